@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of the price extractors of CrawlerSpider.parse over the saved pages of benchmarks/samples.
+
+Every sample is named <mode>_<anything>.html and is parsed with the fast extractor (crawler.extractors.EXTRACTORS)
+and with the XPath one (crawler.extractors.DOM_EXTRACTORS). A new response is built for every call, so the DOM
+extractors pay the full page parse like in a real crawl.
+
+The samples must be real store pages (--save or --save-defaults): the byte search of the fast path costs more the
+further into the page its <script> block is, so the "marker at" column shows where it was found.
+
+Usage (from the repository root):
+    python benchmarks/bench_extractors.py --save-defaults
+    python benchmarks/bench_extractors.py --save gog https://www.gog.com/en/game/the_witcher_3_wild_hunt
+    python benchmarks/bench_extractors.py [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+import requests
+from scrapy.http import HtmlResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawler.extractors import EXTRACTORS, DOM_EXTRACTORS, BATTLE_SCRIPT_MARKER, GOG_SCRIPT_MARKER
+
+samples_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
+DEFAULT_SAMPLES = [
+    ("xbox", "https://www.xbox.com/es-ES/games/store/forza-horizon-5/9NKX70BBCDRN"),
+    ("battle", "https://eu.shop.battle.net/es-es/product/diablo-iv"),
+    ("gog", "https://www.gog.com/en/game/the_witcher_3_wild_hunt")
+]
+MARKERS = {
+    "battle": BATTLE_SCRIPT_MARKER,
+    "gog": GOG_SCRIPT_MARKER
+}
+
+
+def save_sample(mode, url):
+    response = requests.get(url, headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0"})
+    response.raise_for_status()
+    os.makedirs(samples_path, exist_ok=True)
+    file_name = f"{mode}_{url.rstrip('/').split('/')[-1]}.html"
+    with open(os.path.join(samples_path, file_name), "wb") as f:
+        f.write(response.content)
+    print(f"Saved {file_name} ({len(response.content)} bytes)")
+
+
+def time_extractor(extractor, url, body, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        price_in_cents = extractor(HtmlResponse(url=url, body=body, encoding="utf-8"))
+    return (time.perf_counter() - start) / repeat, price_in_cents
+
+
+def get_marker_position(mode, body):
+    """ :return: position of the script marker of the fast path as a share of the page, "-" if it has none """
+    marker = MARKERS.get(mode)
+    position = body.find(marker) if marker else -1
+    return f"{position / len(body):.0%}" if position >= 0 else "-"
+
+
+def run(repeat):
+    file_names = sorted(file_name for file_name in os.listdir(samples_path) if file_name.endswith(".html")) if os.path.isdir(samples_path) else []
+    if not file_names:
+        print("No samples: save real store pages first (--save-defaults or --save MODE URL)")
+        return
+
+    print(f"{'sample':<28}{'bytes':>9}{'marker at':>11}{'fast us':>11}{'dom us':>11}{'speedup':>9}  price (fast/dom)")
+    for file_name in file_names:
+        mode = file_name.split("_")[0]
+        with open(os.path.join(samples_path, file_name), "rb") as f:
+            body = f.read()
+        url = f"https://example.com/{file_name}"
+
+        fast_time, fast_price = time_extractor(EXTRACTORS[mode], url, body, repeat)
+        dom_time, dom_price = time_extractor(DOM_EXTRACTORS[mode], url, body, repeat)
+
+        print(f"{file_name:<28}{len(body):>9}{get_marker_position(mode, body):>11}{fast_time * 1e6:>11.1f}{dom_time * 1e6:>11.1f}"
+              f"{dom_time / fast_time:>8.1f}x  {fast_price}/{dom_price}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Price extractors micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--save", nargs=2, metavar=("MODE", "URL"), help="save a real page as a new sample")
+    parser.add_argument("--save-defaults", action="store_true", help="save one real product page per store")
+    args = parser.parse_args()
+
+    if args.save:
+        save_sample(*args.save)
+    elif args.save_defaults:
+        for mode, url in DEFAULT_SAMPLES:
+            save_sample(mode, url)
+    else:
+        run(args.repeat)
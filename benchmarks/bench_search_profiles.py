@@ -0,0 +1,179 @@
+"""
+Index size, bulk indexing speed and query latency of every search profile of the games index (see
+main.games_search_profiles) on a synthetic catalog.
+
+For every profile a throwaway index (theeasteregg_bench_<profile>) is created with the same settings and mappings as
+post_games_index, the catalog is bulk-indexed, force-merged to one segment and queried with --queries type-ahead
+prefixes and whole words. The completion profile is also queried through its suggester (name.suggest).
+
+Needs a running Elasticsearch (--es-url).
+
+Usage (from the repository root):
+    python benchmarks/bench_search_profiles.py [--catalog 100000] [--queries 2000] [--profiles ngram edge_ngram completion]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from bench_title_matching import random_word, random_title
+
+GENRES = ["Action", "Adventure", "Indie", "RPG", "Strategy", "Simulation", "Casual", "Sports", "Racing", "Puzzle"]
+CATEGORIES = ["Single-player", "Multi-player", "Co-op", "Steam Achievements", "Full controller support",
+              "Steam Cloud", "Steam Trading Cards", "Online PvP", "Remote Play Together", "In-App Purchases"]
+BULK_CHUNK_SIZE = 5000
+
+
+def make_catalog(size, seed):
+    """ :return: games documents with the searchable fields of the games index """
+    rng = random.Random(seed)
+    vocabulary = list({random_word(rng) for _ in range(40000)})
+    companies = [f"{random_word(rng)} {rng.choice(['Games', 'Studios', 'Interactive', 'Entertainment'])}" for _ in range(size // 10 + 1)]
+
+    catalog = []
+    for appid in range(size):
+        catalog.append({
+            "appid": appid,
+            "name": random_title(rng, vocabulary),
+            "data": {
+                "developers": [rng.choice(companies)],
+                "publishers": [rng.choice(companies)],
+                "genres": rng.sample(GENRES, rng.randint(1, 3)),
+                "categories": rng.sample(CATEGORIES, rng.randint(1, 4)),
+                "total_recommendations": int(rng.paretovariate(1.2)) - 1
+            }
+        })
+    return catalog
+
+
+def make_queries(catalog, count, seed):
+    """ :return: type-ahead prefixes (3 to 6 characters of a title) and whole titles, half and half """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        name = rng.choice(catalog)["name"]
+        if rng.random() < 0.5:
+            queries.append(name[:rng.randint(3, 6)].strip())
+        else:
+            queries.append(name)
+    return queries
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def create_index(session, es_url, index, profile):
+    session.delete(f"{es_url}/{index}")
+    body = main.get_games_index_settings()
+    body["mappings"] = main.get_games_mappings(profile)
+    response = session.put(f"{es_url}/{index}", json=body)
+    response.raise_for_status()
+
+
+def index_catalog(session, es_url, index, catalog):
+    """ :return: seconds spent in the bulk requests (and the final refresh) """
+    headers = {"Content-Type": "application/x-ndjson"}
+    lines = []
+    for game in catalog:
+        lines.append(json.dumps({"create": {"_id": game["appid"]}}) + "\n")
+        lines.append(json.dumps(game, ensure_ascii=False) + "\n")
+
+    start = time.perf_counter()
+    for i in range(0, len(lines), BULK_CHUNK_SIZE):
+        response = session.post(f"{es_url}/{index}/_bulk", headers=headers, data="".join(lines[i:i + BULK_CHUNK_SIZE]).encode("utf-8"))
+        response.raise_for_status()
+        if response.json()["errors"]:
+            raise RuntimeError(f"Bulk errors in {index}")
+    session.post(f"{es_url}/{index}/_refresh").raise_for_status()
+    return time.perf_counter() - start
+
+
+def get_index_size(session, es_url, index):
+    session.post(f"{es_url}/{index}/_forcemerge", params={"max_num_segments": 1}).raise_for_status()
+    stats = session.get(f"{es_url}/{index}/_stats/store,docs").json()
+    return stats["indices"][index]["primaries"]["store"]["size_in_bytes"]
+
+
+def run_queries(session, es_url, index, queries, make_body):
+    """ :return: latencies in milliseconds (client side) """
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        response = session.post(f"{es_url}/{index}/_search", json=make_body(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+    return latencies
+
+
+def match_body(query):
+    return {
+        "query": {
+            "multi_match": {
+                "query": query,
+                "fields": ["name^3", "data.developers", "data.publishers"]
+            }
+        },
+        "_source": ["appid", "name"],
+        "size": 10
+    }
+
+
+def suggest_body(query):
+    return {
+        "suggest": {
+            "name": {
+                "prefix": query,
+                "completion": {"field": "name.suggest", "size": 10, "skip_duplicates": True}
+            }
+        },
+        "_source": ["appid", "name"]
+    }
+
+
+def run(es_url, catalog_size, query_count, profiles, keep, seed):
+    session = requests.Session()
+    catalog = make_catalog(catalog_size, seed)
+    queries = make_queries(catalog, query_count, seed)
+    print(f"catalog: {len(catalog)} games, {len(queries)} queries")
+
+    for profile in profiles:
+        index = f"theeasteregg_bench_{profile}"
+        create_index(session, es_url, index, profile)
+        index_time = index_catalog(session, es_url, index, catalog)
+        size = get_index_size(session, es_url, index)
+
+        searches = [("match", match_body)]
+        if main.games_search_profiles[profile]["suggest"]:
+            searches.append(("suggest", suggest_body))
+
+        # Warm up, so the first profile does not pay the cold caches of the others
+        run_queries(session, es_url, index, queries[:100], match_body)
+        print(f"{profile}: {size / 1024 / 1024:.1f} MB, {len(catalog) / index_time:.0f} docs/s")
+        for name, make_body in searches:
+            latencies = run_queries(session, es_url, index, queries, make_body)
+            print(f"    {name}: p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms")
+
+        if not keep:
+            session.delete(f"{es_url}/{index}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Games index search profiles benchmark")
+    parser.add_argument("--es-url", default="http://localhost:9200")
+    parser.add_argument("--catalog", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--profiles", nargs="+", default=list(main.games_search_profiles), choices=list(main.games_search_profiles))
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark indexes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    run(args.es_url, args.catalog, args.queries, args.profiles, args.keep, args.seed)
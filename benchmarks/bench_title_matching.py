@@ -0,0 +1,152 @@
+"""
+Precision, recall and runtime of title_matching.TrigramIndex on a synthetic catalog.
+
+A catalog of --catalog titles is indexed, then --store store titles are matched against it. A share of the store
+titles (--positives) are variants of catalog titles (™/® symbols, platform suffixes, roman numerals, typos,
+punctuation) that must match them. Half of the rest are near misses that must not match: other editions (Deluxe,
+GOTY...) and other numbers (sequels) of catalog titles. The other half are titles that are not in the catalog.
+
+Precision counts every match that is not the expected catalog title (wrong title or false positive).
+
+Usage (from the repository root):
+    python benchmarks/bench_title_matching.py [--catalog 200000] [--store 300000] [--min-score 0.85]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from title_matching import TrigramIndex
+
+CONSONANTS = "bcdfghjklmnprstvwxyz"
+VOWELS = "aeiou"
+ROMAN = {"2": "II", "3": "III", "4": "IV", "5": "V", "6": "VI", "7": "VII", "8": "VIII"}
+PLATFORM_SUFFIXES = [" for Windows 10", " - Standard Edition", " PC Edition", " Windows 10"]
+EDITION_SUFFIXES = [" - Deluxe Edition", " Game of the Year Edition", " GOTY", " - Definitive Edition", " Complete Edition",
+                    " Gold Edition", " Ultimate Edition"]
+
+
+def random_word(rng):
+    syllables = (rng.choice(CONSONANTS) + rng.choice(VOWELS) + rng.choice(["", "", rng.choice(CONSONANTS)])
+                 for _ in range(rng.randint(1, 4)))
+    return "".join(syllables).capitalize()
+
+
+def random_title(rng, vocabulary):
+    title = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4)))
+    if rng.random() < 0.2:
+        title += f" {rng.randint(2, 8)}"
+    if rng.random() < 0.1:
+        title += ": " + " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 3)))
+    return title
+
+
+def make_variant(rng, title):
+    variant = title
+    changes = rng.sample(["symbol", "suffix", "roman", "typo", "punctuation"], rng.randint(1, 2))
+    if "symbol" in changes:
+        words = variant.split(" ")
+        words[0] += rng.choice(["™", "®"])
+        variant = " ".join(words)
+    if "suffix" in changes:
+        variant += rng.choice(PLATFORM_SUFFIXES)
+    if "roman" in changes:
+        variant = " ".join(ROMAN.get(word, word) for word in variant.split(" "))
+    if "typo" in changes and len(variant) > 8:
+        position = rng.randint(1, len(variant) - 2)
+        variant = variant[:position] + variant[position + 1:]
+    if "punctuation" in changes:
+        variant = variant.replace(" ", " - ", 1)
+    return variant
+
+
+def make_near_miss(rng, title):
+    """ :return: another product with a similar title: another edition, or another number (sequel) """
+    if rng.random() < 0.5:
+        return title + rng.choice(EDITION_SUFFIXES)
+    words = title.split(" ")
+    numbers = [i for i, word in enumerate(words) if word.isdigit()]
+    if numbers:
+        position = rng.choice(numbers)
+        words[position] = str(int(words[position]) + rng.choice([-1, 1, 2]))
+    else:
+        words.append(rng.choice(["2", "II", "3", "III"]))
+    return " ".join(words)
+
+
+def run(catalog_size, store_size, positives, min_score, seed):
+    rng = random.Random(seed)
+    vocabulary = list({random_word(rng) for _ in range(40000)})
+
+    catalog = {}
+    while len(catalog) < catalog_size:
+        title = random_title(rng, vocabulary)
+        catalog.setdefault(title, len(catalog))
+    catalog_titles = list(catalog)
+
+    store = []
+    for _ in range(int(store_size * positives)):
+        title = rng.choice(catalog_titles)
+        store.append((make_variant(rng, title), catalog[title]))
+    near_misses = (store_size - len(store)) // 2
+    while near_misses:
+        title = make_near_miss(rng, rng.choice(catalog_titles))
+        if title not in catalog:
+            store.append((title, "near miss"))
+            near_misses -= 1
+    while len(store) < store_size:
+        title = random_title(rng, vocabulary)
+        if title not in catalog:
+            store.append((title, None))
+    rng.shuffle(store)
+
+    start = time.perf_counter()
+    index = TrigramIndex()
+    for title, appid in catalog.items():
+        index.add(title, appid)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact = fuzzy = correct = wrong = false_positive = near_miss = 0
+    for title, expected in store:
+        value, score = index.query(title, min_score)
+        if value is None:
+            continue
+        if score == 1.0:
+            exact += 1
+        else:
+            fuzzy += 1
+        if expected is None:
+            false_positive += 1
+        elif expected == "near miss":
+            near_miss += 1
+        elif value == expected:
+            correct += 1
+        else:
+            wrong += 1
+    query_time = time.perf_counter() - start
+
+    positives_count = sum(1 for _, expected in store if isinstance(expected, int))
+    near_misses_count = sum(1 for _, expected in store if expected == "near miss")
+    matches = correct + wrong + false_positive + near_miss
+    print(f"catalog: {len(catalog)} titles, store: {len(store)} titles ({positives_count} variants of catalog titles, "
+          f"{near_misses_count} other editions or sequels)")
+    print(f"build: {build_time:.1f}s, {len(index.blocks)} blocking keys")
+    print(f"match: {query_time:.1f}s ({query_time / len(store) * 1e6:.0f} us/title), {exact} exact, {fuzzy} fuzzy")
+    print(f"precision: {correct / matches if matches else 1:.4f}, recall: {correct / positives_count:.3f}")
+    print(f"wrong title: {wrong}, other edition or sequel: {near_miss}, not in catalog: {false_positive}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fuzzy title matching benchmark")
+    parser.add_argument("--catalog", type=int, default=200000)
+    parser.add_argument("--store", type=int, default=300000)
+    parser.add_argument("--positives", type=float, default=0.4, help="share of store titles taken from the catalog")
+    parser.add_argument("--min-score", type=float, default=0.85)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    run(args.catalog, args.store, args.positives, args.min_score, args.seed)
@@ -0,0 +1,82 @@
+# Define here the extensions of the crawler
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from main import logger
+
+
+class StoreAutoThrottle:
+    """
+    Latency-adaptive throttling with one profile per store domain (see STORE_THROTTLE_PROFILES).
+
+    Every response adjusts the delay and concurrency of its download slot:
+    - 429 or 5xx: back off (delay * STORE_THROTTLE_BACKOFF, honouring Retry-After, and half the concurrency).
+    - Healthy and faster than target_latency: speed up (delay * STORE_THROTTLE_SPEEDUP, one more concurrent request
+      up to the profile concurrency).
+    - Healthy but slower than target_latency: slow down (delay * STORE_THROTTLE_SLOWDOWN).
+    The delay always stays between min_delay and max_delay of the profile.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.profiles = crawler.settings.getdict("STORE_THROTTLE_PROFILES")
+        if not crawler.settings.getbool("STORE_THROTTLE_ENABLED") or not self.profiles:
+            raise NotConfigured
+
+        self.speedup = crawler.settings.getfloat("STORE_THROTTLE_SPEEDUP", 0.8)
+        self.slowdown = crawler.settings.getfloat("STORE_THROTTLE_SLOWDOWN", 1.25)
+        self.backoff = crawler.settings.getfloat("STORE_THROTTLE_BACKOFF", 2.0)
+        crawler.signals.connect(self.response_downloaded, signal=signals.response_downloaded)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def response_downloaded(self, response, request, spider):
+        key = request.meta.get("download_slot")
+        latency = request.meta.get("download_latency")
+        if key not in self.profiles or latency is None:
+            return
+
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+
+        profile = self.profiles[key]
+        old_delay = slot.delay
+        old_concurrency = slot.concurrency
+
+        if response.status == 429 or response.status >= 500:
+            decision = "back off"
+            new_delay = max(slot.delay * self.backoff, profile["min_delay"], get_retry_after(response))
+            new_concurrency = max(1, slot.concurrency // 2)
+        elif response.status >= 400:
+            return
+        elif latency <= profile["target_latency"]:
+            decision = "speed up"
+            new_delay = slot.delay * self.speedup
+            new_concurrency = min(profile["concurrency"], slot.concurrency + 1)
+        else:
+            decision = "slow down"
+            new_delay = slot.delay * self.slowdown
+            new_concurrency = slot.concurrency
+
+        slot.delay = min(max(new_delay, profile["min_delay"]), profile["max_delay"])
+        slot.concurrency = new_concurrency
+
+        if slot.delay != old_delay or slot.concurrency != old_concurrency:
+            logger('INFO', f'Throttle {key}: {decision} (status={response.status}, latency={latency:.2f}s) '
+                           f'delay {old_delay:.2f}s -> {slot.delay:.2f}s, '
+                           f'concurrency {old_concurrency} -> {slot.concurrency}')
+
+
+def get_retry_after(response):
+    retry_after = response.headers.get("Retry-After")
+    try:
+        return float(retry_after) if retry_after else 0
+    except ValueError:
+        return 0
@@ -0,0 +1,144 @@
+# Price extractors used by CrawlerSpider.parse
+#
+# Battle.net and gog.com only need one <script> block of the page, so their fast extractors find it with plain byte
+# searches over response.body instead of building the whole DOM. If the block cannot be located that way, they fall
+# back to the XPath extractors, which are also what benchmarks/bench_extractors.py compares against.
+
+import json
+import re
+
+BATTLE_SCRIPT_MARKER = b'class="structured-product-data"'
+GOG_SCRIPT_MARKER = b'type="application/ld+json"'
+
+
+def find_script_block(body, marker):
+    """
+    Returns the content of the first <script> whose opening tag contains marker, or None.
+    :param body: raw page bytes
+    :param marker: bytes that appear inside the opening tag, e.g. b'type="application/ld+json"'
+    :return: bytes
+    """
+    position = body.find(marker)
+    while position != -1:
+        tag_start = body.rfind(b'<script', 0, position)
+        tag_end = body.find(b'>', position)
+        if tag_start != -1 and tag_end != -1 and body.rfind(b'>', tag_start, position) == -1:
+            content_end = body.find(b'</script>', tag_end)
+            if content_end != -1:
+                return body[tag_end + 1:content_end]
+        position = body.find(marker, position + len(marker))
+    return None
+
+
+def iter_values(data, key):
+    """
+    Yields every value stored under key in a nested JSON structure, walking it with a stack instead of building
+    intermediate lists.
+    """
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for node_key, value in node.items():
+                if node_key == key:
+                    yield value
+                elif isinstance(value, (dict, list)):
+                    stack.append(value)
+        elif isinstance(node, list):
+            for item in node:
+                if isinstance(item, (dict, list)):
+                    stack.append(item)
+
+
+def get_xbox_price(price_span):
+    price_span = price_span.lower().strip()
+
+    if "gratis" in price_span:
+        return 0
+
+    # Formatos "9,99 €", "9,99€", "9,99€+"
+    match = re.search(r"(\d+),(\d{2})\s*€\+?", price_span)
+    if match:
+        euros = int(match.group(1))
+        cents = int(match.group(2))
+        return euros * 100 + cents
+
+    return None
+
+
+def get_battle_price(data):
+    """ Lowest 'price' of the structured product data, in cents """
+    price_in_cents = None
+    for price in iter_values(data, "price"):
+        cents = int(float(price) * 100)
+        if price_in_cents is None or cents < price_in_cents:
+            price_in_cents = cents
+    return price_in_cents
+
+
+def get_gog_price(data):
+    """ Price of the ES/EUR offer of the JSON-LD product data, in cents """
+    offers = data.get("offers", [])
+    if isinstance(offers, list):
+        for offer in offers:
+            if offer.get("areaServed") == "ES" and offer.get("priceCurrency") == "EUR":
+                return int(float(offer.get("price")) * 100)
+    return None
+
+
+def extract_xbox_price(response):
+    price_span = response.css("div.ProductDetailsHeader-module__price___-NaHV span.Price-module__boldText___1i2Li::text").get()
+
+    if price_span:
+        return get_xbox_price(price_span)
+
+    game_pass_label = response.css("div.ProductLogos-module__gamePassLogo___UxbvF svg::attr(aria-label)").get()
+    if game_pass_label and "incluido con game pass" in game_pass_label.lower().strip():
+        return -2
+
+    return None
+
+
+def extract_battle_price_dom(response):
+    game_content = response.xpath('//script[@class="structured-product-data"]/text()').get()
+    if game_content:
+        return get_battle_price(json.loads(game_content))
+    return None
+
+
+def extract_gog_price_dom(response):
+    json_ld_script = response.xpath('//script[@type="application/ld+json"]/text()').get()
+    if json_ld_script:
+        return get_gog_price(json.loads(json_ld_script))
+    return None
+
+
+def extract_script_price(response, marker, get_price, fallback):
+    block = find_script_block(response.body, marker)
+    if block is None:
+        return fallback(response)
+    if not block.strip():
+        return None
+    return get_price(json.loads(block))
+
+
+def extract_battle_price(response):
+    return extract_script_price(response, BATTLE_SCRIPT_MARKER, get_battle_price, extract_battle_price_dom)
+
+
+def extract_gog_price(response):
+    return extract_script_price(response, GOG_SCRIPT_MARKER, get_gog_price, extract_gog_price_dom)
+
+
+# Extractors by crawler mode. Each one takes a response and returns the price in cents (or None)
+EXTRACTORS = {
+    "xbox": extract_xbox_price,
+    "battle": extract_battle_price,
+    "gog": extract_gog_price
+}
+
+DOM_EXTRACTORS = {
+    "xbox": extract_xbox_price,
+    "battle": extract_battle_price_dom,
+    "gog": extract_gog_price_dom
+}
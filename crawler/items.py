@@ -7,6 +7,9 @@ import scrapy
 
 
 class CrawlerItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # Crawled price of one store coincidence
+    store = scrapy.Field()
+    url_name = scrapy.Field()
+    url = scrapy.Field()
+    price_in_cents = scrapy.Field()
+    price_time = scrapy.Field()
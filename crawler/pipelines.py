@@ -3,11 +3,37 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import json
+import os
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from main import logger, parent_path
+
+
+class CrawlerPipeline:
+    """
+    Appends every crawled price to json_data/temp/<store>_prices.ndjson as soon as it is scraped, so a killed
+    crawl keeps every price it got. Lines are flushed one by one and synced to disk every FSYNC_EVERY items.
+    """
+    FSYNC_EVERY = 100
+
+    def open_spider(self, spider):
+        self.file_path = os.path.join(parent_path, "json_data", "temp", f"{spider.mode}_prices.ndjson")
+        self.file = open(self.file_path, "a", encoding="utf-8")
+        self.count = 0
+
+    def close_spider(self, spider):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        logger('INFO', f'Stored {self.count} crawled prices in {self.file_path}')
 
-class ScrapyfilmsPipeline:
     def process_item(self, item, spider):
+        self.file.write(json.dumps(ItemAdapter(item).asdict()) + "\n")
+        self.file.flush()
+        self.count += 1
+        if self.count % self.FSYNC_EVERY == 0:
+            os.fsync(self.file.fileno())
         return item
@@ -21,7 +21,8 @@ USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/1
 ROBOTSTXT_OBEY = True
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-CONCURRENT_REQUESTS = 1
+# Per store limits are set by STORE_THROTTLE_PROFILES below
+CONCURRENT_REQUESTS = 16
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -57,15 +58,15 @@ CONCURRENT_REQUESTS = 1
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "crawler.extensions.StoreAutoThrottle": 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "crawler.pipelines.CrawlerPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "crawler.pipelines.CrawlerPipeline": 300,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -98,4 +99,42 @@ DUPEFILTER_CLASS = 'crawler.dupefilters.MyRFPDupeFilter'
 CLOSESPIDER_ITEMCOUNT = 0
 
 # Configura el retraso entre las solicitudes (en segundos)
-DOWNLOAD_DELAY = 3
\ No newline at end of file
+# Solo para dominios sin perfil en STORE_THROTTLE_PROFILES
+DOWNLOAD_DELAY = 3
+
+# Per store throttle profiles, keyed by download slot (domain):
+#   concurrency: max concurrent requests to the domain
+#   target_latency: responses faster than this (seconds) let the crawler speed up
+#   start_delay, min_delay, max_delay: delay between requests to the domain (seconds)
+STORE_THROTTLE_ENABLED = True
+STORE_THROTTLE_PROFILES = {
+    "www.xbox.com": {
+        "concurrency": 4,
+        "target_latency": 1.0,
+        "start_delay": 1.0,
+        "min_delay": 0.25,
+        "max_delay": 30
+    },
+    "eu.shop.battle.net": {
+        "concurrency": 2,
+        "target_latency": 1.5,
+        "start_delay": 2.0,
+        "min_delay": 0.5,
+        "max_delay": 30
+    },
+    "www.gog.com": {
+        "concurrency": 4,
+        "target_latency": 1.0,
+        "start_delay": 1.0,
+        "min_delay": 0.25,
+        "max_delay": 30
+    }
+}
+STORE_THROTTLE_SPEEDUP = 0.8
+STORE_THROTTLE_SLOWDOWN = 1.25
+STORE_THROTTLE_BACKOFF = 2.0
+
+DOWNLOAD_SLOTS = {
+    domain: {"concurrency": profile["concurrency"], "delay": profile["start_delay"]}
+    for domain, profile in STORE_THROTTLE_PROFILES.items()
+}
\ No newline at end of file
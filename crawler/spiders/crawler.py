@@ -1,10 +1,11 @@
 import json
 import os.path
-import re
 import traceback
 
 from scrapy.spiders import Spider
-from main import logger, get_time
+from crawler.extractors import EXTRACTORS
+from crawler.items import CrawlerItem
+from main import logger, get_time, read_ndjson
 
 parent_path = './' # Default
 #parent_path = '/home/raspy/Desktop/theEasterEgg_scraper' # Crontab
@@ -24,45 +25,6 @@ def read_json(filename):
         logger(f'ERROR', f'Cannot read file {filename}')
         return []
 
-def write_json(filename, data):
-    with open(os.path.join(parent_path, "json_data", filename), "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
-
-def get_xbox_price(price_span):
-    price_span = price_span.lower().strip()
-
-    if "gratis" in price_span:
-        return 0
-
-    # Formatos "9,99 €", "9,99€", "9,99€+"
-    match = re.search(r"(\d+),(\d{2})\s*€\+?", price_span)
-    if match:
-        euros = int(match.group(1))
-        cents = int(match.group(2))
-        return euros * 100 + cents
-
-    return None
-
-def get_battle_prices(self, data):
-    """ Función recursiva para extraer todas las claves 'price' de un JSON anidado """
-    prices = []
-
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if key == "price":
-                prices.append(value)
-            else:
-                prices.extend(get_battle_prices(self, value))
-
-    elif isinstance(data, list):
-        for item in data:
-            prices.extend(get_battle_prices(self, item))
-
-    return prices
-
-def battle_prices_list_string_to_list_int(prices):
-    return [int(float(price) * 100) for price in prices]
-
 class CrawlerSpider(Spider):
     name = "no-scraper"
     allowed_domains = [
@@ -74,28 +36,38 @@ class CrawlerSpider(Spider):
     def __init__(self, mode, *args, **kwargs):
         super().__init__(*args, **kwargs)
         urls = []
+        coincidences = []
+        self.url_names = {}
         match mode:
             case "xbox":
                 coincidences = read_json(os.path.join("temp", "xbox_coincidences.json"))
                 for coincidence in coincidences:
                     urls.append(coincidence["url"])
-                self.coincidences_dict = {coincidence["url_name"]: coincidence for coincidence in coincidences}
+                self.url_names = {coincidence.get("store_url_name", coincidence["url_name"]): coincidence["url_name"] for coincidence in coincidences}
 
             case "battle":
                 coincidences = read_json(os.path.join("temp", "battle_coincidences.json"))
                 for coincidence in coincidences:
                     urls.append(coincidence["url"])
-                self.coincidences_dict = {coincidence["url_name"]: coincidence for coincidence in coincidences}
+                self.url_names = {coincidence.get("store_url_name", coincidence["url_name"]): coincidence["url_name"] for coincidence in coincidences}
 
             case "gog":
                 coincidences = read_json(os.path.join("temp", "gog_coincidences.json"))
                 for coincidence in coincidences:
                     urls.append(coincidence["url"])
-                self.coincidences_dict = {coincidence["url_name"]: coincidence for coincidence in coincidences}
+                self.url_names = {coincidence.get("store_url_name", coincidence["url_name"]): coincidence["url_name"] for coincidence in coincidences}
 
             case _:
                 logger('ERROR', 'Crawler mode not recognized')
 
+        # Coincidences already in the prices store (batched sources, or an interrupted crawl with main.crawl_resume)
+        # are not crawled again
+        stored = {result["url_name"] for result in read_ndjson(os.path.join("temp", f"{mode}_prices.ndjson"))}
+        if stored:
+            pending = [url for url, coincidence in zip(urls, coincidences) if coincidence["url_name"] not in stored]
+            logger('INFO', f'Crawler {mode}: skipping {len(urls) - len(pending)} coincidences already priced')
+            urls = pending
+
         self.start_urls = urls
         self.mode = mode
 
@@ -103,93 +75,32 @@ class CrawlerSpider(Spider):
         try:
             match self.mode:
                 case "xbox":
-                    try:
-                        price_span = response.css("div.ProductDetailsHeader-module__price___-NaHV span.Price-module__boldText___1i2Li::text").get()
-
-                        if price_span:
-                            current_price_in_cents = get_xbox_price(price_span)
-                        else:
-                            game_pass_label = response.css("div.ProductLogos-module__gamePassLogo___UxbvF svg::attr(aria-label)").get()
-                            if game_pass_label and "incluido con game pass" in game_pass_label.lower().strip():
-                                current_price_in_cents = -2
-                            else:
-                                current_price_in_cents = None
-
-                        current_url_name = response.url.split("store/")[1].split("/")[0]
-                        if current_url_name in self.coincidences_dict:
-                            self.coincidences_dict[current_url_name]["price_in_cents"] = current_price_in_cents
-                            self.coincidences_dict[current_url_name]["url"] = response.url
-                            self.coincidences_dict[current_url_name]["price_time"] = get_time()
-
-                    except:
-                        logger('ERROR', traceback.format_exc())
+                    current_url_name = response.url.split("store/")[1].split("/")[0]
 
                 case "battle":
-                    try:
-                        game_content = response.xpath('//script[@class="structured-product-data"]/text()').get()
-
-                        if game_content:
-                            data = json.loads(game_content)
-                            prices_string = get_battle_prices(self, data)
-                            prices_int = battle_prices_list_string_to_list_int(prices_string)
-                            current_price_in_cents = min(prices_int)
-                        else:
-                            current_price_in_cents = None
-
-                        current_url_name = response.url.split("product/")[1]
-                        if current_url_name in self.coincidences_dict:
-                            self.coincidences_dict[current_url_name]["price_in_cents"] = current_price_in_cents
-                            self.coincidences_dict[current_url_name]["url"] = response.url
-                            self.coincidences_dict[current_url_name]["price_time"] = get_time()
-
-                    except:
-                        logger('ERROR', traceback.format_exc())
+                    current_url_name = response.url.split("product/")[1]
 
                 case "gog":
-                    try:
-                        if response.url != 'https://www.gog.com/en/games':
-                            price_in_cents = None
-                            json_ld_script = response.xpath('//script[@type="application/ld+json"]/text()').get()
-                            if json_ld_script:
-                                data = json.loads(json_ld_script)
-                                offers = data.get("offers", [])
-
-                                if isinstance(offers, list):
-                                    for offer in offers:
-                                        if offer.get("areaServed") == "ES" and offer.get("priceCurrency") == "EUR":
-                                            price_in_cents = int(float(offer.get("price")) * 100)
-                                            break
-
-                            current_url_name = response.url.split("game/")[1].replace("_", "-")
-                            if current_url_name in self.coincidences_dict:
-                                self.coincidences_dict[current_url_name]["price_in_cents"] = price_in_cents
-                                self.coincidences_dict[current_url_name]["url"] = response.url
-                                self.coincidences_dict[current_url_name]["price_time"] = get_time()
-
-                    except:
-                        logger('ERROR', traceback.format_exc())
+                    if response.url == 'https://www.gog.com/en/games':
+                        return
+                    current_url_name = response.url.split("game/")[1].replace("_", "-")
 
                 case _:
                     logger('ERROR', 'Crawler mode not recognized')
+                    return
+
+            # Store url_name -> url_name of the games catalog
+            if current_url_name in self.url_names:
+                yield CrawlerItem(
+                    store=self.mode,
+                    url_name=self.url_names[current_url_name],
+                    url=response.url,
+                    price_in_cents=EXTRACTORS[self.mode](response),
+                    price_time=get_time()
+                )
         except:
             logger('ERROR', traceback.format_exc())
 
     def closed(self, reason):
-        match self.mode:
-            case "xbox":
-                logger('INFO', "Started updating JSON file 'xbox_coincidences.json'")
-                write_json(os.path.join("temp", "xbox_coincidences.json"), list(self.coincidences_dict.values()))
-                logger('INFO', "Ended updating JSON file 'xbox_coincidences.json'")
-
-            case "battle":
-                logger('INFO', "Started updating JSON file 'battle_coincidences.json'")
-                write_json(os.path.join("temp", "battle_coincidences.json"), list(self.coincidences_dict.values()))
-                logger('INFO', "Ended updating JSON file 'battle_coincidences.json'")
-
-            case "gog":
-                logger('INFO', "Started updating JSON file 'gog_coincidences.json'")
-                write_json(os.path.join("temp", "gog_coincidences.json"), list(self.coincidences_dict.values()))
-                logger('INFO', "Ended updating JSON file 'gog_coincidences.json'")
-
-            case _:
-                logger('ERROR', 'Crawler mode not recognized')
\ No newline at end of file
+        # Prices are already on disk, see crawler.pipelines.CrawlerPipeline
+        logger('INFO', f"Crawler '{self.mode}' closed: {reason}")
@@ -0,0 +1,106 @@
+"""
+Long-running alternative to the crontab runs of pipeline.py.
+
+The process stays alive between runs, so the imports, the url names and fuzzy title indexes (see
+main.load_url_names_index) and the HTTP connections (main.get_http_session) are only paid once. Every job of DAEMON_JOBS
+has its own interval; the jobs that are due at the same time run as a single pipeline run, so the export and index
+stages downstream of them (the ES sync) run once per batch of changes and only for the files that changed.
+
+Jobs take the same lock as pipeline.py, so a cron run and the daemon never overlap: a job that finds the lock taken
+waits for the next tick.
+
+Usage (from the repository root):
+    python daemon.py
+"""
+import os
+import signal
+import time
+import traceback
+
+import main
+import pipeline
+from main import logger, get_time, read_json, write_json
+
+# Jobs: pipeline targets (see pipeline.select_stages), interval in seconds and, for store_prices, the stores
+DAEMON_JOBS = {
+    "steam_prices": {"targets": ["steam_prices"], "interval": 60 * 60},
+    "steam_details": {"targets": ["steam"], "interval": 24 * 60 * 60},
+    "store_prices": {"targets": ["store_prices"], "interval": 12 * 60 * 60, "stores": ("epic", "xbox", "battle", "gog")},
+}
+daemon_tick = 60
+daemon_state_filename = os.path.join("temp", "daemon_state.json")
+daemon_running = True
+
+
+def stop(signum, frame):
+    global daemon_running
+    logger('INFO', f'Daemon: signal {signum} received, stopping after the current run')
+    daemon_running = False
+
+def install_signal_handlers():
+    # Scrapy replaces them while it crawls, so they are installed again after every run
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+def get_due_jobs(last_runs):
+    """
+    :param last_runs: {job: unix time of its last run}
+    :return: jobs whose interval has passed, in DAEMON_JOBS order
+    """
+    now = get_time()
+    return [name for name, job in DAEMON_JOBS.items() if now - last_runs.get(name, 0) >= job["interval"]]
+
+def run_jobs(names):
+    """
+    Runs the given jobs as one pipeline run.
+    :param names: job names
+    :return: True if they ran, False if another run holds the lock
+    """
+    lock_file = pipeline.acquire_lock()
+    if lock_file is None:
+        logger('INFO', f'Daemon: another run is in progress, delaying {", ".join(names)}')
+        return False
+
+    try:
+        targets = []
+        stores = []
+        for name in names:
+            targets.extend(DAEMON_JOBS[name]["targets"])
+            stores.extend(store for store in DAEMON_JOBS[name].get("stores", ()) if store not in stores)
+        if stores:
+            pipeline.store_prices_stores = tuple(stores)
+
+        logger('INFO', f'Daemon: running {", ".join(names)}')
+        pipeline.run_pipeline(targets)
+    except:
+        logger('ERROR', traceback.format_exc())
+    finally:
+        pipeline.release_lock(lock_file)
+    return True
+
+def run():
+    install_signal_handlers()
+    main.initialize()
+    last_runs = read_json(daemon_state_filename) or {}
+    schedule = ", ".join(f'{name} every {job["interval"]}s' for name, job in DAEMON_JOBS.items())
+    logger('INFO', f'Daemon started: {schedule}')
+
+    while daemon_running:
+        due_jobs = get_due_jobs(last_runs)
+        if due_jobs and run_jobs(due_jobs):
+            for name in due_jobs:
+                last_runs[name] = get_time()
+            write_json(daemon_state_filename, last_runs)
+            install_signal_handlers()
+
+        # Short sleeps, so a stop signal does not wait for the whole tick
+        for _ in range(daemon_tick):
+            if not daemon_running:
+                break
+            time.sleep(1)
+
+    logger('INFO', 'Daemon stopped')
+
+
+if __name__ == '__main__':
+    run()
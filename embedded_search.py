@@ -0,0 +1,367 @@
+"""
+Embedded search over the games catalog, for small deployments (e.g. a Raspberry Pi) that do not run Elasticsearch.
+
+build() turns the games search documents into an inverted index analyzed like the games index (see
+main.get_games_index_settings): the replace_specials char filter, the standard (or whitespace) tokenizer, lowercase,
+asciifolding, the roman numerals synonyms and the n-gram filter of the search profile. The analyzers are read from the
+ES settings and stored in the file, so both engines always split text the same way. Queries are scored like a
+best_fields multi_match query: BM25 on name (boosted), developers and publishers, best field per game.
+
+The standard tokenizer is approximated with a regex (words, with inner apostrophes and dots), and only single word
+synonyms are applied.
+
+The index is a single binary file (json_data/games_search.bin), laid out like the prices history (see price_history.py):
+    b"GSIX" | uint32 header length | JSON header | columns
+Every field has its sorted terms (fixed-width bytes, binary searched), the start of the postings of every term, the
+postings (game, term frequency) and the length of the field in every game. The search documents are stored as JSON
+after them. The columns are memory-mapped, so the server starts in well under a second and only reads the postings of
+the queried terms.
+
+Usage (from the repository root):
+    python embedded_search.py [--port 9201] [--file json_data/games_search.bin]
+    curl "http://localhost:9201/search?q=witcher&size=10"
+    curl "http://localhost:9201/games/292030"
+"""
+import argparse
+import array
+import json
+import math
+import os
+import re
+import struct
+import time
+import unicodedata
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+MAGIC = b"GSIX"
+VERSION = 1
+ALIGNMENT = 64
+# Searched fields (path in the search document) and their boosts
+FIELDS = {"name": 3.0, "data.developers": 1.0, "data.publishers": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+STANDARD_TOKEN = re.compile(r"[^\W_]+(?:['.][^\W_]+)*")
+
+
+def align(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def get_analyzer_config(analysis, name):
+    """
+    :param analysis: "analysis" settings of an ES index
+    :param name: analyzer name
+    :return: {"char_mappings", "tokenizer", "filters"} of the analyzer, with the settings of its filters
+    """
+    analyzer = analysis["analyzer"][name]
+    char_mappings = {}
+    for char_filter in analyzer.get("char_filter", []):
+        for rule in analysis["char_filter"][char_filter]["mappings"]:
+            key, value = rule.split("=>")
+            char_mappings[key.strip()] = value.strip()
+    # Built-in filters (lowercase, asciifolding) are only referenced by name
+    filters = [analysis.get("filter", {}).get(filter_name, {"type": filter_name}) for filter_name in analyzer.get("filter", [])]
+    return {"char_mappings": char_mappings, "tokenizer": analyzer["tokenizer"], "filters": filters}
+
+
+def fold_ascii(token):
+    return unicodedata.normalize("NFKD", token).encode("ascii", "ignore").decode("ascii") or token
+
+
+class Analyzer:
+    """ Python version of an ES custom analyzer (see get_analyzer_config) """
+
+    def __init__(self, config):
+        self.char_mappings = config["char_mappings"]
+        keys = sorted(self.char_mappings, key=len, reverse=True)
+        self.char_pattern = re.compile("|".join(re.escape(key) for key in keys)) if keys else None
+        self.tokenizer = config["tokenizer"]
+        self.filters = []
+        for settings in config["filters"]:
+            if settings["type"] == "synonym":
+                synonyms = {}
+                for rule in settings["synonyms"]:
+                    if "=>" in rule:
+                        sources, target = rule.split("=>")
+                        for source in sources.split(","):
+                            synonyms[source.strip()] = target.strip()
+                self.filters.append(("synonym", synonyms))
+            else:
+                self.filters.append((settings["type"], settings))
+
+    def analyze(self, text):
+        """ :return: tokens of a text """
+        if self.char_pattern:
+            text = self.char_pattern.sub(lambda match: self.char_mappings[match.group(0)], text)
+        tokens = text.split() if self.tokenizer == "whitespace" else STANDARD_TOKEN.findall(text)
+
+        for kind, settings in self.filters:
+            if kind == "lowercase":
+                tokens = [token.lower() for token in tokens]
+            elif kind == "asciifolding":
+                tokens = [fold_ascii(token) for token in tokens]
+            elif kind == "synonym":
+                tokens = [settings.get(token, token) for token in tokens]
+            elif kind == "ngram":
+                tokens = [token[i:i + size] for token in tokens for i in range(len(token))
+                          for size in range(settings["min_gram"], settings["max_gram"] + 1) if i + size <= len(token)]
+            elif kind == "edge_ngram":
+                tokens = [token[:size] for token in tokens
+                          for size in range(settings["min_gram"], min(settings["max_gram"], len(token)) + 1)]
+        return tokens
+
+
+def get_field_text(document, path):
+    """ :return: text of a field of a search document (lists are joined) """
+    value = document
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    if isinstance(value, list):
+        return " ".join(str(item) for item in value if item)
+    return str(value) if value else ""
+
+
+def write_columns(file_path, header, columns):
+    """ Writes the binary file (to a temporary file first, then replaces it, so a running server keeps its mapping) """
+    header["columns"] = []
+    offset = 0
+    for name, column in columns.items():
+        header["columns"].append({"name": name, "dtype": column.dtype.str, "shape": list(column.shape), "offset": offset})
+        offset += align(column.nbytes)
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = align(len(MAGIC) + 4 + len(header_bytes))
+
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+        for column, column_header in zip(columns.values(), header["columns"]):
+            f.seek(data_start + column_header["offset"])
+            f.write(np.ascontiguousarray(column).tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+def build(file_path, documents, analysis, index_analyzer, search_analyzer):
+    """
+    :param file_path: output file
+    :param documents: games search documents (iterable)
+    :param analysis: "analysis" settings of the games index
+    :param index_analyzer: analyzer of the documents
+    :param search_analyzer: analyzer of the queries
+    :return: number of documents
+    """
+    analyzer = Analyzer(get_analyzer_config(analysis, index_analyzer))
+    appids = []
+    sources = []
+    terms = {field: {} for field in FIELDS}
+    # Term ids, docs and frequencies, as compact arrays (millions of postings for a full catalog)
+    postings = {field: (array.array("i"), array.array("i"), array.array("i")) for field in FIELDS}
+    lengths = {field: [] for field in FIELDS}
+
+    for doc, document in enumerate(documents):
+        appids.append(document["appid"])
+        sources.append(json.dumps(document, ensure_ascii=False).encode("utf-8"))
+        for field in FIELDS:
+            tokens = analyzer.analyze(get_field_text(document, field))
+            lengths[field].append(len(tokens))
+            field_terms = terms[field]
+            term_ids, docs, frequencies = postings[field]
+            for term, frequency in Counter(tokens).items():
+                term_ids.append(field_terms.setdefault(term, len(field_terms)))
+                docs.append(doc)
+                frequencies.append(frequency)
+
+    columns = {"appids": np.array(appids, dtype=np.int64)}
+    header = {"version": VERSION, "docs": len(appids), "fields": FIELDS,
+              "index_analyzer": get_analyzer_config(analysis, index_analyzer),
+              "search_analyzer": get_analyzer_config(analysis, search_analyzer), "average_lengths": {}}
+    for field in FIELDS:
+        # Terms sorted as bytes (like np.searchsorted compares them), postings grouped by term and sorted by game
+        encoded = [term.encode("utf-8") for term in terms[field]]
+        term_bytes = np.array(encoded or [b""], dtype=f"S{max([len(term) for term in encoded] or [1])}")[:len(encoded)]
+        order = np.argsort(term_bytes, kind="stable")
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        term_ids, docs, frequencies = (np.frombuffer(values, dtype=np.int32).astype(np.int64) for values in postings[field])
+        term_ranks = rank[term_ids] if len(term_ids) else term_ids
+        postings_order = np.lexsort((docs, term_ranks))
+        starts = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ranks, minlength=len(order)), out=starts[1:])
+
+        columns[f"{field}_terms"] = term_bytes[order]
+        columns[f"{field}_starts"] = starts
+        columns[f"{field}_docs"] = docs[postings_order].astype(np.int32)
+        columns[f"{field}_frequencies"] = np.minimum(frequencies[postings_order], np.iinfo(np.uint16).max).astype(np.uint16)
+        columns[f"{field}_lengths"] = np.array(lengths[field], dtype=np.int32)
+        header["average_lengths"][field] = float(np.mean(lengths[field])) if lengths[field] else 0.0
+
+    offsets = np.zeros(len(sources) + 1, dtype=np.int64)
+    np.cumsum([len(source) for source in sources], out=offsets[1:])
+    columns["source_offsets"] = offsets
+    columns["sources"] = np.frombuffer(b"".join(sources), dtype=np.uint8)
+
+    write_columns(file_path, header, columns)
+    return len(appids)
+
+
+class GamesSearch:
+    """ Memory-mapped games search file written by build() """
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as f:
+            if f.read(4) != MAGIC:
+                raise ValueError(f"{file_path} is not a games search file")
+            header_length = struct.unpack("<I", f.read(4))[0]
+            self.header = json.loads(f.read(header_length))
+        data_start = align(len(MAGIC) + 4 + header_length)
+
+        self.columns = {}
+        for column_header in self.header["columns"]:
+            dtype = np.dtype(column_header["dtype"])
+            shape = tuple(column_header["shape"])
+            if shape[0] > 0:
+                column = np.memmap(file_path, dtype=dtype, mode="r", offset=data_start + column_header["offset"], shape=shape)
+            else:
+                column = np.zeros(shape, dtype=dtype)
+            self.columns[column_header["name"]] = column
+
+        self.docs = self.header["docs"]
+        self.analyzer = Analyzer(self.header["search_analyzer"])
+        self.rows = {appid: row for row, appid in enumerate(self.columns["appids"].tolist())}
+
+    def get_source(self, doc):
+        start, end = self.columns["source_offsets"][doc:doc + 2]
+        return json.loads(self.columns["sources"][start:end].tobytes())
+
+    def get(self, appid):
+        """ :return: search document of a game, None if it is not in the index """
+        row = self.rows.get(appid)
+        return None if row is None else self.get_source(row)
+
+    def get_postings(self, field, term):
+        """ :return: (docs, frequencies) of a term in a field """
+        terms = self.columns[f"{field}_terms"]
+        key = term.encode("utf-8")
+        if len(key) > terms.dtype.itemsize:
+            # Longer than every term (searchsorted would compare it truncated)
+            return None, None
+        position = int(np.searchsorted(terms, key))
+        if position == len(terms) or terms[position] != key:
+            return None, None
+        start, end = self.columns[f"{field}_starts"][position:position + 2]
+        return self.columns[f"{field}_docs"][start:end], self.columns[f"{field}_frequencies"][start:end]
+
+    def search(self, query, size=10, offset=0):
+        """
+        :param query: text
+        :param size: max hits
+        :param offset: hits skipped (pagination)
+        :return: (total matching games, [(appid, score, search document)] best first)
+        """
+        tokens = Counter(self.analyzer.analyze(query))
+        scores = np.zeros(self.docs, dtype=np.float32)
+        for field, boost in self.header["fields"].items():
+            field_scores = np.zeros(self.docs, dtype=np.float32)
+            average_length = self.header["average_lengths"][field] or 1.0
+            for term, query_frequency in tokens.items():
+                docs, frequencies = self.get_postings(field, term)
+                if docs is None:
+                    continue
+                idf = math.log(1 + (self.docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                frequencies = frequencies.astype(np.float32)
+                norms = BM25_K1 * (1 - BM25_B + BM25_B * self.columns[f"{field}_lengths"][docs] / average_length)
+                field_scores[docs] += query_frequency * boost * idf * frequencies / (frequencies + norms)
+            np.maximum(scores, field_scores, out=scores)
+
+        matches = np.flatnonzero(scores)
+        wanted = offset + size
+        if len(matches) > wanted:
+            matches = matches[np.argpartition(-scores[matches], wanted - 1)[:wanted]]
+        matches = matches[np.lexsort((matches, -scores[matches]))][offset:wanted]
+        hits = [(int(self.columns["appids"][doc]), float(scores[doc]), self.get_source(doc)) for doc in matches]
+        return int(np.count_nonzero(scores)), hits
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """
+    GET /search?q=<text>&size=10&from=0  -> {"took", "hits": {"total": {"value"}, "hits": [{"_id", "_score", "_source"}]}}
+    GET /games/<appid>                   -> {"_id", "found", "_source"}
+    The responses follow the ES ones, so a front end can switch between both.
+    """
+    file_path = None
+    search = None
+    mtime = None
+
+    @classmethod
+    def get_search(cls):
+        # The pipeline replaces the file when it rebuilds it, the new one is mapped on the next request
+        mtime = os.path.getmtime(cls.file_path)
+        if cls.search is None or mtime != cls.mtime:
+            cls.search = GamesSearch(cls.file_path)
+            cls.mtime = mtime
+        return cls.search
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        try:
+            search = self.get_search()
+            if url.path in ("/search", "/_search"):
+                start = time.perf_counter()
+                size = min(int(params.get("size", ["10"])[0]), 100)
+                offset = int(params.get("from", ["0"])[0])
+                total, hits = search.search(params.get("q", [""])[0], size, offset)
+                self.send_json(200, {
+                    "took": round((time.perf_counter() - start) * 1000),
+                    "hits": {
+                        "total": {"value": total},
+                        "hits": [{"_id": appid, "_score": score, "_source": source} for appid, score, source in hits]
+                    }
+                })
+            elif url.path.startswith("/games/") and url.path[len("/games/"):].isdigit():
+                appid = int(url.path[len("/games/"):])
+                source = search.get(appid)
+                self.send_json(200 if source else 404, {"_id": appid, "found": source is not None, "_source": source})
+            else:
+                self.send_json(404, {"error": f"Unknown path {url.path}"})
+        except (ValueError, OSError) as e:
+            self.send_json(400 if isinstance(e, ValueError) else 503, {"error": str(e)})
+
+
+def serve(file_path, host, port):
+    SearchHandler.file_path = file_path
+    SearchHandler.get_search()
+    server = ThreadingHTTPServer((host, port), SearchHandler)
+    print(f"Serving {file_path} ({SearchHandler.search.docs} games) on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Embedded games search server")
+    parser.add_argument("--file", default=os.path.join("json_data", "games_search.bin"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9201)
+    args = parser.parse_args()
+
+    serve(args.file, args.host, args.port)
@@ -0,0 +1,70 @@
+"""
+Local stand-in for the store APIs, serving the recorded responses of this folder so the batched price sources can
+be run offline.
+
+Usage (from the repository root):
+    python fixtures/stand_in_server.py [--port 8765]
+
+Then point the source urls of main.py to it (see the commented stand-in lines next to each url).
+"""
+import argparse
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+fixtures_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_fixture(*path):
+    with open(os.path.join(fixtures_path, *path), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def xbox_products(query):
+    """ /v7.0/products?bigIds=ID1,ID2,... -> recorded products with those ids """
+    big_ids = {product_id.upper() for product_id in query.get("bigIds", [""])[0].split(",") if product_id}
+    products = read_fixture("xbox", "displaycatalog_products.json")["Products"]
+    return 200, {"Products": [product for product in products if product["ProductId"] in big_ids]}
+
+
+def gog_catalog(query):
+    """ /v1/catalog?page=N -> recorded catalog page N (empty past the last recorded page) """
+    page = int(query.get("page", ["1"])[0])
+    if not os.path.exists(os.path.join(fixtures_path, "gog", f"catalog_page_{page}.json")):
+        first_page = read_fixture("gog", "catalog_page_1.json")
+        return 200, {"pages": first_page["pages"], "productCount": first_page["productCount"], "products": []}
+    return 200, read_fixture("gog", f"catalog_page_{page}.json")
+
+
+routes = {
+    "/v7.0/products": xbox_products,
+    "/v1/catalog": gog_catalog,
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in routes:
+            status, body = 404, {"error": f"No stand-in for {url.path}"}
+        else:
+            status, body = routes[url.path](parse_qs(url.query))
+
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline stand-in for the store APIs")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("localhost", args.port), StandInHandler)
+    print(f"Serving store stand-ins on http://localhost:{args.port}")
+    server.serve_forever()
@@ -7,16 +7,76 @@ import requests
 import time
 import gzip
 import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from epicstore_api import EpicGamesStoreAPI
+from title_matching import TrigramIndex
+from price_history import PriceHistory
+from price_analytics import compute_deals
+from taxonomy import TaxonomyRegistry, TAXONOMIES
+import embedded_search
 import xml.etree.ElementTree as ET
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
 
 parent_path = './' # Default
 #parent_path = '/home/raspy/Desktop/theEasterEgg_scraper' # Crontab
 history_limit = 10
+crawler_reactor_started = False
+crawl_resume = False # Keep the prices already crawled (json_data/temp/<store>_prices.ndjson) and only crawl the rest, after an interrupted crawl
+fuzzy_matching = False # Fuzzy title matching of store titles not found by url_name (see title_matching.py), review its matches before enabling it
+fuzzy_min_score = 0.85
+fuzzy_index = None
+fuzzy_index_fingerprint = None
+epic_items_per_request = 40 # New API limit
+epic_workers = 4
+epic_clients = threading.local()
+xbox_price_source = 'displaycatalog' # 'displaycatalog' (batched JSON lookups) or 'crawler' (product pages)
+xbox_displaycatalog_url = 'https://displaycatalog.mp.microsoft.com/v7.0/products'
+#xbox_displaycatalog_url = 'http://localhost:8765/v7.0/products' # Offline stand-in (fixtures/stand_in_server.py)
+xbox_batch_size = 20
+xbox_game_pass_ids = ("CFQ7TTC0KHS0", "CFQ7TTC0KGQ8", "CFQ7TTC0K5DJ") # Game Pass Ultimate, PC and console subscriptions
+gog_price_source = 'catalog' # 'catalog' (catalog API listing, crawler as fallback) or 'crawler' (product pages)
+gog_catalog_url = 'https://catalog.gog.com/v1/catalog'
+#gog_catalog_url = 'http://localhost:8765/v1/catalog' # Offline stand-in (fixtures/stand_in_server.py)
+gog_catalog_page_size = 48
+steam_prices_batch_size = 100 # appids per appdetails request (price_overview only)
+http_sessions = threading.local() # One requests session per thread, see get_http_session
+url_names_index = None
+url_names_index_mtime = None
+matching_index_lock = threading.RLock() # url_names_index and fuzzy_index are shared by the store threads
+taxonomy_registry = None
+taxonomy_registry_mtime = None
+appdetails_cache = True # Keep the raw appdetails responses, so the details can be rebuilt offline (see reprocess_steam_details)
+appdetails_cache_folder = os.path.join("json_data", "appdetails_cache")
+price_events_state_filename = os.path.join("temp", "price_events_state.json") # Prices history sequence exported and indexed in the price events index
+games_index_prices_filename = os.path.join("temp", "games_index_prices.json") # Prices of every app as the games index has them
+# Analysis of the searchable text of the games index (name, developers, publishers, categories, genres):
+# - ngram: 2-3 grams of every word, matches inside words (biggest index, slowest bulk indexing)
+# - edge_ngram: 2-20 character prefixes of every word, matches words as they are typed
+# - completion: edge_ngram plus a completion suggester on name (name.suggest) for the type-ahead
+# benchmarks/bench_search_profiles.py compares them
+games_search_profiles = {
+    "ngram": {"analyzer": "ngram_analyzer", "suggest": False},
+    "edge_ngram": {"analyzer": "edge_ngram_analyzer", "suggest": False},
+    "completion": {"analyzer": "edge_ngram_analyzer", "suggest": True},
+}
+games_search_profile = 'ngram'
+#games_search_profile = 'edge_ngram'
+autocomplete_index_filename = os.path.join("temp", "autocomplete_index.json") # Hash of every suggestion in the autocomplete index
+autocomplete_max_inputs = 4 # Suggestion inputs per title: the whole title and the ones starting at its next words
+# Index sort of the games index (index.sort.*): listings sorted the same way (see get_games_listing) stop after the top hits
+games_index_sort = {"field": ["data.total_recommendations"], "order": ["desc"], "missing": ["_last"]} # Most recommended first
+#games_index_sort = {"field": ["deal.best_price_in_cents"], "order": ["asc"], "missing": ["_last"]} # Cheapest first
+#games_index_sort = None
+# Heavy data fields only shown on the product page: kept in the game details index instead of the games index
+game_detail_fields = ("about_the_game", "short_description", "supported_languages", "pc_requirements", "mac_requirements",
+                      "linux_requirements", "legal_notice", "screenshots", "movies")
 
 def initialize():
     """
@@ -54,8 +114,7 @@ def initialize():
         os.path.join(xml_sitemaps_folder, "gog.xml"),
         os.path.join(json_temp_folder, "xbox_coincidences.json"),
         os.path.join(json_temp_folder, "battle_coincidences.json"),
-        os.path.join(json_temp_folder, "gog_coincidences.json"),
-        os.path.join(json_data_folder, "prices_history.json")
+        os.path.join(json_temp_folder, "gog_coincidences.json")
     ]
 
     for file in files:
@@ -99,6 +158,45 @@ def write_json(filename, data):
     with open(os.path.join(parent_path, "json_data", filename), "w", encoding="utf-8") as f:
         json.dump(data, f, indent=4)
 
+def read_prices_history(mmap=False):
+    """
+    Loads the columnar prices history (json_data/prices_history.bin, see price_history.py). The first time, it is
+    converted from the old prices_history.json.
+    :param mmap: memory-map it read-only (for exports)
+    :return: PriceHistory
+    """
+    file_path = os.path.join(parent_path, 'json_data', 'prices_history.bin')
+    if not os.path.exists(file_path):
+        entries = read_json('prices_history.json')
+        if entries:
+            logger('INFO', f'Converting prices_history.json ({len(entries)} apps) to prices_history.bin')
+            return PriceHistory.from_entries(entries, history_limit)
+    return PriceHistory.load(file_path, history_limit, mmap=mmap)
+
+def write_prices_history(history):
+    history.save(os.path.join(parent_path, 'json_data', 'prices_history.bin'))
+
+def read_ndjson(filename):
+    """
+    Reads a JSON lines file from json_data. A torn last line (e.g. a killed crawl) is skipped.
+    :param filename:
+    :return: list of the decoded lines
+    """
+    file_path = os.path.join(parent_path, 'json_data', filename)
+
+    if not os.path.exists(file_path):
+        return []
+
+    data = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                try:
+                    data.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger('ERROR', f'Skipped unreadable line in {filename}')
+    return data
+
 def logger(status, message, html_code=None):
     if html_code:
         print(f"|{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}|{status}|{html_code}|{message}")
@@ -342,6 +440,8 @@ def update_games_catalog(games):
                 app["metacritic"] = old_entry["metacritic"]
             if "data" in old_entry:
                 app["data"] = old_entry["data"]
+            if "deal" in old_entry:
+                app["deal"] = old_entry["deal"]
         old_apps_dict[appid] = app
 
     for app in old_apps_dict.values():
@@ -357,35 +457,270 @@ def update_games_catalog(games):
             app["data"] = []
 
     write_json('games.json', list(old_apps_dict.values()))
+    build_url_names_index(old_apps_dict.values())
     logger('INFO', 'Ended updating games catalog')
 
-def update_prices_history(games):
+def get_alternate_url_name(url_name):
     """
-    :param games:
+    Alternate matching key of a url_name: runs of hyphens collapsed, so "a--b" (from "A - B") matches "a-b".
+    :param url_name:
     :return:
     """
-    logger('INFO', 'Started updating prices history')
+    return re.sub(r'-+', '-', url_name).strip('-')
+
+def build_url_names_index(games):
+    """
+    Builds and persists the matching index of the games catalog (json_data/url_names_index.json):
+    - url_names: url_name -> appids
+    - alternate_keys: alternate key -> url_name (see get_alternate_url_name)
+    - titles: url_name -> name, for the fuzzy matching (see get_fuzzy_index)
+    - catalog_fingerprint: changes whenever an appid or url_name of the catalog changes
+    :param games: games catalog
+    :return: the index
+    """
+    url_names = {}
+    titles = {}
+    for game in games:
+        url_names.setdefault(game["url_name"], []).append(game["appid"])
+        titles.setdefault(game["url_name"], game["name"])
+
+    alternate_keys = {}
+    for url_name in url_names:
+        alternate_key = get_alternate_url_name(url_name)
+        if alternate_key != url_name and alternate_key not in url_names:
+            alternate_keys.setdefault(alternate_key, url_name)
+
+    fingerprint_source = "\n".join(f'{url_name}:{appids}' for url_name, appids in sorted(url_names.items()))
+    index = {
+        "catalog_fingerprint": hashlib.sha1(fingerprint_source.encode("utf-8")).hexdigest(),
+        "url_names": url_names,
+        "alternate_keys": alternate_keys,
+        "titles": titles
+    }
+    write_json('url_names_index.json', index)
+    logger('INFO', f'Built url names index: {len(url_names)} url names, {len(alternate_keys)} alternate keys')
+    return index
+
+def load_url_names_index():
+    """
+    Loads the matching index, building it from games.json if it does not exist yet. update_games_catalog()
+    rebuilds it every time the catalog changes.
+    The index is kept in memory until the file changes, so it must not be modified by the callers.
+    :return:
+    """
+    global url_names_index, url_names_index_mtime
+
+    with matching_index_lock:
+        file_path = os.path.join(parent_path, "json_data", "url_names_index.json")
+        mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else None
+        if url_names_index is not None and mtime is not None and mtime == url_names_index_mtime:
+            return url_names_index
+
+        index = read_json('url_names_index.json')
+        if not index:
+            index = build_url_names_index(read_json('games.json'))
+        url_names_index = index
+        url_names_index_mtime = os.path.getmtime(file_path)
+        return index
+
+def get_fuzzy_index(index):
+    """
+    Trigram index over the titles of the games catalog, built once per catalog fingerprint.
+    :param index: see build_url_names_index()
+    :return: title_matching.TrigramIndex
+    """
+    global fuzzy_index, fuzzy_index_fingerprint
 
-    old_history = []
+    with matching_index_lock:
+        if fuzzy_index is None or fuzzy_index_fingerprint != index["catalog_fingerprint"]:
+            # Only published once complete, so no thread ever queries a half-built index
+            new_index = TrigramIndex()
+            for url_name, title in index.get("titles", {}).items():
+                new_index.add(title, url_name)
+            fuzzy_index = new_index
+            fuzzy_index_fingerprint = index["catalog_fingerprint"]
+            logger('INFO', f'Built fuzzy title index: {len(fuzzy_index)} titles')
 
-    if os.path.getsize(os.path.join(parent_path, "json_data", "prices_history.json")) > 0:
-        old_history = read_json('prices_history.json')
+        return fuzzy_index
 
-    old_history_dict = {entry["appid"]: entry for entry in old_history}
+def find_coincidence(index, store_url_name, title=None):
+    """
+    Exact lookup of a store url_name and, if fuzzy_matching is enabled, fuzzy lookup of its title (or url_name).
+    :param index: see build_url_names_index()
+    :param store_url_name: url_name (slug) in the store
+    :param title: title in the store, if known
+    :return: (url_name of the games catalog or None, confidence between 0 and 1)
+    """
+    url_name = match_url_name(index, store_url_name)
+    if url_name is not None:
+        return url_name, 1.0
+    if not fuzzy_matching:
+        return None, 0
+    return get_fuzzy_index(index).query(title or store_url_name, fuzzy_min_score)
+
+def keep_best_coincidences(coincidences):
+    """
+    :param coincidences: list of coincidences with "url_name" and "confidence"
+    :return: one coincidence per url_name, the one with the highest confidence
+    """
+    best = {}
+    for coincidence in coincidences:
+        url_name = coincidence["url_name"]
+        if url_name not in best or coincidence["confidence"] > best[url_name]["confidence"]:
+            best[url_name] = coincidence
+    return list(best.values())
+
+def match_url_name(index, store_url_name):
+    """
+    Constant time lookup of a store url_name in the matching index.
+    :param index: see build_url_names_index()
+    :param store_url_name: url_name (slug) in the store
+    :return: the url_name of the games catalog it matches, or None
+    """
+    if store_url_name in index["url_names"]:
+        return store_url_name
+    alternate_key = get_alternate_url_name(store_url_name)
+    if alternate_key in index["url_names"]:
+        return alternate_key
+    return index["alternate_keys"].get(alternate_key)
+
+def get_taxonomy_terms(data):
+    """
+    :param data: cleaned details of a game (see clean_app_details)
+    :return: {taxonomy: terms} of the game
+    """
+    if not isinstance(data, dict):
+        return {}
+    rating = (data.get("pegi") or {}).get("rating")
+    return {
+        "genres": data.get("genres", []),
+        "categories": [item for item in data.get("categories", []) if "valve" not in item.lower() and "steam" not in item.lower()],
+        "developers": data.get("developers", []),
+        "publishers": data.get("publishers", []),
+        "pegi": [] if rating is None else rating if isinstance(rating, list) else [rating]
+    }
 
+def load_taxonomies():
+    """
+    Loads the taxonomy registry (json_data/taxonomies.json, see taxonomy.py). The first time, it is built from the
+    old list files (genres.json, ...) and the usage counts from games.json.
+    The registry is kept in memory until the file changes (e.g. between daemon runs).
+    :return:
+    """
+    global taxonomy_registry, taxonomy_registry_mtime
+
+    file_path = os.path.join(parent_path, 'json_data', 'taxonomies.json')
+    if os.path.exists(file_path):
+        mtime = os.path.getmtime(file_path)
+        if taxonomy_registry is not None and mtime == taxonomy_registry_mtime:
+            return taxonomy_registry
+        taxonomy_registry = TaxonomyRegistry.load(file_path)
+        taxonomy_registry_mtime = mtime
+        return taxonomy_registry
+
+    logger('INFO', 'Building taxonomies.json from the taxonomy lists')
+    registry = TaxonomyRegistry.from_lists({kind: read_json(f'{kind}.json') for kind in TAXONOMIES},
+                                           (get_taxonomy_terms(game.get("data")) for game in read_json('games.json')))
+    write_taxonomies(registry)
+    return registry
+
+def write_taxonomies(registry):
+    """ Saves the taxonomy registry, and the term lists (genres.json, ...) in id order """
+    global taxonomy_registry, taxonomy_registry_mtime
+
+    file_path = os.path.join(parent_path, 'json_data', 'taxonomies.json')
+    registry.save(file_path)
+    for kind in TAXONOMIES:
+        write_json(f'{kind}.json', registry[kind].names)
+    taxonomy_registry = registry
+    taxonomy_registry_mtime = os.path.getmtime(file_path)
+
+def get_appdetails_cache_path(appid):
+    # Grouped by thousands of appids, so no folder ends up with the whole catalog
+    return os.path.join(parent_path, appdetails_cache_folder, str(appid // 1000), f"{appid}.json.gz")
+
+def write_appdetails_cache(appid, last_modified, data):
+    """
+    Keeps the raw appdetails data of an app (before clean_app_details), gzip-compressed. Only the latest version
+    (last_modified) of every app is kept.
+    :param appid:
+    :param last_modified: last_modified of the app when it was fetched
+    :param data: "data" of the appdetails response
+    """
+    file_path = get_appdetails_cache_path(appid)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    entry = {"appid": appid, "last_modified": last_modified, "fetched": get_time(), "data": data}
+    with gzip.open(file_path + ".tmp", "wt", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(file_path + ".tmp", file_path)
+
+def read_appdetails_cache(appid, last_modified=None):
+    """
+    :param appid:
+    :param last_modified: only return the entry if it was fetched for this last_modified
+    :return: {"appid", "last_modified", "fetched", "data"}, None if there is none
+    """
+    file_path = get_appdetails_cache_path(appid)
+    if not os.path.exists(file_path):
+        return None
+    try:
+        with gzip.open(file_path, "rt", encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, EOFError, json.JSONDecodeError):
+        logger('ERROR', f'Cannot read appdetails cache of app {appid}')
+        return None
+    if last_modified is not None and entry["last_modified"] != last_modified:
+        return None
+    return entry
+
+def apply_app_details(app, data, taxonomies, fetched=None):
+    """
+    Fills the details of a game (metacritic, data and its taxonomy terms) from a raw appdetails response.
+    :param app: game of the catalog
+    :param data: "data" of the appdetails response (cleaned in place)
+    :param taxonomies: TaxonomyRegistry
+    :param fetched: unix time the response was fetched (now if None)
+    """
+    old_terms = get_taxonomy_terms(app.get("data"))
+    #app["critics"]["metacritic"] = get_metacritic_data(data)
+    app["metacritic"] = get_metacritic_data(data)
+    if fetched is not None and app["metacritic"]["last_fetched"] != -1:
+        app["metacritic"]["last_fetched"] = fetched
+    app["data"] = clean_app_details(data)
+    taxonomies.update_app(old_terms, get_taxonomy_terms(app["data"]))
+
+def reprocess_steam_details():
+    """
+    Rebuilds the details of every game (data, metacritic and taxonomies) from the appdetails cache, without any
+    request, e.g. after a change of clean_app_details. The prices are left as they are, as the cached ones are old.
+    :return:
+    """
+    logger('INFO', 'Started reprocessing games details from the appdetails cache')
+    games = read_json('games.json')
+    taxonomies = load_taxonomies()
+    reprocessed = 0
     for app in games:
-        appid = app["appid"]
-        if appid not in old_history_dict:
-            old_history.append({
-                "appid": appid,
-                "steam": [],
-                "epic": [],
-                "xbox": [],
-                "battle": [],
-                "gog": [],
-            })
+        cached = read_appdetails_cache(app["appid"])
+        if cached is not None:
+            apply_app_details(app, cached["data"], taxonomies, cached["fetched"])
+            reprocessed += 1
+
+    write_json('games.json', games)
+    write_taxonomies(taxonomies)
+    logger('INFO', f'Ended reprocessing games details: {reprocessed} from cache, {len(games) - reprocessed} not cached')
+
+def update_prices_history(games):
+    """
+    :param games:
+    :return:
+    """
+    logger('INFO', 'Started updating prices history')
+
+    prices_history = read_prices_history()
+    for app in games:
+        prices_history.add_app(app["appid"])
 
-    write_json('prices_history.json', old_history)
+    write_prices_history(prices_history)
     logger('INFO', 'Ended updating prices history')
 
 def process_xbox_sitemaps():
@@ -420,7 +755,7 @@ def process_xbox_sitemaps():
                 compressed_file = os.path.join(output_folder, f"xbox-compressed-{x}.gz")
                 decompressed_file = os.path.join(output_folder, f"xbox-{x}.xml")
 
-                response = requests.get(url, stream=True)
+                response = get_http_session().get(url, stream=True)
                 if response.status_code == 200:
                     with open(compressed_file, "wb") as file:
                         shutil.copyfileobj(response.raw, file)
@@ -516,8 +851,39 @@ def run_crawler(mode):
     ]
     subprocess.run(command)
 
+def run_crawlers(modes):
+    """
+    Runs one crawler per mode inside this process, all of them at the same time on a single Twisted reactor.
+    Every mode gets its own Crawler and downloader, so the per-domain politeness limits of each store stay
+    independent.
+
+    The reactor cannot be restarted, so any later call in the same process falls back to run_crawler().
+    :param modes: list of crawler modes ("xbox", "battle", "gog")
+    :return:
+    """
+    global crawler_reactor_started
+
+    if not modes:
+        return
+
+    if crawler_reactor_started:
+        logger('INFO', 'Crawler reactor already used in this process, running crawlers as subprocesses')
+        for mode in modes:
+            run_crawler(mode)
+        return
+
+    from crawler.spiders.crawler import CrawlerSpider
+
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'crawler.settings')
+    process = CrawlerProcess(get_project_settings())
+    for mode in modes:
+        process.crawl(CrawlerSpider, mode=mode)
+
+    crawler_reactor_started = True
+    process.start()
+
 def download_xml_sitemap(xml_url, filename):
-    response = requests.get(xml_url)
+    response = get_http_session().get(xml_url)
 
     if response.status_code == 200:
         with open(os.path.join(parent_path, 'xml_sitemaps', filename), 'wb') as file:
@@ -561,7 +927,7 @@ def build_xbox_catalog():
 def fetch_steam_catalog():
     """
     :param limit:
-    :return:
+    :return: True if the whole catalog was fetched
     """
     logger('INFO','Started fetching Steam catalog')
     file_path = os.path.join(parent_path, "credentials/steam_api_key.txt")
@@ -574,7 +940,7 @@ def fetch_steam_catalog():
     apps = []
 
     while True:
-        response_get_app_list = requests.get(f"https://api.steampowered.com/IStoreService/GetAppList/v1/?"
+        response_get_app_list = get_http_session().get(f"https://api.steampowered.com/IStoreService/GetAppList/v1/?"
                                              f"key={steam_api_key}"
                                              f"&if_modified_since={modified_since}"
                                              f"&include_games=true"
@@ -592,13 +958,14 @@ def fetch_steam_catalog():
                 last_app_id = apps_chunk[-1]["appid"]
         else:
             logger('ERROR', f'GetAppList request failed: {response_get_app_list.status_code}')
-            break
+            return False
     logger('INFO', 'Ended fetching Steam catalog')
+    return True
 
 def fetch_steam_catalog_by_ids(ids_list):
     """
     FOR TEST PURPOSES
-    :return:
+    :return: True if every app was fetched
     """
     logger('INFO','Started fetching Steam catalog')
     file_path = os.path.join(parent_path, "credentials/steam_api_key.txt")
@@ -607,7 +974,7 @@ def fetch_steam_catalog_by_ids(ids_list):
 
     apps = []
     for game_id in ids_list:
-        response_get_app_list = requests.get(f"https://api.steampowered.com/IStoreService/GetAppList/v1/?"
+        response_get_app_list = get_http_session().get(f"https://api.steampowered.com/IStoreService/GetAppList/v1/?"
                                              f"key={steam_api_key}"
                                              f"&include_games=true"
                                              f"&last_appid={game_id - 1}"
@@ -622,8 +989,9 @@ def fetch_steam_catalog_by_ids(ids_list):
                 break
         else:
             logger('ERROR', f'GetAppList request failed: {response_get_app_list.status_code}')
-            break
+            return False
     logger('INFO', 'Ended fetching Steam catalog')
+    return True
 
 def fetch_steam_details(limit=None):
     """
@@ -633,72 +1001,47 @@ def fetch_steam_details(limit=None):
     successful response is received. For a 403 status code, the program should wait for 5 minutes to comply with
     the rate limit duration.
 
-    :return:
+    The apps fetched before an error are kept.
+    :return: False if an error stopped the fetch (a rate limit stop is partial progress, not an error)
     """
     logger('INFO', 'Started fetching games details')
     games = read_json('games.json')
-    genres = read_json('genres.json')
-    categories = read_json('categories.json')
-    developers = read_json('developers.json')
-    publishers = read_json('publishers.json')
-    pegi = read_json('pegi.json')
-    prices_history = read_json('prices_history.json')
-    prices_history_dict = {entry["appid"]: entry for entry in prices_history}
+    taxonomies = load_taxonomies()
+    prices_history = read_prices_history()
     count = 0
+    completed = True
 
     try:
         for app in games:
             start_time = time.time()
             appid = app["appid"]
             if app["last_fetched"] < app["last_modified"] and (limit is None or count <= limit):
+                cached = read_appdetails_cache(appid, app["last_modified"]) if appdetails_cache else None
+                if cached is not None:
+                    # Already fetched for this last_modified (e.g. the run stopped before writing games.json): no
+                    # request, and the price is left to fetch_steam_prices
+                    app["last_fetched"] = max(cached["fetched"], app["last_modified"])
+                    apply_app_details(app, cached["data"], taxonomies, cached["fetched"])
+                    logger('INFO', f'Details for app {appid} from the appdetails cache')
+                    continue
+
                 count += 1
-                response_get_app_details = requests.get(f"https://store.steampowered.com/api/appdetails?appids={appid}")
+                response_get_app_details = get_http_session().get(f"https://store.steampowered.com/api/appdetails?appids={appid}")
                 if response_get_app_details.status_code == 200:
                     data = response_get_app_details.json().get(str(appid), {})
                     if data.get("success"):
-                        # Games
+                        # Raw response first, clean_app_details modifies it
+                        if appdetails_cache:
+                            write_appdetails_cache(appid, app["last_modified"], data["data"])
+                        # Games, genres, categories, developers, publishers and PEGI
                         app["last_fetched"] = get_time()
                         app["stores"]["steam"] = get_steam_data(data["data"])
-                        #app["critics"]["metacritic"] = get_metacritic_data(data["data"])
-                        app["metacritic"] = get_metacritic_data(data["data"])
-                        app["data"] = clean_app_details(data["data"])
+                        apply_app_details(app, data["data"], taxonomies)
                         logger('INFO', f'Fetched details for app {appid}', response_get_app_details.status_code)
-                        # Genres
-                        if "genres" in app["data"]:
-                            genres.extend(item for item in app["data"]["genres"]if item not in genres)
-                        # Categories
-                        if "categories" in app["data"]:
-                            categories.extend(item for item in app["data"]["categories"]if (
-                                    item not in categories and
-                                    "valve" not in item.lower() and
-                                    "steam" not in item.lower()
-                            ))
-                        # Developers
-                        if "developers" in app["data"]:
-                            developers.extend(item for item in app["data"]["developers"] if item not in developers)
-                        # Publishers
-                        if "publishers" in app["data"]:
-                            publishers.extend(item for item in app["data"]["publishers"] if item not in publishers)
-                        # PEGI
-                        if "pegi" in app["data"] and "rating" in app["data"]["pegi"]:
-                            rating = app["data"]["pegi"]["rating"]
-                            if rating is not None:
-                                if isinstance(rating, list):
-                                    pegi.extend(item for item in rating if item not in pegi)
-                                else:
-                                    if rating not in pegi:
-                                        pegi.append(rating)
 
                         # Prices history (Steam)
                         if app["stores"]["steam"]["price_in_cents"] is not None and 0 <= app["stores"]["steam"]["price_in_cents"] <= 11000:
-                            new_price = {
-                                "price_in_cents": app["stores"]["steam"]["price_in_cents"],
-                                "price_time": app["stores"]["steam"]["price_time"],
-                            }
-                            if appid in prices_history_dict:
-                                if len(prices_history_dict[appid]["steam"]) >= history_limit:
-                                    prices_history_dict[appid]["steam"].pop(0)
-                                prices_history_dict[appid]["steam"].append(new_price)
+                            prices_history.append(appid, "steam", app["stores"]["steam"]["price_in_cents"], app["stores"]["steam"]["price_time"])
 
                     else:
                         logger('INFO', f'Cannot fetch details for app {appid}: Not available', response_get_app_details.status_code)
@@ -708,217 +1051,413 @@ def fetch_steam_details(limit=None):
                     if remaining_time > 0:
                         time.sleep(remaining_time)
 
+                # Rate limited: the daily limit is routinely reached on a full catalog, so it is partial progress (the
+                # apps left are fetched by the next run) and the stages downstream still get the apps fetched so far
                 elif response_get_app_details.status_code == 429:
-                    logger('ERROR', f'Error fetching details for app {appid}: Too many requests', response_get_app_details.status_code)
+                    logger('ERROR', f'Error fetching details for app {appid}: Too many requests, the rest is left for the next run', response_get_app_details.status_code)
                     break
                 elif response_get_app_details.status_code == 403:
-                    logger('ERROR', f'Error fetching details for app {appid}: Forbidden', response_get_app_details.status_code)
+                    logger('ERROR', f'Error fetching details for app {appid}: Forbidden, the rest is left for the next run', response_get_app_details.status_code)
                     break
                 else:
                     logger('ERROR', f'Error fetching details for app {appid}: Unknown error', response_get_app_details.status_code)
+                    completed = False
                     break
             elif limit is not None and count > limit:
                 logger('INFO', f'Reached manual fetching limit of {limit}')
                 break
             else:
-                # Prices history (Steam)
-                if app["stores"]["steam"]["price_in_cents"] is not None and app["stores"]["steam"]["price_in_cents"] >= 0:
-                    new_price = {
-                            "price_in_cents": app["stores"]["steam"]["price_in_cents"],
-                            "price_time": get_time(),
-                    }
-                    if appid in prices_history_dict:
-                        if len(prices_history_dict[appid]["steam"]) >= history_limit:
-                            prices_history_dict[appid]["steam"].pop(0)
-                        prices_history_dict[appid]["steam"].append(new_price)
-
+                # No new price was seen, so the prices history is left as it is (see fetch_steam_prices)
                 logger('INFO', f'Skipped app {appid}: Already up to date')
     except:
         logger('ERROR', traceback.format_exc(), f'appid={appid}')
+        completed = False
 
     logger('INFO', 'Ended fetching games details')
 
     logger('INFO', 'Started updating JSON files')
     write_json('games.json', games)
-    write_json('genres.json', genres)
-    write_json('categories.json', categories)
-    write_json('developers.json', developers)
-    write_json('publishers.json', publishers)
-    write_json('pegi.json', pegi)
-    write_json('prices_history.json', list(prices_history_dict.values()))
+    write_taxonomies(taxonomies)
+    write_prices_history(prices_history)
     logger('INFO', 'Ended updating JSON files')
+    return completed
 
-def fetch_epic_catalog():
-    logger('INFO', 'Started fetching Epic Games catalog')
+def fetch_steam_prices():
+    """
+    Refreshes the Steam price of every game whose details were already fetched. appdetails only accepts several
+    appids at once when it is filtered to price_overview, so each request covers steam_prices_batch_size games.
 
+    Free games come back without price_overview and keep their price. Same rate limits as fetch_steam_details().
+    The prices fetched before an error are kept.
+    :return: False if an error stopped the fetch (a rate limit stop is partial progress, not an error)
+    """
+    logger('INFO', 'Started fetching Steam prices')
     games = read_json('games.json')
-    prices_history = read_json('prices_history.json')
-    prices_history_dict = {entry["appid"]: entry for entry in prices_history}
-    url_names = []
-    for game in games:
-        url_names.append(game["url_name"])
-
-    api = EpicGamesStoreAPI(locale='es-ES', country='ES')
-    epic_catalog = []
-    coincidences = []
-    start = 0
-    items_per_request = 40 # New API limit
+    prices_history = read_prices_history()
+    games_dict = {app["appid"]: app for app in games if app["last_fetched"] > 0}
+    appids = list(games_dict)
+    updated = 0
+    completed = True
 
     try:
-        while True:
-            response = api.fetch_store_games(count=items_per_request, start=start, allow_countries='ES', with_price=True)
-            try:
-                if "data" in response and "Catalog" in response["data"] and "searchStore" in response["data"][
-                    "Catalog"] and "elements" in response["data"]["Catalog"]["searchStore"]:
-                    games_chunk = response["data"]["Catalog"]["searchStore"]["elements"]
-                    epic_catalog.extend(games_chunk)
-                    start += items_per_request
-                    if len(games_chunk) < items_per_request:
-                        break
-                else:
-                    break
-            except ValueError:
-                logger('ERROR', traceback.format_exc())
-                break
+        for i in range(0, len(appids), steam_prices_batch_size):
+            start_time = time.time()
+            batch = appids[i:i + steam_prices_batch_size]
+            response = get_http_session().get("https://store.steampowered.com/api/appdetails", params={
+                "appids": ",".join(str(appid) for appid in batch),
+                "filters": "price_overview"
+            })
 
-        logger('INFO', 'Ended fetching Epic Games catalog')
+            if response.status_code == 200:
+                for appid, data in response.json().items():
+                    app = games_dict.get(int(appid))
+                    if app is None or not data.get("success") or not isinstance(data.get("data"), dict) or "price_overview" not in data["data"]:
+                        continue
+                    app["stores"]["steam"] = get_steam_data({
+                        "is_free": False,
+                        "steam_appid": app["appid"],
+                        "price_overview": data["data"]["price_overview"]
+                    })
+                    updated += 1
+
+                    # Prices history (Steam)
+                    if app["stores"]["steam"]["price_in_cents"] is not None and 0 <= app["stores"]["steam"]["price_in_cents"] <= 11000:
+                        prices_history.append(app["appid"], "steam", app["stores"]["steam"]["price_in_cents"], app["stores"]["steam"]["price_time"])
+                logger('INFO', f'Fetched Steam prices [{i} - {i + len(batch)}]', response.status_code)
+            elif response.status_code in (429, 403):
+                # Rate limited: partial progress, as in fetch_steam_details
+                logger('ERROR', f'Error fetching Steam prices [{i} - {i + len(batch)}]: Rate limited, the rest is left for the next run', response.status_code)
+                break
+            else:
+                logger('ERROR', f'Error fetching Steam prices [{i} - {i + len(batch)}]', response.status_code)
+                completed = False
+                break
 
+            elapsed_time = time.time() - start_time
+            remaining_time = 1.51 - elapsed_time
+            if remaining_time > 0:
+                time.sleep(remaining_time)
     except:
         logger('ERROR', traceback.format_exc())
+        completed = False
+
+    logger('INFO', f'Ended fetching Steam prices: {updated} prices updated')
+
+    if updated:
+        write_json('games.json', games)
+        write_prices_history(prices_history)
+    return completed
+
+def get_http_session():
+    """
+    One requests session per thread, as a session is not meant to be shared between threads. It keeps the
+    connections of its thread alive between requests and stages.
+    :return:
+    """
+    if not hasattr(http_sessions, "session"):
+        http_sessions.session = requests.Session()
+    return http_sessions.session
+
+def get_epic_client():
+    """
+    One EpicGamesStoreAPI client per thread, as its session is not meant to be shared between threads.
+    :return:
+    """
+    if not hasattr(epic_clients, "api"):
+        epic_clients.api = EpicGamesStoreAPI(locale='es-ES', country='ES')
+    return epic_clients.api
 
+def fetch_epic_store_page(start):
+    """
+    :param start: offset of the page
+    :return: (games of the page, total count of the store) or (None, None) on error
+    """
     try:
-        logger('INFO', 'Searching for coincidences between Steam and Epic catalogs')
-        for game in epic_catalog:
-            if "title" in game and game["title"] is not None:
-                if "productSlug" in game and game["productSlug"] is not None:
-                    if "price" in game and game["price"] is not None:
-                        if "totalPrice" in game["price"] and game["price"]["totalPrice"] is not None:
-                            if "discountPrice" in game["price"]["totalPrice"] and game["price"]["totalPrice"]["discountPrice"] is not None:
-                                if game["productSlug"] in url_names:
-                                    coincidences.append({
-                                        "url_name": game["productSlug"],
-                                        "price_in_cents": game["price"]["totalPrice"]["discountPrice"],
-                                    })
-                                elif get_url_name(game["title"]) in url_names:
-                                    coincidences.append({
-                                        "url_name": get_url_name(game["title"]),
-                                        "price_in_cents": game["price"]["totalPrice"]["discountPrice"],
-                                    })
-
-        coincidences_dict = {coincidence["url_name"]: coincidence["price_in_cents"] for coincidence in coincidences}
-
-        logger('INFO', f'{len(coincidences_dict)} coincidences found')
-        logger('INFO', 'Started updating JSON files')
+        response = get_epic_client().fetch_store_games(count=epic_items_per_request, start=start, allow_countries='ES', with_price=True)
+        search_store = response["data"]["Catalog"]["searchStore"]
+        return search_store["elements"], search_store["paging"]["total"]
+    except:
+        logger('ERROR', f'Epic Games page {start}: {traceback.format_exc()}')
+        return None, None
 
-        for game in games:
-            if game["url_name"] in coincidences_dict:
-                game["stores"]["epic"]["availability"] = True
-                game["stores"]["epic"]["price_in_cents"] = coincidences_dict[game["url_name"]]
-                game["stores"]["epic"]["price_time"] = get_time()
-                game["stores"]["epic"]["url"] = "https://store.epicgames.com/es-ES/p/" + game["url_name"]
-                # Prices history (Epic)
-                if game["stores"]["epic"]["price_in_cents"] is not None and game["stores"]["epic"]["price_in_cents"] >= 0:
-                    new_price = {
-                            "price_in_cents": game["stores"]["epic"]["price_in_cents"],
-                            "price_time": game["stores"]["epic"]["price_time"],
-                    }
-                    if game["appid"] in prices_history_dict:
-                        if len(prices_history_dict[game["appid"]]["epic"]) >= history_limit:
-                            prices_history_dict[game["appid"]]["epic"].pop(0)
-                        prices_history_dict[game["appid"]]["epic"].append(new_price)
+def fetch_epic_store_games():
+    """
+    Fetches the first page to learn the total count of the store, then the rest of the pages concurrently with
+    epic_workers threads.
+    :return: (list of games, True if every page was fetched)
+    """
+    logger('INFO', 'Started fetching Epic Games catalog')
+
+    epic_catalog, total = fetch_epic_store_page(0)
+    if epic_catalog is None:
+        return [], False
 
+    complete = True
+    starts = range(epic_items_per_request, total, epic_items_per_request)
+    with ThreadPoolExecutor(max_workers=epic_workers) as executor:
+        for games_chunk, _ in executor.map(fetch_epic_store_page, starts):
+            if games_chunk is None:
+                complete = False
             else:
-                game["stores"]["epic"]["availability"] = False
-                game["stores"]["epic"]["price_in_cents"] = None
-                game["stores"]["epic"]["price_time"] = get_time()
-                game["stores"]["epic"]["url"] = None
-
-        if len(coincidences) > 0:
-            write_json('games.json', games)
-            write_json('prices_history.json', list(prices_history_dict.values()))
-        logger('INFO', 'Ended updating JSON files')
-    except:
-        logger('ERROR', traceback.format_exc())
+                epic_catalog.extend(games_chunk)
 
-def fetch_xbox_catalog():
+    logger('INFO', f'Ended fetching Epic Games catalog: {len(epic_catalog)}/{total} games')
+    return epic_catalog, complete
+
+def get_epic_snapshot(epic_catalog):
+    """
+    :param epic_catalog: games of the Epic Games store
+    :return: dict title -> {"slug", "price_in_cents"} of the games with a title and a price
+    """
+    snapshot = {}
+    for game in epic_catalog:
+        title = game.get("title")
+        price = (game.get("price") or {}).get("totalPrice") or {}
+        if title is not None and price.get("discountPrice") is not None:
+            snapshot[title] = {
+                "slug": game.get("productSlug"),
+                "price_in_cents": price["discountPrice"]
+            }
+    return snapshot
+
+def get_epic_url(entry, url_name):
+    """
+    :return: store page of an Epic game, from its own product slug (the catalog url_name only if it has none)
+    """
+    return "https://store.epicgames.com/es-ES/p/" + (entry["slug"] or url_name)
+
+def get_epic_url_name(title, entry, index):
+    """
+    :return: url_name of the games catalog the Epic game matches, or None
+    """
+    if entry["slug"] is not None:
+        url_name = match_url_name(index, entry["slug"])
+        if url_name is not None:
+            return url_name
+    url_name, _ = find_coincidence(index, get_url_name(title), title)
+    return url_name
+
+def collect_epic_prices():
+    """
+    Only the Epic games whose slug or price changed since the previous run (json_data/temp/epic_snapshot.json) end
+    up in the delta. A change in the games catalog matches every game again, as new catalog games may match now;
+    the titles of the previous snapshot are still used to find the games gone from the store.
+    :return: price delta of the Epic Games store (see merge_store_deltas)
+    """
+    index = load_url_names_index()
+    catalog_fingerprint = index["catalog_fingerprint"]
+
+    old_snapshot = read_json(os.path.join("temp", "epic_snapshot.json")) or {}
+    old_games = old_snapshot.get("games", {})
+    rematch = old_snapshot.get("catalog_fingerprint") != catalog_fingerprint
+
+    epic_catalog, complete = fetch_epic_store_games()
+    new_games = get_epic_snapshot(epic_catalog)
+
+    logger('INFO', 'Searching for coincidences between Steam and Epic catalogs')
+    prices = {}
+    for title, entry in new_games.items():
+        if rematch or old_games.get(title) != entry:
+            url_name = get_epic_url_name(title, entry, index)
+            if url_name is not None:
+                prices[url_name] = {
+                    "availability": True,
+                    "price_in_cents": entry["price_in_cents"],
+                    "price_time": get_time(),
+                    "url": get_epic_url(entry, url_name)
+                }
+
+    # Titles gone from the store (only trusted when every page was fetched)
+    removed = 0
+    if complete:
+        current = {get_epic_url_name(title, entry, index) for title, entry in new_games.items()}
+        for title, entry in old_games.items():
+            if title not in new_games:
+                url_name = get_epic_url_name(title, entry, index)
+                if url_name is not None and url_name not in current:
+                    prices[url_name] = {
+                        "availability": False,
+                        "price_in_cents": None,
+                        "price_time": get_time(),
+                        "url": None
+                    }
+                    removed += 1
+
+    logger('INFO', f'{len(prices) - removed} changed coincidences found, {removed} removed')
+
+    return {
+        "store": "epic",
+        "full": False,
+        "prices": prices,
+        "snapshot": {
+            "catalog_fingerprint": catalog_fingerprint,
+            "time": get_time(),
+            "games": new_games
+        } if complete else None
+    }
+
+def reset_crawled_prices(store):
+    """
+    Empties the crawled prices store of the given mode before a new crawl, unless crawl_resume is set (the crawler
+    then skips the coincidences it already priced).
+    :param store: crawler mode ("xbox", "battle", "gog")
+    :return:
+    """
+    if crawl_resume:
+        logger('INFO', f'Resuming the {store} crawl, crawled prices kept')
+        return
+    with open(os.path.join(parent_path, "json_data", "temp", f"{store}_prices.ndjson"), "w", encoding="utf-8"):
+        pass
+
+def read_crawled_coincidences(store):
+    """
+    Joins the coincidences of the given mode with the prices the crawler streamed to
+    json_data/temp/<store>_prices.ndjson (see crawler.pipelines.CrawlerPipeline).
+    :param store: crawler mode ("xbox", "battle", "gog")
+    :return: dict url_name -> coincidence
+    """
+    coincidences = read_json(os.path.join("temp", f"{store}_coincidences.json"))
+    coincidences_dict = {coincidence["url_name"]: coincidence for coincidence in coincidences}
+
+    for result in read_ndjson(os.path.join("temp", f"{store}_prices.ndjson")):
+        if result["url_name"] in coincidences_dict:
+            coincidences_dict[result["url_name"]]["price_in_cents"] = result["price_in_cents"]
+            coincidences_dict[result["url_name"]]["url"] = result["url"]
+            coincidences_dict[result["url_name"]]["price_time"] = result["price_time"]
+
+    return coincidences_dict
+
+def prepare_xbox_coincidences():
     """
+    Matches the Xbox sitemaps against the games catalog and leaves the coincidences ready for the crawler.
     :return:
     """
     process_xbox_sitemaps()
     xbox_catalog = build_xbox_catalog()
 
-    games = read_json('games.json')
-    prices_history = read_json('prices_history.json')
-    prices_history_dict = {entry["appid"]: entry for entry in prices_history}
-    url_names = []
-    for game in games:
-        url_names.append(game["url_name"])
-
+    index = load_url_names_index()
     coincidences = []
 
     logger('INFO', 'Searching for coincidences between Steam and Xbox catalogs')
 
     for game in xbox_catalog:
-        if game["url_name"] in url_names:
+        url_name, confidence = find_coincidence(index, game["url_name"])
+        if url_name is not None:
+            game["store_url_name"] = game["url_name"]
+            game["url_name"] = url_name
+            game["confidence"] = confidence
             coincidences.append(game)
 
-    logger('INFO', f'{len(coincidences)} coincidences found')
+    coincidences = keep_best_coincidences(coincidences)
+    logger('INFO', f'{len(coincidences)} coincidences found ({sum(1 for c in coincidences if c["confidence"] < 1)} fuzzy)')
 
     write_json(os.path.join("temp", "xbox_coincidences.json"), coincidences)
+    reset_crawled_prices('xbox')
 
-    logger('INFO', 'Started crawling Xbox prices')
-    try:
-        run_crawler('xbox')
-    except:
-        logger('ERROR', traceback.format_exc())
-    logger('INFO', 'Ended crawling Xbox prices')
-
-    logger('INFO', 'Started updating Xbox prices')
-    xbox_coincidences = read_json(os.path.join("temp", "xbox_coincidences.json"))
-    xbox_coincidences_dict = {coincidence["url_name"]: coincidence for coincidence in xbox_coincidences}
-
-    for game in games:
-        if game["url_name"] in xbox_coincidences_dict:
-            if xbox_coincidences_dict[game["url_name"]]["price_in_cents"] is not None:
-                game["stores"]["xbox"]["availability"] = True
-                game["stores"]["xbox"]["price_in_cents"] = xbox_coincidences_dict[game["url_name"]]["price_in_cents"]
-                game["stores"]["xbox"]["price_time"] = xbox_coincidences_dict[game["url_name"]]["price_time"]
-                game["stores"]["xbox"]["url"] = xbox_coincidences_dict[game["url_name"]]["url"]
-                # Prices history (Xbox)
-                if game["stores"]["xbox"]["price_in_cents"] is not None and game["stores"]["xbox"]["price_in_cents"] >= 0:
-                    new_price = {
-                            "price_in_cents": game["stores"]["xbox"]["price_in_cents"],
-                            "price_time": game["stores"]["xbox"]["price_time"],
-                    }
-                    if game["appid"] in prices_history_dict:
-                        if len(prices_history_dict[game["appid"]]["xbox"]) >= history_limit:
-                            prices_history_dict[game["appid"]]["xbox"].pop(0)
-                        prices_history_dict[game["appid"]]["xbox"].append(new_price)
-
-            else:
-                game["stores"]["xbox"]["availability"] = False
-                game["stores"]["xbox"]["price_in_cents"] = xbox_coincidences_dict[game["url_name"]]["price_in_cents"]
-                game["stores"]["xbox"]["price_time"] = get_time()
-                game["stores"]["xbox"]["url"] = None
-        else:
-            game["stores"]["xbox"]["availability"] = False
-            game["stores"]["xbox"]["price_in_cents"] = None
-            game["stores"]["xbox"]["price_time"] = get_time()
-            game["stores"]["xbox"]["url"] = None
-
-    if len(xbox_coincidences_dict) > 0:
-        write_json('games.json', games)
-        write_json('prices_history.json', list(prices_history_dict.values()))
+def get_xbox_product_id(url):
+    """
+    :param url: Xbox store url, e.g. https://www.xbox.com/es-ES/games/store/forza-horizon-5/9NKX70BBCDRN
+    :return: product id (upper case) or None
+    """
+    parts = url.split("store/")[1].split("/")
+    if len(parts) > 1 and parts[1]:
+        return parts[1].split("?")[0].upper()
+    return None
 
-    logger('INFO', 'Ended updating Xbox prices')
+def is_xbox_game_pass_availability(availability):
+    """
+    :param availability: availability of a display catalog SKU
+    :return: True if a Game Pass subscription (xbox_game_pass_ids) grants its license
+    """
+    for entitlement in availability.get("LicensingData", {}).get("SatisfyingEntitlementKeys", []):
+        for key in entitlement.get("EntitlementKeys", []):
+            # big:<product id>:<sku id>
+            parts = key.split(":")
+            if len(parts) > 1 and parts[1].upper() in xbox_game_pass_ids:
+                return True
+    return False
+
+def get_xbox_displaycatalog_price(product):
+    """
+    Lowest purchasable EUR price of a display catalog product, in cents, or -2 if it cannot be bought but is included
+    with Game Pass (as the crawler source reports it).
+    :param product: element of the "Products" list of the display catalog response
+    :return:
+    """
+    price_in_cents = None
+    game_pass = False
+    for sku in product.get("DisplaySkuAvailabilities", []):
+        for availability in sku.get("Availabilities", []):
+            if is_xbox_game_pass_availability(availability):
+                game_pass = True
+            if "Purchase" not in availability.get("Actions", []):
+                continue
+            price = availability.get("OrderManagementData", {}).get("Price", {})
+            if price.get("CurrencyCode") == "EUR" and price.get("ListPrice") is not None:
+                cents = int(round(price["ListPrice"] * 100))
+                if price_in_cents is None or cents < price_in_cents:
+                    price_in_cents = cents
+    if price_in_cents is None and game_pass:
+        return -2
+    return price_in_cents
+
+def fetch_xbox_prices_batched():
+    """
+    Gets the prices of the Xbox coincidences from the display catalog, xbox_batch_size products per request,
+    instead of crawling every product page. Results go to the same store the crawler uses
+    (json_data/temp/xbox_prices.ndjson), so collect_crawled_prices() merges them the same way.
+    :return:
+    """
+    logger('INFO', 'Started fetching Xbox prices from the display catalog')
+    coincidences = read_json(os.path.join("temp", "xbox_coincidences.json"))
+    coincidences_by_id = {}
+    for coincidence in coincidences:
+        product_id = get_xbox_product_id(coincidence["url"])
+        if product_id:
+            coincidences_by_id[product_id] = coincidence
+
+    product_ids = list(coincidences_by_id)
+    count = 0
 
-def fetch_battle_catalog():
-    games = read_json('games.json')
-    prices_history = read_json('prices_history.json')
-    prices_history_dict = {entry["appid"]: entry for entry in prices_history}
-    url_names = []
-    for game in games:
-        url_names.append(game["url_name"])
+    with open(os.path.join(parent_path, "json_data", "temp", "xbox_prices.ndjson"), "a", encoding="utf-8") as f:
+        for i in range(0, len(product_ids), xbox_batch_size):
+            batch = product_ids[i:i + xbox_batch_size]
+            try:
+                response = get_http_session().get(xbox_displaycatalog_url, params={
+                    "bigIds": ",".join(batch),
+                    "market": "ES",
+                    "languages": "es-es"
+                })
+            except requests.RequestException:
+                logger('ERROR', traceback.format_exc())
+                continue
+
+            if response.status_code != 200:
+                logger('ERROR', f'Xbox display catalog batch [{i} - {i + len(batch)}]', response.status_code)
+                continue
+
+            for product in response.json().get("Products", []):
+                coincidence = coincidences_by_id.get(product.get("ProductId", "").upper())
+                if coincidence:
+                    f.write(json.dumps({
+                        "store": "xbox",
+                        "url_name": coincidence["url_name"],
+                        "url": coincidence["url"],
+                        "price_in_cents": get_xbox_displaycatalog_price(product),
+                        "price_time": get_time()
+                    }) + "\n")
+                    count += 1
+            f.flush()
+            logger('INFO', f'Xbox display catalog batch [{i} - {i + len(batch)}]', response.status_code)
+
+    logger('INFO', f'Ended fetching Xbox prices from the display catalog: {count} prices')
+
+def prepare_battle_coincidences():
+    """
+    Matches the Battle.net sitemap against the games catalog and leaves the coincidences ready for the crawler.
+    :return:
+    """
+    index = load_url_names_index()
     coincidences = []
 
     battle_catalog = process_battle_sitemaps()
@@ -926,72 +1465,30 @@ def fetch_battle_catalog():
     logger('INFO', 'Searching for coincidences between Steam and Battle.net catalogs')
 
     for game in battle_catalog:
-        url_name = game["url_name"]
-        if url_name in url_names:
+        url_name, confidence = find_coincidence(index, game["url_name"])
+        if url_name is not None:
             coincidences.append({
                 'url': game["url"],
                 'url_name': url_name,
+                'store_url_name': game["url_name"],
+                'confidence': confidence,
                 'price_in_cents': None,
                 'price_time': None
             })
 
-    write_json(os.path.join("temp", "battle_coincidences.json"), coincidences)
-
-    logger('INFO', f'{len(coincidences)} coincidences found')
-
-    logger('INFO', 'Started crawling Battle.net prices')
-    try:
-        run_crawler('battle')
-    except:
-        logger('ERROR', traceback.format_exc())
-    logger('INFO', 'Ended crawling Battle.net prices')
-
-    logger('INFO', 'Started updating Battle.net prices')
-    battle_coincidences = read_json(os.path.join("temp", "battle_coincidences.json"))
-    battle_coincidences_dict = {coincidence["url_name"]: coincidence for coincidence in battle_coincidences}
-
-    for game in games:
-        if game["url_name"] in battle_coincidences_dict:
-            if battle_coincidences_dict[game["url_name"]]["price_in_cents"] is not None:
-                game["stores"]["battle"]["availability"] = True
-                game["stores"]["battle"]["price_in_cents"] = battle_coincidences_dict[game["url_name"]]["price_in_cents"]
-                game["stores"]["battle"]["price_time"] = battle_coincidences_dict[game["url_name"]]["price_time"]
-                game["stores"]["battle"]["url"] = battle_coincidences_dict[game["url_name"]]["url"]
-                # Prices history (Battle)
-                if game["stores"]["battle"]["price_in_cents"] is not None and game["stores"]["battle"]["price_in_cents"] >= 0:
-                    new_price = {
-                            "price_in_cents": game["stores"]["battle"]["price_in_cents"],
-                            "price_time": game["stores"]["battle"]["price_time"],
-                    }
-                    if game["appid"] in prices_history_dict:
-                        if len(prices_history_dict[game["appid"]]["battle"]) >= history_limit:
-                            prices_history_dict[game["appid"]]["battle"].pop(0)
-                        prices_history_dict[game["appid"]]["battle"].append(new_price)
-
-            else:
-                game["stores"]["battle"]["availability"] = False
-                game["stores"]["battle"]["price_in_cents"] = None
-                game["stores"]["battle"]["price_time"] = get_time()
-                game["stores"]["battle"]["url"] = None
-        else:
-            game["stores"]["battle"]["availability"] = False
-            game["stores"]["battle"]["price_in_cents"] = None
-            game["stores"]["battle"]["price_time"] = get_time()
-            game["stores"]["battle"]["url"] = None
+    coincidences = keep_best_coincidences(coincidences)
 
-    if len(battle_coincidences_dict) > 0:
-        write_json('games.json', games)
-        write_json('prices_history.json', list(prices_history_dict.values()))
+    write_json(os.path.join("temp", "battle_coincidences.json"), coincidences)
+    reset_crawled_prices('battle')
 
-    logger('INFO', 'Ended updating Battle.net prices')
+    logger('INFO', f'{len(coincidences)} coincidences found ({sum(1 for c in coincidences if c["confidence"] < 1)} fuzzy)')
 
-def fetch_gog_catalog():
-    games = read_json('games.json')
-    prices_history = read_json('prices_history.json')
-    prices_history_dict = {entry["appid"]: entry for entry in prices_history}
-    url_names = []
-    for game in games:
-        url_names.append(game["url_name"])
+def prepare_gog_coincidences():
+    """
+    Matches the gog.com sitemap against the games catalog and leaves the coincidences ready for the crawler.
+    :return:
+    """
+    index = load_url_names_index()
     coincidences = []
 
     gog_catalog = process_gog_sitemaps()
@@ -999,79 +1496,484 @@ def fetch_gog_catalog():
     logger('INFO', 'Searching for coincidences between Steam and gog.com catalogs')
 
     for game in gog_catalog:
-        url_name = game["url_name"]
-        if url_name in url_names:
+        url_name, confidence = find_coincidence(index, game["url_name"])
+        if url_name is not None:
             coincidences.append({
                 'url': game["url"],
                 'url_name': url_name,
+                'store_url_name': game["url_name"],
+                'confidence': confidence,
                 'price_in_cents': None,
                 'price_time': None
             })
 
+    coincidences = keep_best_coincidences(coincidences)
+
     write_json(os.path.join("temp", "gog_coincidences.json"), coincidences)
-    logger('INFO', f'{len(coincidences)} coincidences found')
+    reset_crawled_prices('gog')
+    logger('INFO', f'{len(coincidences)} coincidences found ({sum(1 for c in coincidences if c["confidence"] < 1)} fuzzy)')
 
-    logger('INFO', 'Started crawling gog.com prices')
-    try:
-        run_crawler('gog')
-    except:
-        logger('ERROR', traceback.format_exc())
-    logger('INFO', 'Ended crawling gog.com prices')
+def get_gog_catalog_price(product):
+    """
+    :param product: element of the "products" list of the gog.com catalog API
+    :return: final EUR price in cents or None
+    """
+    final_money = (product.get("price") or {}).get("finalMoney") or {}
+    if final_money.get("currency") == "EUR" and final_money.get("amount") is not None:
+        return int(round(float(final_money["amount"]) * 100))
+    return None
 
-    logger('INFO', 'Started updating gog.com prices')
+def fetch_gog_prices_from_catalog():
+    """
+    Pages through the gog.com catalog API (gog_catalog_page_size products with prices per response) and joins the
+    products with the gog.com coincidences on url_name. Prices go to json_data/temp/gog_prices.ndjson, and the
+    crawler only visits the coincidences that are still missing afterwards.
+    :return:
+    """
+    logger('INFO', 'Started fetching gog.com prices from the catalog API')
+    coincidences = read_json(os.path.join("temp", "gog_coincidences.json"))
+    coincidences_dict = {coincidence.get("store_url_name", coincidence["url_name"]): coincidence for coincidence in coincidences}
+    found = set()
+    page = 1
+    pages = 1
+
+    with open(os.path.join(parent_path, "json_data", "temp", "gog_prices.ndjson"), "a", encoding="utf-8") as f:
+        while page <= pages and len(found) < len(coincidences_dict):
+            try:
+                response = get_http_session().get(gog_catalog_url, params={
+                    "limit": gog_catalog_page_size,
+                    "page": page,
+                    "order": "desc:trending",
+                    "productType": "in:game,pack",
+                    "countryCode": "ES",
+                    "locale": "en-US",
+                    "currencyCode": "EUR"
+                })
+            except requests.RequestException:
+                logger('ERROR', traceback.format_exc())
+                break
 
-    gog_coincidences = read_json(os.path.join("temp", "gog_coincidences.json"))
-    gog_coincidences_dict = {coincidence["url_name"]: coincidence for coincidence in gog_coincidences}
+            if response.status_code != 200:
+                logger('ERROR', f'gog.com catalog page {page}', response.status_code)
+                break
 
-    for game in games:
-        if game["url_name"] in gog_coincidences_dict:
-            if gog_coincidences_dict[game["url_name"]]["price_in_cents"] is not None:
-                game["stores"]["gog"]["availability"] = True
-                game["stores"]["gog"]["price_in_cents"] = gog_coincidences_dict[game["url_name"]]["price_in_cents"]
-                game["stores"]["gog"]["price_time"] = gog_coincidences_dict[game["url_name"]]["price_time"]
-                game["stores"]["gog"]["url"] = gog_coincidences_dict[game["url_name"]]["url"]
-                # Prices history (gog)
-                if game["stores"]["gog"]["price_in_cents"] is not None and game["stores"]["gog"]["price_in_cents"] >= 0:
-                    new_price = {
-                            "price_in_cents": game["stores"]["gog"]["price_in_cents"],
-                            "price_time": game["stores"]["gog"]["price_time"],
-                    }
-                    if game["appid"] in prices_history_dict:
-                        if len(prices_history_dict[game["appid"]]["gog"]) >= history_limit:
-                            prices_history_dict[game["appid"]]["gog"].pop(0)
-                        prices_history_dict[game["appid"]]["gog"].append(new_price)
-            else:
-                game["stores"]["gog"]["availability"] = False
-                game["stores"]["gog"]["price_in_cents"] = None
-                game["stores"]["gog"]["price_time"] = get_time()
-                game["stores"]["gog"]["url"] = None
+            data = response.json()
+            pages = data.get("pages", 0)
+            for product in data.get("products", []):
+                store_url_name = (product.get("slug") or "").replace("_", "-")
+                price_in_cents = get_gog_catalog_price(product)
+                if store_url_name in coincidences_dict and store_url_name not in found and price_in_cents is not None:
+                    f.write(json.dumps({
+                        "store": "gog",
+                        "url_name": coincidences_dict[store_url_name]["url_name"],
+                        "url": coincidences_dict[store_url_name]["url"],
+                        "price_in_cents": price_in_cents,
+                        "price_time": get_time()
+                    }) + "\n")
+                    found.add(store_url_name)
+            f.flush()
+            logger('INFO', f'gog.com catalog page {page}/{pages}', response.status_code)
+            page += 1
+
+    logger('INFO', f'Ended fetching gog.com prices from the catalog API: {len(found)}/{len(coincidences_dict)} prices')
+
+def collect_crawled_prices(store):
+    """
+    :param store: "xbox", "battle" or "gog"
+    :return: price delta of the store (see merge_store_deltas), built from its coincidences and crawled prices
+    """
+    prices = {}
+    for url_name, coincidence in read_crawled_coincidences(store).items():
+        if coincidence["price_in_cents"] is not None:
+            prices[url_name] = {
+                "availability": True,
+                "price_in_cents": coincidence["price_in_cents"],
+                "price_time": coincidence["price_time"],
+                "url": coincidence["url"]
+            }
         else:
-            game["stores"]["gog"]["availability"] = False
-            game["stores"]["gog"]["price_in_cents"] = None
-            game["stores"]["gog"]["price_time"] = get_time()
-            game["stores"]["gog"]["url"] = None
+            prices[url_name] = {
+                "availability": False,
+                "price_in_cents": None,
+                "price_time": get_time(),
+                "url": None
+            }
 
-    if len(gog_coincidences_dict) > 0:
-        write_json('games.json', games)
-        write_json('prices_history.json', list(prices_history_dict.values()))
+    return {
+        "store": store,
+        "full": True,
+        "prices": prices
+    }
 
-    logger('INFO', 'Ended updating gog.com prices')
+def prepare_store(store):
+    """
+    Finds the coincidences of a crawled store and gets every price that does not need the crawler.
+    :param store: "xbox", "battle" or "gog"
+    :return:
+    """
+    match store:
+        case "xbox":
+            prepare_xbox_coincidences()
+            if xbox_price_source == 'displaycatalog':
+                fetch_xbox_prices_batched()
+        case "battle":
+            prepare_battle_coincidences()
+        case "gog":
+            prepare_gog_coincidences()
+            if gog_price_source == 'catalog':
+                fetch_gog_prices_from_catalog()
+
+def merge_store_deltas(deltas):
+    """
+    Applies the price deltas of every store to games.json and the prices history in one pass.
 
-def json_to_ndjson(input_filename, output_filename):
-    data = read_json(input_filename)
-    file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
-    with open(file_path, 'w', encoding='utf-8') as f:
-        for item in data:
-            appid = item.get("appid")
-            if appid is not None:
-                meta_line = json.dumps({ "create": { "_id": appid } })
-                doc_line = json.dumps(item, ensure_ascii=False)
-                f.write(meta_line + "\n")
-                f.write(doc_line + "\n")
+    A delta is {"store", "full", "prices": {url_name: store data}, "snapshot" (optional)}. A full delta covers the
+    whole store, so the games it does not list become unavailable there; a partial one only touches its url_names.
+    A full delta without prices is skipped, as it means the store could not be fetched.
+    :param deltas: list of deltas
+    :return:
+    """
+    deltas = [delta for delta in deltas if delta is not None]
+    for delta in deltas:
+        if delta["full"] and not delta["prices"]:
+            logger('ERROR', f'No prices for store {delta["store"]}, skipping its update')
+    deltas = [delta for delta in deltas if delta["prices"] or not delta["full"]]
 
-        logger(f'INFO', f'Formatted JSON file {input_filename} to NDJSON {output_filename}.')
+    logger('INFO', f'Started merging prices of {", ".join(delta["store"] for delta in deltas)}')
+    if any(delta["prices"] or delta["full"] for delta in deltas):
+        games = read_json('games.json')
+        prices_history = read_prices_history()
 
-def json_list_to_ndjson(input_filename, output_filename):
+        for game in games:
+            for delta in deltas:
+                store = delta["store"]
+                if game["url_name"] in delta["prices"]:
+                    game["stores"][store] = dict(delta["prices"][game["url_name"]])
+                    # Prices history
+                    if game["stores"][store]["availability"] and game["stores"][store]["price_in_cents"] is not None and game["stores"][store]["price_in_cents"] >= 0:
+                        prices_history.append(game["appid"], store, game["stores"][store]["price_in_cents"], game["stores"][store]["price_time"])
+                elif delta["full"]:
+                    game["stores"][store]["availability"] = False
+                    game["stores"][store]["price_in_cents"] = None
+                    game["stores"][store]["price_time"] = get_time()
+                    game["stores"][store]["url"] = None
+
+        write_json('games.json', games)
+        write_prices_history(prices_history)
+
+    for delta in deltas:
+        if delta.get("snapshot"):
+            write_json(os.path.join("temp", f'{delta["store"]}_snapshot.json'), delta["snapshot"])
+    logger('INFO', 'Ended merging prices')
+
+def update_deals():
+    """
+    Sets the deal metrics of every game (game["deal"], see price_analytics.py) from its current prices and the
+    prices history. games.json is only written if some of them changed.
+    :return:
+    """
+    logger('INFO', 'Started computing deals')
+    games = read_json('games.json')
+    deals = compute_deals(games, read_prices_history(mmap=True))
+
+    changed = 0
+    for game, deal in zip(games, deals):
+        if game.get("deal") != deal:
+            game["deal"] = deal
+            changed += 1
+
+    if changed:
+        write_json('games.json', games)
+    logger('INFO', f'Ended computing deals: {changed} games changed')
+
+def fetch_store_prices(stores=("epic", "xbox", "battle", "gog")):
+    """
+    Fetches the prices of every given store at the same time and merges them in a single pass over the catalog, so
+    a run takes about as long as the slowest store:
+    - Epic, and the sitemaps, coincidences and batched sources of the crawled stores run in threads.
+    - The stores that still need crawling are crawled together in one in-process Scrapy run (see run_crawlers),
+      on the main thread, while Epic keeps going.
+    - Every store returns a price delta and merge_store_deltas() applies them all at once.
+    The stores that did fail are merged anyway.
+    :param stores: stores to fetch ("epic", "xbox", "battle", "gog")
+    :return: True if no store failed
+    """
+    crawled_stores = [store for store in stores if store in ("xbox", "battle", "gog")]
+    deltas = []
+    completed = True
+
+    # Matching indexes built once before the store threads share them
+    index = load_url_names_index()
+    if fuzzy_matching:
+        get_fuzzy_index(index)
+
+    with ThreadPoolExecutor(max_workers=len(stores)) as executor:
+        epic_future = executor.submit(collect_epic_prices) if "epic" in stores else None
+        prepare_futures = {store: executor.submit(prepare_store, store) for store in crawled_stores}
+
+        for store, future in prepare_futures.items():
+            try:
+                future.result()
+            except:
+                logger('ERROR', f'Preparing store {store}: {traceback.format_exc()}')
+                completed = False
+
+        crawl_modes = list(crawled_stores)
+        if "xbox" in crawl_modes and xbox_price_source == 'displaycatalog':
+            crawl_modes.remove("xbox")
+
+        if crawl_modes:
+            logger('INFO', f'Started crawling {", ".join(crawl_modes)} prices')
+            try:
+                run_crawlers(crawl_modes)
+            except:
+                logger('ERROR', traceback.format_exc())
+                completed = False
+            logger('INFO', f'Ended crawling {", ".join(crawl_modes)} prices')
+
+        for store in crawled_stores:
+            deltas.append(collect_crawled_prices(store))
+
+        if epic_future is not None:
+            try:
+                deltas.append(epic_future.result())
+            except:
+                logger('ERROR', f'Fetching Epic Games prices: {traceback.format_exc()}')
+                completed = False
+
+    merge_store_deltas(deltas)
+    return completed
+
+def fetch_epic_catalog():
+    return fetch_store_prices(("epic",))
+
+def fetch_xbox_catalog():
+    return fetch_store_prices(("xbox",))
+
+def fetch_battle_catalog():
+    return fetch_store_prices(("battle",))
+
+def fetch_gog_catalog():
+    return fetch_store_prices(("gog",))
+
+def json_to_ndjson(input_filename, output_filename):
+    data = read_json(input_filename)
+    file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for item in data:
+            appid = item.get("appid")
+            if appid is not None:
+                meta_line = json.dumps({ "create": { "_id": appid } })
+                doc_line = json.dumps(item, ensure_ascii=False)
+                f.write(meta_line + "\n")
+                f.write(doc_line + "\n")
+
+        logger(f'INFO', f'Formatted JSON file {input_filename} to NDJSON {output_filename}.')
+
+def price_events_to_ndjson(output_filename):
+    """
+    Exports the price changes recorded since the last indexed one (see post_price_events_index) as one flat document
+    per (appid, store, price_time). The _id is built from them, so exporting an event twice never duplicates it.
+
+    The events are selected by the prices history sequence (see PriceHistory.iter_events), not by price_time: crawled
+    prices keep the time they were crawled, and a resumed crawl can merge them after newer Steam prices were indexed.
+    :param output_filename:
+    :return:
+    """
+    state = read_json(price_events_state_filename) or {}
+    since = state.get("indexed_sequence", 0)
+    prices_history = read_prices_history(mmap=True)
+    file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
+    events = 0
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for appid, store, price_in_cents, price_time in prices_history.iter_events(since):
+            meta_line = json.dumps({ "create": { "_id": f"{appid}-{store}-{price_time}" } })
+            doc_line = json.dumps({"appid": appid, "store": store, "price_in_cents": price_in_cents, "price_time": price_time})
+            f.write(meta_line + "\n")
+            f.write(doc_line + "\n")
+            events += 1
+
+        logger(f'INFO', f'Formatted {events} price events since {since} to NDJSON {output_filename}.')
+
+    # Recorded as indexed once the index stage pushes them
+    state["exported_sequence"] = prices_history.sequence
+    write_json(price_events_state_filename, state)
+
+def get_search_document(item):
+    """ :return: search document of a game: the game without its game_detail_fields (see game_details_to_ndjson) """
+    if isinstance(item.get("data"), dict):
+        item["data"] = {key: value for key, value in item["data"].items() if key not in game_detail_fields}
+    return item
+
+def games_to_ndjson(output_filename):
+    """
+    Search documents of the games index (see get_search_document).
+    :param output_filename:
+    :return:
+    """
+    file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for item in read_json('games.json'):
+            item = get_search_document(item)
+            meta_line = json.dumps({ "create": { "_id": item["appid"] } })
+            doc_line = json.dumps(item, ensure_ascii=False)
+            f.write(meta_line + "\n")
+            f.write(doc_line + "\n")
+
+        logger(f'INFO', f'Formatted games search documents to NDJSON {output_filename}.')
+
+def game_details_to_ndjson(output_filename):
+    """
+    Documents of the game details index: the game_detail_fields of every game, keyed by appid.
+    :param output_filename:
+    :return:
+    """
+    file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for item in read_json('games.json'):
+            data = item.get("data") if isinstance(item.get("data"), dict) else {}
+            meta_line = json.dumps({ "index": { "_id": item["appid"] } })
+            doc_line = json.dumps({"appid": item["appid"], "data": {key: data.get(key) for key in game_detail_fields}}, ensure_ascii=False)
+            f.write(meta_line + "\n")
+            f.write(doc_line + "\n")
+
+        logger(f'INFO', f'Formatted game details to NDJSON {output_filename}.')
+
+def build_games_search_file():
+    """
+    Embedded alternative to the games index for deployments without ES (see embedded_search.py): the same search
+    documents and analysis, in json_data/games_search.bin.
+    """
+    analyzer = games_search_profiles[games_search_profile]["analyzer"]
+    # ngram_analyzer terms are 2-3 letters long, so queries are split into n-grams too (whole words only match in the
+    # edge_ngram profiles)
+    search_analyzer = analyzer if analyzer == "ngram_analyzer" else "whitespace_analyzer"
+    file_path = os.path.join(parent_path, 'json_data', 'games_search.bin')
+    documents = (get_search_document(item) for item in read_json('games.json'))
+    count = embedded_search.build(file_path, documents, get_games_index_settings()["settings"]["analysis"], analyzer, search_analyzer)
+    logger('INFO', f'Built embedded games search ({count} games, {games_search_profile} profile)')
+
+def get_index_prices(app):
+    """ :return: fields of a game kept up to date by the price syncs """
+    return {"stores": app.get("stores", {}), "deal": app.get("deal")}
+
+def write_games_index_prices(games):
+    write_json(games_index_prices_filename, {str(app["appid"]): get_index_prices(app) for app in games})
+
+def games_prices_to_ndjson(output_filename):
+    """
+    Partial updates for the games index: only stores.<store> and deal, and only for the apps whose prices differ from
+    the ones last sent (games_index_prices_filename). Apps not in the index yet are left to the next post_games_index.
+    :param output_filename:
+    :return:
+    """
+    index_prices = read_json(games_index_prices_filename) or {}
+    file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
+    updates = 0
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for app in read_json('games.json'):
+            indexed = index_prices.get(str(app["appid"]))
+            if indexed is None:
+                continue
+
+            prices = get_index_prices(app)
+            doc = {}
+            stores = {store: data for store, data in prices["stores"].items() if indexed["stores"].get(store) != data}
+            if stores:
+                doc["stores"] = stores
+            if prices["deal"] != indexed["deal"]:
+                doc["deal"] = prices["deal"]
+
+            if doc:
+                meta_line = json.dumps({ "update": { "_id": app["appid"] } })
+                doc_line = json.dumps({"doc": doc}, ensure_ascii=False)
+                f.write(meta_line + "\n")
+                f.write(doc_line + "\n")
+                updates += 1
+
+        logger(f'INFO', f'Formatted {updates} games price updates to NDJSON {output_filename}.')
+
+def get_autocomplete_suggestions(games, taxonomies):
+    """
+    Suggestions of the autocomplete index: every game, weighted by its total_recommendations, and every developer and
+    publisher, weighted by the total_recommendations of all their games.
+    :param games: games catalog
+    :param taxonomies: taxonomy registry (see load_taxonomies), the developers and publishers keep their id as _id
+    :return: {_id: document}
+    """
+    suggestions = {}
+    companies = {}
+    for game in games:
+        data = game.get("data") if isinstance(game.get("data"), dict) else {}
+        weight = data.get("total_recommendations") or 0
+        words = game["name"].split()
+        # Completion suggesters only match from the start of an input, so later words get inputs of their own
+        inputs = [" ".join(words[i:]) for i in range(min(len(words), autocomplete_max_inputs))] or [game["name"]]
+        suggestions[f"game-{game['appid']}"] = {
+            "type": "game",
+            "appid": game["appid"],
+            "name": game["name"],
+            "suggest": {"input": inputs, "weight": min(weight, 2 ** 31 - 1), "contexts": {"type": ["game"]}}
+        }
+        for kind in ("developer", "publisher"):
+            for company in data.get(f"{kind}s", []):
+                if company:
+                    companies[(kind, company)] = companies.get((kind, company), 0) + weight
+
+    for (kind, company), weight in companies.items():
+        # Not the url_name: it is empty for non-Latin names and the same for names that only differ in accents
+        suggestions[f"{kind}-{taxonomies[f'{kind}s'].ids[company]}"] = {
+            "type": kind,
+            "appid": None,
+            "name": company,
+            "suggest": {"input": [company], "weight": min(weight, 2 ** 31 - 1), "contexts": {"type": [kind]}}
+        }
+    return suggestions
+
+def autocomplete_to_ndjson(output_filename):
+    """
+    Changes of the autocomplete index since its last sync: index actions for the new and changed suggestions and
+    delete actions for the ones that are gone, compared by hash with autocomplete_index_filename.
+    :param output_filename:
+    :return:
+    """
+    indexed = read_json(autocomplete_index_filename) or {}
+    suggestions = get_autocomplete_suggestions(read_json('games.json'), load_taxonomies())
+    file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
+    changes = 0
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for _id, suggestion in suggestions.items():
+            doc_line = json.dumps(suggestion, ensure_ascii=False)
+            if indexed.get(_id) != hashlib.sha1(doc_line.encode("utf-8")).hexdigest():
+                f.write(json.dumps({ "index": { "_id": _id } }) + "\n")
+                f.write(doc_line + "\n")
+                changes += 1
+        for _id in indexed:
+            if _id not in suggestions:
+                f.write(json.dumps({ "delete": { "_id": _id } }) + "\n")
+                changes += 1
+
+        logger(f'INFO', f'Formatted {changes} autocomplete changes ({len(suggestions)} suggestions) to NDJSON {output_filename}.')
+
+def taxonomy_to_ndjson(kind, output_filename):
+    """
+    Terms of a taxonomy (see taxonomy.py) with their usage counts, the id of every term as _id.
+    :param kind: genres, categories, developers, publishers or pegi
+    :param output_filename:
+    :return:
+    """
+    taxonomy = load_taxonomies()[kind]
+    file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for term_id, item in enumerate(taxonomy.to_list()):
+            meta_line = json.dumps({"create": {"_id": term_id}})
+            doc_line = json.dumps(item, ensure_ascii=False)
+            f.write(meta_line + "\n")
+            f.write(doc_line + "\n")
+
+        logger(f'INFO', f'Formatted taxonomy {kind} to NDJSON {output_filename}.')
+
+def json_list_to_ndjson(input_filename, output_filename):
     data = read_json(input_filename)
     formatted_data = [{"name": g} for g in data]
     file_path = os.path.join(parent_path, 'ndjson_data', output_filename)
@@ -1086,6 +1988,346 @@ def json_list_to_ndjson(input_filename, output_filename):
 
         logger(f'INFO', f'Formatted JSON file {input_filename} to NDJSON {output_filename}.')
 
+def get_games_index_settings():
+    """
+    :return: analysis settings of the games index, with the analyzers of every search profile (see games_search_profile)
+    """
+    settings = {
+        "settings": {
+            "index": {
+                "max_ngram_diff": 3
+            },
+            "analysis": {
+                "char_filter": {
+                    "replace_specials": {
+                        "type": "mapping",
+                        "mappings": [
+                            "& => and",
+                            "- => ",
+                            "_ => ",
+                            "'s => s",
+                            "'d => d",
+                            "v.s. => versus",
+                            "vs => versus",
+                            "ep. => episode"
+                        ]
+                    }
+                },
+                "filter": {
+                    "ngram_filter": {
+                        "type": "ngram",
+                        "min_gram": 2,
+                        "max_gram": 3,
+                        "token_chars": ["letter", "digit"]
+                    },
+                    "edge_ngram_filter": {
+                        "type": "edge_ngram",
+                        "min_gram": 2,
+                        "max_gram": 20
+                    },
+                    "synonym_filter": {
+                        "type": "synonym",
+                        "synonyms": [
+                            "i => 1",
+                            "ii => 2",
+                            "iii => 3",
+                            "iv => 4",
+                            "v => 5",
+                            "vi => 6",
+                            "vii => 7",
+                            "viii => 8",
+                            "ix => 9",
+                            "x => 10",
+                            "xi => 11",
+                            "xii => 12",
+                            "xiii => 13",
+                            "xiv => 14",
+                            "xv => 15",
+                            "xvi => 16",
+                            "xvii => 17",
+                            "xviii => 18",
+                            "xix => 19",
+                            "xx => 20"
+                        ]
+                    }
+                },
+                "analyzer": {
+                    "ngram_analyzer": {
+                        "type": "custom",
+                        "char_filter": [
+                            "replace_specials"
+                        ],
+                        "tokenizer": "standard",
+                        "filter": [
+                            "lowercase",
+                            "asciifolding",
+                            "synonym_filter",
+                            "ngram_filter"
+                        ]
+                    },
+                    "edge_ngram_analyzer": {
+                        "type": "custom",
+                        "char_filter": [
+                            "replace_specials"
+                        ],
+                        "tokenizer": "standard",
+                        "filter": [
+                            "lowercase",
+                            "asciifolding",
+                            "synonym_filter",
+                            "edge_ngram_filter"
+                        ]
+                    },
+                    "completion_analyzer": {
+                        "type": "custom",
+                        "char_filter": [
+                            "replace_specials"
+                        ],
+                        "tokenizer": "standard",
+                        "filter": [
+                            "lowercase",
+                            "asciifolding"
+                        ]
+                    },
+                    "whitespace_analyzer": {
+                        "type": "custom",
+                        "char_filter": [
+                            "replace_specials"
+                        ],
+                        "tokenizer": "whitespace",
+                        "filter": [
+                            "lowercase",
+                            "asciifolding",
+                            "synonym_filter"
+                        ]
+                    }
+                },
+                "normalizer": {
+                    "lowercase_normalizer": {
+                        "type": "custom",
+                        "filter": ["lowercase"]
+                    }
+                }
+            }
+        }
+    }
+    return settings
+
+def get_games_mappings(profile):
+    """
+    Fields only shown (urls, images, fetch times) have no doc_values, and the text fields that are only matched, never
+    ranked by length (developers, publishers, categories, genres), have no norms.
+    :param profile: search profile (see games_search_profile)
+    :return: mappings of the games index
+    """
+    text_analyzer = games_search_profiles[profile]["analyzer"]
+    mappings = {
+        "properties": {
+            "appid": {
+                "type": "integer",
+                "index": False
+            },
+            "name": {
+                "type": "text",
+                "analyzer": text_analyzer,
+                "search_analyzer": "whitespace_analyzer",
+                "fields": {
+                    "keyword": {
+                        "type": "keyword",
+                        "ignore_above": 100
+                    },
+                    "sort": {
+                        "type": "keyword",
+                        "normalizer": "lowercase_normalizer"
+                    }
+                }
+            },
+            "last_modified": {
+                "type": "date",
+                "format": "epoch_second",
+                "index": False,
+                "doc_values": False
+            },
+            "last_fetched": {
+                "type": "date",
+                "format": "epoch_second",
+                "index": False,
+                "doc_values": False
+            },
+            "url_name": {
+                "type": "keyword",
+                "index": False,
+                "doc_values": False
+            },
+            "stores": {
+                "type": "object",
+                "properties": {
+                    "steam": {
+                        "properties": {
+                            "availability": {"type": "boolean"},
+                            "price_in_cents": {"type": "integer"},
+                            "price_time": {
+                                "type": "date",
+                                "format": "epoch_second",
+                                "index": False,
+                                "doc_values": False
+                            },
+                            "url": {"type": "keyword", "index": False, "doc_values": False}
+                        }
+                    },
+                    "epic": {
+                        "properties": {
+                            "availability": {"type": "boolean"},
+                            "price_in_cents": {"type": "integer"},
+                            "price_time": {
+                                "type": "date",
+                                "format": "epoch_second",
+                                "index": False,
+                                "doc_values": False
+                            },
+                            "url": {"type": "keyword", "index": False, "doc_values": False}
+                        }
+                    },
+                    "xbox": {
+                        "properties": {
+                            "availability": {"type": "boolean"},
+                            "price_in_cents": {"type": "integer"},
+                            "price_time": {
+                                "type": "date",
+                                "format": "epoch_second",
+                                "index": False,
+                                "doc_values": False
+                            },
+                            "url": {"type": "keyword", "index": False, "doc_values": False}
+                        }
+                    },
+                    "battle": {
+                        "properties": {
+                            "availability": {"type": "boolean"},
+                            "price_in_cents": {"type": "integer"},
+                            "price_time": {
+                                "type": "date",
+                                "format": "epoch_second",
+                                "index": False,
+                                "doc_values": False
+                            },
+                            "url": {"type": "keyword", "index": False, "doc_values": False}
+                        }
+                    },
+                    "gog": {
+                        "properties": {
+                            "availability": {"type": "boolean"},
+                            "price_in_cents": {"type": "integer"},
+                            "price_time": {
+                                "type": "date",
+                                "format": "epoch_second",
+                                "index": False,
+                                "doc_values": False
+                            },
+                            "url": {"type": "keyword", "index": False, "doc_values": False}
+                        }
+                    }
+                }
+            },
+            "deal": {
+                "properties": {
+                    "best_store": {"type": "keyword"},
+                    "best_price_in_cents": {"type": "integer"},
+                    "historical_min_price_in_cents": {"type": "integer"},
+                    "historical_max_price_in_cents": {"type": "integer", "index": False},
+                    "discount_percent": {"type": "integer"},
+                    "at_all_time_low": {"type": "boolean"}
+                }
+            },
+            "metacritic": {
+                "properties": {
+                    "scale": {"type": "integer", "index": False},
+                    "score": {"type": "integer", "index": False},
+                    "url": {"type": "keyword", "index": False, "doc_values": False},
+                    "last_fetched": {
+                        "type": "date",
+                        "format": "epoch_second",
+                        "index": False,
+                        "doc_values": False
+                    }
+                }
+            },
+            "data": {
+                "properties": {
+                    "type": {"type": "keyword", "index": False, "doc_values": False},
+                    "is_free": {"type": "boolean", "index": False, "doc_values": False},
+                    "header_image": {"type": "keyword", "index": False, "doc_values": False},
+                    "capsule_image": {"type": "keyword", "index": False, "doc_values": False},
+                    "website": {"type": "keyword", "index": False, "doc_values": False},
+                    "developers": {
+                        "type": "text",
+                        "analyzer": text_analyzer,
+                        "search_analyzer": "whitespace_analyzer",
+                        "norms": False,
+                        "fields": {
+                            "keyword": {"type": "keyword", "ignore_above": 50}
+                        }
+                    },
+                    "publishers": {
+                        "type": "text",
+                        "analyzer": text_analyzer,
+                        "search_analyzer": "whitespace_analyzer",
+                        "norms": False,
+                        "fields": {
+                            "keyword": {"type": "keyword", "ignore_above": 50}
+                        }
+                    },
+                    "categories": {
+                        "type": "text",
+                        "analyzer": text_analyzer,
+                        "search_analyzer": "whitespace_analyzer",
+                        "norms": False,
+                        "fields": {
+                            "keyword": {"type": "keyword", "ignore_above": 50}
+                        }
+                    },
+                    "genres": {
+                        "type": "text",
+                        "analyzer": text_analyzer,
+                        "search_analyzer": "whitespace_analyzer",
+                        "norms": False,
+                        "fields": {
+                            "keyword": {"type": "keyword", "ignore_above": 50}
+                        }
+                    },
+                    "release_date": {
+                        "properties": {
+                            "coming_soon": {"type": "boolean"},
+                            "date": {
+                                "type": "date",
+                                "format": "epoch_second",
+                                "index": False
+                            },
+                            "year": {"type": "integer"}
+                        }
+                    },
+                    "background_raw": {"type": "keyword", "index": False, "doc_values": False},
+                    "availability_windows": {"type": "boolean"},
+                    "availability_mac": {"type": "boolean"},
+                    "availability_linux": {"type": "boolean"},
+                    "total_recommendations": {"type": "integer"},
+                    "pegi": {
+                        "properties": {
+                            "rating": {"type": "keyword"},
+                            "descriptors": {"type": "text", "index": False}
+                        }
+                    }
+                }
+            }
+        }
+    }
+    if games_search_profiles[profile]["suggest"]:
+        mappings["properties"]["name"]["fields"]["suggest"] = {
+            "type": "completion",
+            "analyzer": "completion_analyzer"
+        }
+    return mappings
+
 def post_games_index():
     def delete_index():
         url = "http://localhost:9200/theeasteregg_games_index"
@@ -1104,390 +2346,392 @@ def post_games_index():
             "Accept": "application/vnd.twitchtv.v3+json"
         }
 
-        response = requests.put(url, headers=headers)
+        # index.sort can only be set when the index is created, with the sort fields already mapped, so the analysis
+        # settings and the mappings go in the same request
+        body = get_games_index_settings()
+        if games_index_sort:
+            body["settings"]["index"].update({f"sort.{key}": value for key, value in games_index_sort.items()})
+        body["mappings"] = get_games_mappings(games_search_profile)
+
+        response = requests.put(url, headers=headers, json=body)
+        if response.status_code >= 400:
+            # Pushing anyway would let the bulk requests auto-create an unsorted index with dynamic mappings and no analyzers
+            logger('ERROR', f'Games index: Create', f'{response.status_code}: {response.text}')
+            raise RuntimeError('Games index: the index could not be created')
         logger('INFO', f'Games index: Create', f'{response.status_code}')
 
-    def close_index():
-        url = "http://localhost:9200/theeasteregg_games_index/_close"
+    def push_data():
+        """ :return: True if every chunk was indexed """
+        BULK_CHUNK_SIZE = 5000
+        ES_URL = "http://localhost:9200/theeasteregg_games_index/_bulk"
 
         headers = {
+            "Accept": "application/vnd.twitchtv.v3+json",
             "Content-Type": "application/x-ndjson"
         }
 
-        response = requests.post(url, headers=headers)
-        logger('INFO', f'Games index: Close', f'{response.status_code}')
+        ndjson_data_path = os.path.join(parent_path, "ndjson_data", "games_bulk.ndjson")
+
+        try:
+            with open(ndjson_data_path, "r", encoding="utf-8") as file:
+                lines = file.readlines()
+
+            if len(lines) % 2 != 0:
+                logger('ERROR', 'Games index: Push data', 'NDJSON format error: odd number of lines')
+                return False
+
+            pushed = True
+            for i in range(0, len(lines), BULK_CHUNK_SIZE):
+                chunk = lines[i:i + BULK_CHUNK_SIZE]
+                body = ''.join(chunk)
+
+                response = requests.post(ES_URL, headers=headers, data=body)
+
+                if response.status_code >= 400:
+                    logger('ERROR', f'Games index: Push data chunk [{i} - {i+BULK_CHUNK_SIZE}]', f'{response.status_code}: {response.text}')
+                    pushed = False
+                elif response.json().get("errors"):
+                    logger('ERROR', f'Games index: Push data chunk [{i} - {i+BULK_CHUNK_SIZE}]', 'some documents were not indexed')
+                    pushed = False
+                else:
+                    logger('INFO', f'Games index: Push data chunk [{i} - {i+BULK_CHUNK_SIZE}]', f'{response.status_code}')
 
-    def config_ngrams_and_synonyms():
-        url = "http://localhost:9200/theeasteregg_games_index/_settings"
+            return pushed
+
+        except Exception:
+            logger('ERROR', 'Games index: Push data', traceback.format_exc())
+            return False
+
+    delete_index()
+    create_index()
+    pushed = push_data()
+    if pushed:
+        # Prices as the index has them now, so the price syncs (see games_prices_to_ndjson) only send what changes next
+        write_games_index_prices(read_json('games.json'))
+    logger('INFO', 'Posted games index')
+    return pushed
+
+def post_games_prices_index():
+    """
+    Applies the partial price updates (see games_prices_to_ndjson) to the games index, without rebuilding it.
+    :return: True if every update was applied
+    """
+    BULK_CHUNK_SIZE = 5000
+    ES_URL = "http://localhost:9200/theeasteregg_games_index/_bulk"
+
+    headers = {
+        "Accept": "application/vnd.twitchtv.v3+json",
+        "Content-Type": "application/x-ndjson"
+    }
+
+    ndjson_data_path = os.path.join(parent_path, "ndjson_data", "games_prices_bulk.ndjson")
+    index_prices = read_json(games_index_prices_filename) or {}
+    updated = 0
+    completed = True
+
+    with open(ndjson_data_path, "r", encoding="utf-8") as file:
+        lines = file.readlines()
+
+    if len(lines) % 2 != 0:
+        logger('ERROR', 'Games index: Push prices', 'NDJSON format error: odd number of lines')
+        return False
+
+    try:
+        for i in range(0, len(lines), BULK_CHUNK_SIZE):
+            chunk = lines[i:i + BULK_CHUNK_SIZE]
+            body = ''.join(chunk)
+
+            response = requests.post(ES_URL, headers=headers, data=body)
+
+            if response.status_code >= 400:
+                logger('ERROR', f'Games index: Push prices chunk [{i} - {i + BULK_CHUNK_SIZE}]', f'{response.status_code}: {response.text}')
+                completed = False
+                continue
+
+            # Only the updates ES applied are recorded, the rest are sent again by the next sync
+            failed = 0
+            for item, doc_line in zip(response.json()["items"], chunk[1::2]):
+                if item["update"]["status"] >= 400:
+                    failed += 1
+                    continue
+                doc = json.loads(doc_line)["doc"]
+                indexed = index_prices[str(item["update"]["_id"])]
+                indexed["stores"].update(doc.get("stores", {}))
+                if "deal" in doc:
+                    indexed["deal"] = doc["deal"]
+                updated += 1
+
+            if failed:
+                logger('ERROR', f'Games index: Push prices chunk [{i} - {i + BULK_CHUNK_SIZE}]', f'{failed} updates failed')
+                completed = False
+            else:
+                logger('INFO', f'Games index: Push prices chunk [{i} - {i + BULK_CHUNK_SIZE}]', f'{response.status_code}')
+    finally:
+        write_json(games_index_prices_filename, index_prices)
+
+    logger('INFO', f'Posted {updated} games price updates')
+    return completed
+
+def post_game_details_index():
+    """
+    Index of the heavy data fields of every game (see game_detail_fields), only read by appid from the product page
+    (see get_game_details). Nothing in it is searchable, it is never deleted and every push overwrites the documents.
+    :return: True if every document was indexed
+    """
+    def index_exists():
+        url = "http://localhost:9200/theeasteregg_game_details_index"
+
+        response = requests.head(url)
+        return response.status_code == 200
+
+    def create_index():
+        url = "http://localhost:9200/theeasteregg_game_details_index"
 
         headers = {
-            "Content-Type": "application/x-ndjson"
+            "Accept": "application/vnd.twitchtv.v3+json"
         }
 
-        payload = {
-            "settings": {
-                "index": {
-                    "max_ngram_diff": 3
-                },
-                "analysis": {
-                    "char_filter": {
-                        "replace_specials": {
-                            "type": "mapping",
-                            "mappings": [
-                                "& => and",
-                                "- => ",
-                                "_ => ",
-                                "'s => s",
-                                "'d => d",
-                                "v.s. => versus",
-                                "vs => versus",
-                                "ep. => episode"
-                            ]
-                        }
-                    },
-                    "filter": {
-                        "ngram_filter": {
-                            "type": "ngram",
-                            "min_gram": 2,
-                            "max_gram": 3,
-                            "token_chars": ["letter", "digit"]
-                        },
-                        "synonym_filter": {
-                            "type": "synonym",
-                            "synonyms": [
-                                "i => 1",
-                                "ii => 2",
-                                "iii => 3",
-                                "iv => 4",
-                                "v => 5",
-                                "vi => 6",
-                                "vii => 7",
-                                "viii => 8",
-                                "ix => 9",
-                                "x => 10",
-                                "xi => 11",
-                                "xii => 12",
-                                "xiii => 13",
-                                "xiv => 14",
-                                "xv => 15",
-                                "xvi => 16",
-                                "xvii => 17",
-                                "xviii => 18",
-                                "xix => 19",
-                                "xx => 20"
-                            ]
-                        }
-                    },
-                    "analyzer": {
-                        "ngram_analyzer": {
-                            "type": "custom",
-                            "char_filter": [
-                                "replace_specials"
-                            ],
-                            "tokenizer": "standard",
-                            "filter": [
-                                "lowercase",
-                                "asciifolding",
-                                "synonym_filter",
-                                "ngram_filter"
-                            ]
-                        },
-                        "whitespace_analyzer": {
-                            "type": "custom",
-                            "char_filter": [
-                                "replace_specials"
-                            ],
-                            "tokenizer": "whitespace",
-                            "filter": [
-                                "lowercase",
-                                "asciifolding",
-                                "synonym_filter"
-                            ]
-                        }
-                    },
-                    "normalizer": {
-                        "lowercase_normalizer": {
-                            "type": "custom",
-                            "filter": ["lowercase"]
-                        }
-                    }
+        body = {
+            "mappings": {
+                "properties": {
+                    "appid": {"type": "integer", "index": False},
+                    "data": {"type": "object", "enabled": False}
                 }
             }
         }
 
-        response = requests.put(url, headers=headers, data=json.dumps(payload))
-        logger('INFO', f'Games index: Configure', f'{response.status_code}')
+        response = requests.put(url, headers=headers, json=body)
+        logger('INFO', f'Game details index: Create', f'{response.status_code}')
 
-    def open_index():
-        url = "http://localhost:9200/theeasteregg_games_index/_open"
+    def push_data():
+        """ :return: True if every chunk was indexed """
+        BULK_CHUNK_SIZE = 2000
+        ES_URL = "http://localhost:9200/theeasteregg_game_details_index/_bulk"
 
         headers = {
+            "Accept": "application/vnd.twitchtv.v3+json",
             "Content-Type": "application/x-ndjson"
         }
 
-        response = requests.post(url, headers=headers)
-        logger('INFO', f'Games index: Open', f'{response.status_code}')
+        ndjson_data_path = os.path.join(parent_path, "ndjson_data", "game_details_bulk.ndjson")
 
-    def map_data():
-        url = "http://localhost:9200/theeasteregg_games_index/_mapping"
+        try:
+            with open(ndjson_data_path, "r", encoding="utf-8") as file:
+                lines = file.readlines()
+
+            if len(lines) % 2 != 0:
+                logger('ERROR', 'Game details index: Push data', 'NDJSON format error: odd number of lines')
+                return False
+
+            pushed = True
+            for i in range(0, len(lines), BULK_CHUNK_SIZE):
+                chunk = lines[i:i + BULK_CHUNK_SIZE]
+                body = ''.join(chunk)
+
+                response = requests.post(ES_URL, headers=headers, data=body)
+
+                if response.status_code >= 400:
+                    logger('ERROR', f'Game details index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]',
+                           f'{response.status_code}: {response.text}')
+                    pushed = False
+                elif response.json().get("errors"):
+                    logger('ERROR', f'Game details index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]',
+                           'some documents were not indexed')
+                    pushed = False
+                else:
+                    logger('INFO', f'Game details index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]',
+                           f'{response.status_code}')
+
+            return pushed
+
+        except Exception:
+            logger('ERROR', 'Game details index: Push data', traceback.format_exc())
+            return False
+
+    if not index_exists():
+        create_index()
+    pushed = push_data()
+    logger('INFO', 'Posted game details index')
+    return pushed
+
+def get_game_details(appid):
+    """
+    :param appid:
+    :return: game_detail_fields of the game from the game details index (None if it is not there)
+    """
+    url = f"http://localhost:9200/theeasteregg_game_details_index/_doc/{appid}"
+
+    response = get_http_session().get(url, params={"_source": "data"})
+    if response.status_code != 200:
+        return None
+    return response.json()["_source"]["data"]
+
+def get_games_listing(sort_field, order, filters=None, size=20):
+    """
+    Top games of a listing (e.g. "deal.best_price_in_cents" asc, "data.total_recommendations" desc). When the listing
+    is sorted like the index (games_index_sort), ES stops reading every segment after its first hits, as the total
+    number of hits is not tracked.
+    :param sort_field:
+    :param order: "asc" or "desc"
+    :param filters: ES filter clauses (e.g. [{"term": {"stores.epic.availability": True}}])
+    :param size: max games
+    :return: games documents
+    """
+    url = "http://localhost:9200/theeasteregg_games_index/_search"
+
+    body = {
+        "query": {"bool": {"filter": filters or []}},
+        "sort": [{sort_field: {"order": order, "missing": "_last"}}],
+        "track_total_hits": False,
+        "size": size
+    }
+
+    response = get_http_session().post(url, json=body)
+    if response.status_code >= 400:
+        logger('ERROR', f'Games index: Listing {sort_field} {order}', f'{response.status_code}: {response.text}')
+        return []
+    return [hit["_source"] for hit in response.json()["hits"]["hits"]]
+
+def post_autocomplete_index():
+    """
+    Applies the autocomplete changes (see autocomplete_to_ndjson) to the autocomplete index, created on first use: a
+    small index of names only, so the type-ahead never touches the games index.
+    :return: True if every change was applied
+    """
+    def index_exists():
+        url = "http://localhost:9200/theeasteregg_autocomplete_index"
+
+        response = requests.head(url)
+        return response.status_code == 200
+
+    def create_index():
+        url = "http://localhost:9200/theeasteregg_autocomplete_index"
 
         headers = {
-            "Accept": "application/vnd.twitchtv.v3+json",
-            "Content-Type": "application/x-ndjson",
+            "Accept": "application/vnd.twitchtv.v3+json"
         }
 
-        body = {
+        body = get_games_index_settings()
+        body["mappings"] = {
+            "dynamic": "strict",
             "properties": {
-                "appid": {
-                    "type": "integer",
-                    "index": False
-                },
+                "type": {"type": "keyword"},
+                "appid": {"type": "integer", "index": False},
                 "name": {
                     "type": "text",
-                    "analyzer": "ngram_analyzer",
+                    "analyzer": "edge_ngram_analyzer",
                     "search_analyzer": "whitespace_analyzer",
-                    "fields": {
-                        "keyword": {
-                            "type": "keyword",
-                            "ignore_above": 100
-                        },
-                        "sort": {
-                            "type": "keyword",
-                            "normalizer": "lowercase_normalizer"
-                        }
-                    }
-                },
-                "last_modified": {
-                    "type": "date",
-                    "format": "epoch_second",
-                    "index": False
-                },
-                "last_fetched": {
-                    "type": "date",
-                    "format": "epoch_second",
-                    "index": False
-                },
-                "url_name": {
-                    "type": "keyword",
-                    "index": False
+                    "norms": False
                 },
-                "stores": {
-                    "type": "object",
-                    "properties": {
-                        "steam": {
-                            "properties": {
-                                "availability": {"type": "boolean"},
-                                "price_in_cents": {"type": "integer"},
-                                "price_time": {
-                                    "type": "date",
-                                    "format": "epoch_second",
-                                    "index": False
-                                },
-                                "url": {"type": "keyword", "index": False}
-                            }
-                        },
-                        "epic": {
-                            "properties": {
-                                "availability": {"type": "boolean"},
-                                "price_in_cents": {"type": "integer"},
-                                "price_time": {
-                                    "type": "date",
-                                    "format": "epoch_second",
-                                    "index": False
-                                },
-                                "url": {"type": "keyword", "index": False}
-                            }
-                        },
-                        "xbox": {
-                            "properties": {
-                                "availability": {"type": "boolean"},
-                                "price_in_cents": {"type": "integer"},
-                                "price_time": {
-                                    "type": "date",
-                                    "format": "epoch_second",
-                                    "index": False
-                                },
-                                "url": {"type": "keyword", "index": False}
-                            }
-                        },
-                        "battle": {
-                            "properties": {
-                                "availability": {"type": "boolean"},
-                                "price_in_cents": {"type": "integer"},
-                                "price_time": {
-                                    "type": "date",
-                                    "format": "epoch_second",
-                                    "index": False
-                                },
-                                "url": {"type": "keyword", "index": False}
-                            }
-                        },
-                        "gog": {
-                            "properties": {
-                                "availability": {"type": "boolean"},
-                                "price_in_cents": {"type": "integer"},
-                                "price_time": {
-                                    "type": "date",
-                                    "format": "epoch_second",
-                                    "index": False
-                                },
-                                "url": {"type": "keyword", "index": False}
-                            }
-                        }
-                    }
-                },
-                "metacritic": {
-                    "properties": {
-                        "scale": {"type": "integer", "index": False},
-                        "score": {"type": "integer", "index": False},
-                        "url": {"type": "keyword", "index": False},
-                        "last_fetched": {
-                            "type": "date",
-                            "format": "epoch_second",
-                            "index": False
-                        }
-                    }
-                },
-                "data": {
-                    "properties": {
-                        "type": {"type": "keyword", "index": False},
-                        "is_free": {"type": "boolean", "index": False},
-                        "about_the_game": {"type": "text", "index": False},
-                        "short_description": {"type": "text", "index": False},
-                        "supported_languages": {"type": "text", "index": False},
-                        "header_image": {"type": "keyword", "index": False},
-                        "capsule_image": {"type": "keyword", "index": False},
-                        "website": {"type": "keyword", "index": False},
-                        "pc_requirements": {
-                            "properties": {
-                                "minimum": {"type": "text", "index": False},
-                                "recommended": {"type": "text", "index": False}
-                            }
-                        },
-                        "mac_requirements": {
-                            "properties": {
-                                "minimum": {"type": "text", "index": False},
-                                "recommended": {"type": "text", "index": False}
-                            }
-                        },
-                        "linux_requirements": {
-                            "properties": {
-                                "minimum": {"type": "text", "index": False},
-                                "recommended": {"type": "text", "index": False}
-                            }
-                        },
-                        "legal_notice": {"type": "text", "index": False},
-                        "developers": {
-                            "type": "text",
-                            "analyzer": "ngram_analyzer",
-                            "search_analyzer": "whitespace_analyzer",
-                            "fields": {
-                                "keyword": {"type": "keyword", "ignore_above": 50}
-                            }
-                        },
-                        "publishers": {
-                            "type": "text",
-                            "analyzer": "ngram_analyzer",
-                            "search_analyzer": "whitespace_analyzer",
-                            "fields": {
-                                "keyword": {"type": "keyword", "ignore_above": 50}
-                            }
-                        },
-                        "categories": {
-                            "type": "text",
-                            "analyzer": "ngram_analyzer",
-                            "search_analyzer": "whitespace_analyzer",
-                            "fields": {
-                                "keyword": {"type": "keyword", "ignore_above": 50}
-                            }
-                        },
-                        "genres": {
-                            "type": "text",
-                            "analyzer": "ngram_analyzer",
-                            "search_analyzer": "whitespace_analyzer",
-                            "fields": {
-                                "keyword": {"type": "keyword", "ignore_above": 50}
-                            }
-                        },
-                        "screenshots": {"type": "keyword", "index": False},
-                        "movies": {
-                            "type": "object",
-                            "properties": {
-                                "id": {"type": "integer", "index": False},
-                                "thumbnail": {"type": "keyword", "index": False}
-                            }
-                        },
-                        "release_date": {
-                            "properties": {
-                                "coming_soon": {"type": "boolean"},
-                                "date": {
-                                    "type": "date",
-                                    "format": "epoch_second",
-                                    "index": False
-                                },
-                                "year": {"type": "integer"}
-                            }
-                        },
-                        "background_raw": {"type": "keyword", "index": False},
-                        "availability_windows": {"type": "boolean"},
-                        "availability_mac": {"type": "boolean"},
-                        "availability_linux": {"type": "boolean"},
-                        "total_recommendations": {"type": "integer"},
-                        "pegi": {
-                            "properties": {
-                                "rating": {"type": "keyword"},
-                                "descriptors": {"type": "text", "index": False}
-                            }
-                        }
-                    }
+                "suggest": {
+                    "type": "completion",
+                    "analyzer": "completion_analyzer",
+                    "contexts": [{"name": "type", "type": "category"}]
                 }
             }
         }
 
         response = requests.put(url, headers=headers, json=body)
-        logger('INFO', f'Games index: Map data', f'{response.status_code}')
+        logger('INFO', f'Autocomplete index: Create', f'{response.status_code}')
 
-    def push_data():
+    def push_data(indexed):
+        """ Records in indexed the changes ES applied. :return: True if every change was applied """
         BULK_CHUNK_SIZE = 5000
-        ES_URL = "http://localhost:9200/theeasteregg_games_index/_bulk"
+        ES_URL = "http://localhost:9200/theeasteregg_autocomplete_index/_bulk"
 
         headers = {
             "Accept": "application/vnd.twitchtv.v3+json",
             "Content-Type": "application/x-ndjson"
         }
 
-        ndjson_data_path = os.path.join(parent_path, "ndjson_data", "games_bulk.ndjson")
+        ndjson_data_path = os.path.join(parent_path, "ndjson_data", "autocomplete_bulk.ndjson")
 
-        try:
-            with open(ndjson_data_path, "r", encoding="utf-8") as file:
-                lines = file.readlines()
+        with open(ndjson_data_path, "r", encoding="utf-8") as file:
+            lines = file.readlines()
 
-            if len(lines) % 2 != 0:
-                logger('ERROR', 'Games index: Push data', 'NDJSON format error: odd number of lines')
-                return
+        # Delete actions have no document line, so the actions are grouped before chunking
+        actions = []
+        i = 0
+        while i < len(lines):
+            meta = json.loads(lines[i])
+            if "delete" in meta:
+                actions.append((meta, None))
+                i += 1
+            else:
+                actions.append((meta, lines[i + 1]))
+                i += 2
+
+        pushed = True
+        for i in range(0, len(actions), BULK_CHUNK_SIZE):
+            chunk = actions[i:i + BULK_CHUNK_SIZE]
+            body = ''.join(json.dumps(meta) + "\n" + (doc_line or "") for meta, doc_line in chunk)
+
+            response = requests.post(ES_URL, headers=headers, data=body.encode("utf-8"))
+
+            if response.status_code >= 400:
+                logger('ERROR', f'Autocomplete index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]', f'{response.status_code}: {response.text}')
+                pushed = False
+                continue
+
+            failed = 0
+            for item, (meta, doc_line) in zip(response.json()["items"], chunk):
+                action, result = next(iter(item.items()))
+                if action == "delete" and result["status"] in (200, 404):
+                    indexed.pop(meta["delete"]["_id"], None)
+                elif action == "index" and result["status"] < 400:
+                    indexed[meta["index"]["_id"]] = hashlib.sha1(doc_line.rstrip("\n").encode("utf-8")).hexdigest()
+                else:
+                    failed += 1
 
-            for i in range(0, len(lines), BULK_CHUNK_SIZE):
-                chunk = lines[i:i + BULK_CHUNK_SIZE]
-                body = ''.join(chunk)
+            if failed:
+                logger('ERROR', f'Autocomplete index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]', f'{failed} actions failed')
+                pushed = False
+            else:
+                logger('INFO', f'Autocomplete index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]', f'{response.status_code}')
 
-                response = requests.post(ES_URL, headers=headers, data=body)
+        return pushed
 
-                if response.status_code >= 400:
-                    logger('ERROR', f'Games index: Push data chunk [{i} - {i+BULK_CHUNK_SIZE}]', f'{response.status_code}: {response.text}')
-                else:
-                    logger('INFO', f'Games index: Push data chunk [{i} - {i+BULK_CHUNK_SIZE}]', f'{response.status_code}')
+    indexed = read_json(autocomplete_index_filename) or {}
+    if not index_exists():
+        create_index()
+        if indexed:
+            # New (or deleted) index: the next sync sends every suggestion
+            logger('INFO', 'Autocomplete index: created, the next sync will send every suggestion')
+            indexed = {}
 
-        except Exception:
-            logger('ERROR', 'Games index: Push data', traceback.format_exc())
+    try:
+        pushed = push_data(indexed)
+    finally:
+        write_json(autocomplete_index_filename, indexed)
+    logger('INFO', f'Posted autocomplete index ({len(indexed)} suggestions)')
+    return pushed
 
-    delete_index()
-    create_index()
-    close_index()
-    config_ngrams_and_synonyms()
-    open_index()
-    map_data()
-    push_data()
-    logger('INFO', 'Posted games index')
+def get_suggestions(prefix, types=None, size=8):
+    """
+    Type-ahead suggestions from the autocomplete index, best weighted first.
+    :param prefix: text typed so far
+    :param types: only these types ("game", "developer", "publisher"), all if None
+    :param size: max suggestions
+    :return: [{"type", "appid", "name"}]
+    """
+    url = "http://localhost:9200/theeasteregg_autocomplete_index/_search"
+
+    completion = {"field": "suggest", "size": size, "skip_duplicates": True}
+    if types:
+        completion["contexts"] = {"type": list(types)}
+
+    body = {
+        "suggest": {
+            "names": {"prefix": prefix, "completion": completion}
+        },
+        "_source": ["type", "appid", "name"]
+    }
+
+    response = get_http_session().post(url, json=body)
+    if response.status_code >= 400:
+        logger('ERROR', f'Autocomplete index: Suggest {prefix}', f'{response.status_code}: {response.text}')
+        return []
+    return [option["_source"] for option in response.json()["suggest"]["names"][0]["options"]]
 
 def post_categories_index():
     def delete_index():
@@ -1528,7 +2772,8 @@ def post_categories_index():
                             "ignore_above": 100
                         }
                     }
-                }
+                },
+                "count": {"type": "integer"}
             }
         }
 
@@ -1536,6 +2781,7 @@ def post_categories_index():
         logger('INFO', f'Categories index: Map data', f'{response.status_code}')
 
     def push_data():
+        """ :return: True if every document was indexed """
         url = "http://localhost:9200/theeasteregg_categories_index/_bulk"
 
         headers = {
@@ -1548,16 +2794,24 @@ def post_categories_index():
         try:
             with open(ndjson_data_path, "r", encoding="utf-8") as file:
                 body_content = file.read()
+                if not body_content:
+                    return True
                 response = requests.put(url, headers=headers, data=body_content)
-                logger('INFO', f'Categories index: Push data', f'{response.status_code}')
+            if response.status_code >= 400 or response.json().get("errors"):
+                logger('ERROR', f'Categories index: Push data', f'{response.status_code}: {response.text[:500]}')
+                return False
+            logger('INFO', f'Categories index: Push data', f'{response.status_code}')
+            return True
         except:
             logger('ERROR', 'Categories index: Push data', traceback.format_exc())
+            return False
 
     delete_index()
     create_index()
     map_data()
-    push_data()
+    pushed = push_data()
     logger('INFO', 'Posted categories index')
+    return pushed
 
 def post_genres_index():
     def delete_index():
@@ -1598,7 +2852,8 @@ def post_genres_index():
                             "ignore_above": 100
                         }
                     }
-                }
+                },
+                "count": {"type": "integer"}
             }
         }
 
@@ -1606,6 +2861,7 @@ def post_genres_index():
         logger('INFO', f'Genres index: Map data', f'{response.status_code}')
 
     def push_data():
+        """ :return: True if every document was indexed """
         url = "http://localhost:9200/theeasteregg_genres_index/_bulk"
 
         headers = {
@@ -1618,16 +2874,24 @@ def post_genres_index():
         try:
             with open(ndjson_data_path, "r", encoding="utf-8") as file:
                 body_content = file.read()
+                if not body_content:
+                    return True
                 response = requests.put(url, headers=headers, data=body_content)
-                logger('INFO', f'Genres index: Push data', f'{response.status_code}')
+            if response.status_code >= 400 or response.json().get("errors"):
+                logger('ERROR', f'Genres index: Push data', f'{response.status_code}: {response.text[:500]}')
+                return False
+            logger('INFO', f'Genres index: Push data', f'{response.status_code}')
+            return True
         except:
             logger('ERROR', 'Genres index: Push data', traceback.format_exc())
+            return False
 
     delete_index()
     create_index()
     map_data()
-    push_data()
+    pushed = push_data()
     logger('INFO', 'Posted genres index')
+    return pushed
 
 def post_developers_index():
     def delete_index():
@@ -1668,7 +2932,8 @@ def post_developers_index():
                             "ignore_above": 100
                         }
                     }
-                }
+                },
+                "count": {"type": "integer"}
             }
         }
 
@@ -1676,6 +2941,7 @@ def post_developers_index():
         logger('INFO', f'Developers index: Map data', f'{response.status_code}')
 
     def push_data():
+        """ :return: True if every document was indexed """
         url = "http://localhost:9200/theeasteregg_developers_index/_bulk"
 
         headers = {
@@ -1688,16 +2954,24 @@ def post_developers_index():
         try:
             with open(ndjson_data_path, "r", encoding="utf-8") as file:
                 body_content = file.read()
+                if not body_content:
+                    return True
                 response = requests.put(url, headers=headers, data=body_content)
-                logger('INFO', f'Developers index: Push data', f'{response.status_code}')
+            if response.status_code >= 400 or response.json().get("errors"):
+                logger('ERROR', f'Developers index: Push data', f'{response.status_code}: {response.text[:500]}')
+                return False
+            logger('INFO', f'Developers index: Push data', f'{response.status_code}')
+            return True
         except:
             logger('ERROR', 'Developers index: Push data', traceback.format_exc())
+            return False
 
     delete_index()
     create_index()
     map_data()
-    push_data()
+    pushed = push_data()
     logger('INFO', 'Posted developers index')
+    return pushed
 
 def post_publishers_index():
     def delete_index():
@@ -1738,7 +3012,8 @@ def post_publishers_index():
                             "ignore_above": 100
                         }
                     }
-                }
+                },
+                "count": {"type": "integer"}
             }
         }
 
@@ -1746,6 +3021,7 @@ def post_publishers_index():
         logger('INFO', f'Publishers index: Map data', f'{response.status_code}')
 
     def push_data():
+        """ :return: True if every document was indexed """
         url = "http://localhost:9200/theeasteregg_publishers_index/_bulk"
 
         headers = {
@@ -1758,16 +3034,24 @@ def post_publishers_index():
         try:
             with open(ndjson_data_path, "r", encoding="utf-8") as file:
                 body_content = file.read()
+                if not body_content:
+                    return True
                 response = requests.put(url, headers=headers, data=body_content)
-                logger('INFO', f'Publishers index: Push data', f'{response.status_code}')
+            if response.status_code >= 400 or response.json().get("errors"):
+                logger('ERROR', f'Publishers index: Push data', f'{response.status_code}: {response.text[:500]}')
+                return False
+            logger('INFO', f'Publishers index: Push data', f'{response.status_code}')
+            return True
         except:
             logger('ERROR', 'Publishers index: Push data', traceback.format_exc())
+            return False
 
     delete_index()
     create_index()
     map_data()
-    push_data()
+    pushed = push_data()
     logger('INFO', 'Posted publishers index')
+    return pushed
 
 def post_pegi_index():
     def delete_index():
@@ -1808,7 +3092,8 @@ def post_pegi_index():
                             "ignore_above": 20
                         }
                     }
-                }
+                },
+                "count": {"type": "integer"}
             }
         }
 
@@ -1816,6 +3101,7 @@ def post_pegi_index():
         logger('INFO', f'PEGI index: Map data', f'{response.status_code}')
 
     def push_data():
+        """ :return: True if every document was indexed """
         url = "http://localhost:9200/theeasteregg_pegi_index/_bulk"
 
         headers = {
@@ -1828,111 +3114,91 @@ def post_pegi_index():
         try:
             with open(ndjson_data_path, "r", encoding="utf-8") as file:
                 body_content = file.read()
+                if not body_content:
+                    return True
                 response = requests.put(url, headers=headers, data=body_content)
-                logger('INFO', f'PEGI index: Push data', f'{response.status_code}')
+            if response.status_code >= 400 or response.json().get("errors"):
+                logger('ERROR', f'PEGI index: Push data', f'{response.status_code}: {response.text[:500]}')
+                return False
+            logger('INFO', f'PEGI index: Push data', f'{response.status_code}')
+            return True
         except:
             logger('ERROR', 'PEGI index: Push data', traceback.format_exc())
+            return False
 
     delete_index()
     create_index()
     map_data()
-    push_data()
+    pushed = push_data()
     logger('INFO', 'Posted PEGI index')
+    return pushed
 
-def post_prices_history_index():
-    def delete_index():
-        url = "http://localhost:9200/theeasteregg_prices_history_index"
-
-        headers = {
-            "Accept": "application/vnd.twitchtv.v3+json"
-        }
+def post_price_events_index():
+    """
+    Appends the exported price events (see price_events_to_ndjson) to the price events index, created on first use.
+    Unlike the other indexes it is never deleted: every run only adds the new events, and the prices history sequence
+    they were exported at is kept in price_events_state_filename as indexed_sequence, for the next export.
+    """
+    def index_exists():
+        url = "http://localhost:9200/theeasteregg_price_events_index"
 
-        response = requests.delete(url, headers=headers)
-        logger('INFO', f'Prices history index: Delete', f'{response.status_code}')
+        response = requests.head(url)
+        return response.status_code == 200
 
     def create_index():
-        url = "http://localhost:9200/theeasteregg_prices_history_index"
+        url = "http://localhost:9200/theeasteregg_price_events_index"
 
         headers = {
             "Accept": "application/vnd.twitchtv.v3+json"
         }
 
-        response = requests.put(url, headers=headers)
-        logger('INFO', f'Prices history index: Create', f'{response.status_code}')
-
-    def map_data():
-        url = "http://localhost:9200/theeasteregg_prices_history_index/_mapping"
-
-        headers = {
-            "Accept": "application/vnd.twitchtv.v3+json",
-            "Content-Type": "application/x-ndjson"
-        }
-
+        # Sorted by time on disk, so the time-sorted history searches (see get_price_events) read it in order.
+        # index.sort can only be set when the index is created, with price_time already mapped, so the settings and
+        # the mappings go in the same request
         body = {
-            "properties": {
-                "appid": {
-                    "type": "integer",
-                    "index": False
-                },
-                "steam": {
-                    "type": "nested",
-                    "properties": {
-                        "price_in_cents": {"type": "integer", "index": False},
-                        "price_time": {"type": "long", "index": False}
-                    }
-                },
-                "epic": {
-                    "type": "nested",
-                    "properties": {
-                        "price_in_cents": {"type": "integer", "index": False},
-                        "price_time": {"type": "long", "index": False}
-                    }
-                },
-                "xbox": {
-                    "type": "nested",
-                    "properties": {
-                        "price_in_cents": {"type": "integer", "index": False},
-                        "price_time": {"type": "long", "index": False}
-                    }
-                },
-                "battle": {
-                    "type": "nested",
-                    "properties": {
-                        "price_in_cents": {"type": "integer", "index": False},
-                        "price_time": {"type": "long", "index": False}
-                    }
-                },
-                "gog": {
-                    "type": "nested",
-                    "properties": {
-                        "price_in_cents": {"type": "integer", "index": False},
-                        "price_time": {"type": "long", "index": False}
-                    }
+            "settings": {
+                "index": {
+                    "sort.field": "price_time",
+                    "sort.order": "asc"
+                }
+            },
+            "mappings": {
+                "dynamic": "strict",
+                "properties": {
+                    "appid": {"type": "integer"},
+                    "store": {"type": "keyword"},
+                    "price_in_cents": {"type": "integer", "index": False},
+                    "price_time": {"type": "date", "format": "epoch_second"}
                 }
             }
         }
 
         response = requests.put(url, headers=headers, json=body)
-        logger('INFO', f'Prices history index: Map data', f'{response.status_code}')
+        if response.status_code >= 400:
+            # Pushing anyway would let the bulk requests auto-create an unsorted index with dynamic mappings
+            logger('ERROR', f'Price events index: Create', f'{response.status_code}: {response.text}')
+            raise RuntimeError('Price events index: the index could not be created')
+        logger('INFO', f'Price events index: Create', f'{response.status_code}')
 
     def push_data():
+        """ :return: True if every event was indexed """
         BULK_CHUNK_SIZE = 5000
-        ES_URL = "http://localhost:9200/theeasteregg_prices_history_index/_bulk"
+        ES_URL = "http://localhost:9200/theeasteregg_price_events_index/_bulk"
 
         headers = {
             "Accept": "application/vnd.twitchtv.v3+json",
             "Content-Type": "application/x-ndjson"
         }
 
-        ndjson_data_path = os.path.join(parent_path, "ndjson_data", "prices_history_bulk.ndjson")
+        ndjson_data_path = os.path.join(parent_path, "ndjson_data", "price_events_bulk.ndjson")
 
         try:
             with open(ndjson_data_path, "r", encoding="utf-8") as file:
                 lines = file.readlines()
 
             if len(lines) % 2 != 0:
-                logger('ERROR', 'Prices history index: Push data', 'NDJSON format error: odd number of lines')
-                return
+                logger('ERROR', 'Price events index: Push data', 'NDJSON format error: odd number of lines')
+                return False
 
             for i in range(0, len(lines), BULK_CHUNK_SIZE):
                 chunk = lines[i:i + BULK_CHUNK_SIZE]
@@ -1941,20 +3207,71 @@ def post_prices_history_index():
                 response = requests.post(ES_URL, headers=headers, data=body)
 
                 if response.status_code >= 400:
-                    logger('ERROR', f'Prices history index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]',
+                    logger('ERROR', f'Price events index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]',
                            f'{response.status_code}: {response.text}')
-                else:
-                    logger('INFO', f'Prices history index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]',
-                           f'{response.status_code}')
+                    return False
+
+                # Events already in the index (409, e.g. a retried run) are not errors
+                failed = [item["create"] for item in response.json()["items"] if item["create"]["status"] >= 400 and item["create"]["status"] != 409]
+                if failed:
+                    logger('ERROR', f'Price events index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]',
+                           f'{len(failed)} failed: {failed[0].get("error")}')
+                    return False
+                logger('INFO', f'Price events index: Push data chunk [{i} - {i + BULK_CHUNK_SIZE}]',
+                       f'{response.status_code}')
 
         except Exception:
-            logger('ERROR', 'Prices history index: Push data', traceback.format_exc())
+            logger('ERROR', 'Price events index: Push data', traceback.format_exc())
+            return False
+        return True
+
+    state = read_json(price_events_state_filename) or {}
+    created = False
+    if not index_exists():
+        create_index()
+        created = True
+
+    if not push_data():
+        raise RuntimeError('Price events index: some events were not indexed')
+
+    if created and state.get("indexed_sequence", 0):
+        # New (or deleted) index: the next export sends again every sample still kept in the prices history
+        logger('INFO', 'Price events index: created, the next export will include every kept sample')
+        state["indexed_sequence"] = 0
+    else:
+        state["indexed_sequence"] = state.get("exported_sequence", 0)
+    write_json(price_events_state_filename, state)
+    logger('INFO', f'Posted price events index (until sequence {state["indexed_sequence"]})')
 
-    delete_index()
-    create_index()
-    map_data()
-    push_data()
-    logger('INFO', 'Posted prices history index')
+def get_price_events(appid, store=None, since=None, size=1000):
+    """
+    Prices history of an app from the price events index, through a filtered, time-sorted search.
+    :param appid:
+    :param store: only the events of this store (all stores if None)
+    :param since: only the events from this unix time
+    :param size: max events
+    :return: [{"store", "price_in_cents", "price_time"}], oldest first
+    """
+    url = "http://localhost:9200/theeasteregg_price_events_index/_search"
+
+    filters = [{"term": {"appid": appid}}]
+    if store is not None:
+        filters.append({"term": {"store": store}})
+    if since is not None:
+        filters.append({"range": {"price_time": {"gte": since}}})
+
+    body = {
+        "query": {"bool": {"filter": filters}},
+        "sort": [{"price_time": "asc"}],
+        "_source": ["store", "price_in_cents", "price_time"],
+        "size": size
+    }
+
+    response = get_http_session().post(url, json=body)
+    if response.status_code >= 400:
+        logger('ERROR', f'Price events index: Search {appid}', f'{response.status_code}: {response.text}')
+        return []
+    return [hit["_source"] for hit in response.json()["hits"]["hits"]]
 
 def send_status_email(data):
     exec_no = data["exec_no"]
@@ -2001,36 +3318,6 @@ def send_status_email(data):
     logger('INFO', 'Sent status email')
 
 if __name__ == '__main__':
-    try:
-        initialize()
-        #fetch_steam_catalog()
-        fetch_steam_catalog_by_ids([10, 311210, 1174180, 377160, 552520, 2344520, 1985820, 1091500, 214490, 1002300, 1245620, 646270, 235600, 1888930, 1716740, 268910, 3180070, 1716740, 668580, 202970, 235600, 1771300, 1085660, 2767030, 578080, 1962663, 1665460, 440, 570, 224880, 17390]) # TEST
-        fetch_steam_details()
-        #fetch_epic_catalog()
-        #fetch_battle_catalog()
-        #fetch_xbox_catalog()
-        #fetch_gog_catalog()
-
-        # ----------
-        json_to_ndjson("games.json", "games_bulk.ndjson")
-        json_list_to_ndjson("categories.json", "categories_bulk.ndjson")
-        json_list_to_ndjson("genres.json", "genres_bulk.ndjson")
-        json_list_to_ndjson("developers.json", "developers_bulk.ndjson")
-        json_list_to_ndjson("publishers.json", "publishers_bulk.ndjson")
-        json_list_to_ndjson("pegi.json", "pegi_bulk.ndjson")
-        json_to_ndjson("prices_history.json", "prices_history_bulk.ndjson")
-
-        # ----------
-        post_games_index()
-        post_categories_index()
-        post_genres_index()
-        post_developers_index()
-        post_publishers_index()
-        post_pegi_index()
-        post_prices_history_index()
-
-        # ----------
-        #finalize()
-    except:
-        #finalize(traceback.format_exc())
-        logger('ERROR', traceback.format_exc())
+    # The run is defined as a stage graph in pipeline.py (python pipeline.py --list)
+    import pipeline
+    pipeline.run()
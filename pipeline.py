@@ -0,0 +1,320 @@
+"""
+Stage graph of a full run: fetch -> merge -> analytics -> export -> index.
+
+Every stage declares the stages it runs after and the files it reads. Before running a stage its inputs are
+fingerprinted, and if they match the fingerprint recorded by its last successful run (json_data/temp/pipeline_state.json)
+the stage is skipped. Stages that do not depend on each other run in parallel.
+
+Fetch stages have no input files (they read from the stores) so they always run when selected. Selecting a stage also
+selects the export and index stages downstream of it, which only run if their inputs actually changed.
+
+Usage (from the repository root):
+    python pipeline.py                      # default_targets
+    python pipeline.py prices               # Steam and store prices, then whatever they changed
+    python pipeline.py reindex-games        # export and rebuild the games index even if nothing changed
+    python pipeline.py export index         # export and index whatever changed since the last run
+    python pipeline.py details --reprocess  # rebuild the Steam details offline from the appdetails cache
+    python pipeline.py store_prices --resume  # finish an interrupted crawl without crawling again what it priced
+    python pipeline.py --list
+"""
+import argparse
+import fcntl
+import hashlib
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import main
+from main import logger, get_time, read_json, write_json
+
+steam_catalog_ids = [10, 311210, 1174180, 377160, 552520, 2344520, 1985820, 1091500, 214490, 1002300, 1245620, 646270, 235600, 1888930, 1716740, 268910, 3180070, 1716740, 668580, 202970, 235600, 1771300, 1085660, 2767030, 578080, 1962663, 1665460, 440, 570, 224880, 17390] # TEST
+#steam_catalog_ids = None # Full catalog
+store_prices_stores = ("epic", "xbox", "battle", "gog")
+steam_details_source = 'steam' # 'steam' (appdetails API) or 'cache' (offline, see main.reprocess_steam_details)
+default_targets = ["steam"]
+#default_targets = ["all"]
+pipeline_workers = 4
+search_backend = 'elasticsearch' # 'elasticsearch', 'embedded' (json_data/games_search.bin, see embedded_search.py) or 'both'
+state_filename = os.path.join("temp", "pipeline_state.json")
+lock_filename = os.path.join("json_data", "temp", "pipeline.lock")
+
+
+def fetch_steam_catalog():
+    if steam_catalog_ids:
+        return main.fetch_steam_catalog_by_ids(steam_catalog_ids)
+    return main.fetch_steam_catalog()
+
+def fetch_steam_details():
+    if steam_details_source == 'cache':
+        return main.reprocess_steam_details()
+    return main.fetch_steam_details()
+
+def fetch_store_prices():
+    return main.fetch_store_prices(store_prices_stores)
+
+
+# Stages:
+# - run: function without arguments; it fails by raising or by returning False (errors it only logged), and a failed
+#   stage records no fingerprint, so it runs again next time. A Steam fetch stopped by the rate limits is not a failure:
+#   its stages have no inputs, so they always run and carry on from where the last run stopped
+# - after: stages that must end before this one (when both are selected); selecting them also selects this one
+# - wait_for: stages that must end before this one (when both are selected), without selecting it
+# - inputs: files (relative to parent_path) fingerprinted to decide whether the stage can be skipped
+# - updates_inputs: the stage writes some of its inputs, so the fingerprint is recorded after it runs
+# - main_thread: the stage cannot run in a worker thread (Scrapy installs signal handlers)
+STAGES = {
+    # Fetch
+    "steam_catalog": {"kind": "fetch", "run": fetch_steam_catalog, "after": [], "inputs": []},
+    "steam_details": {"kind": "fetch", "run": fetch_steam_details, "after": ["steam_catalog"], "inputs": []},
+    "steam_prices": {"kind": "fetch", "run": main.fetch_steam_prices, "after": ["steam_details"], "inputs": []},
+    # Fetch and merge (see main.fetch_store_prices)
+    "store_prices": {"kind": "fetch", "run": fetch_store_prices, "after": ["steam_details", "steam_prices"], "inputs": [], "main_thread": True},
+    # Analytics (rewrites games.json, so its fingerprint is taken again after running)
+    "deals": {"kind": "analytics", "run": main.update_deals, "after": ["steam_details", "steam_prices", "store_prices"], "inputs": ["json_data/games.json", "json_data/prices_history.bin"], "updates_inputs": True},
+    # Export
+    # Price-only changes reach the games index as partial updates (games_prices_*), not as a full rebuild
+    "games_ndjson": {"kind": "export", "run": lambda: main.games_to_ndjson("games_bulk.ndjson"), "after": ["steam_details"], "wait_for": ["steam_prices", "store_prices", "deals"], "inputs": ["json_data/games.json"]},
+    "game_details_ndjson": {"kind": "export", "run": lambda: main.game_details_to_ndjson("game_details_bulk.ndjson"), "after": ["steam_details"], "wait_for": ["steam_prices", "store_prices", "deals"], "inputs": ["json_data/games.json"]},
+    "autocomplete_ndjson": {"kind": "export", "run": lambda: main.autocomplete_to_ndjson("autocomplete_bulk.ndjson"), "after": ["steam_details"], "wait_for": ["steam_prices", "store_prices", "deals"], "inputs": ["json_data/games.json", "json_data/temp/autocomplete_index.json"]},
+    "games_prices_ndjson": {"kind": "export", "run": lambda: main.games_prices_to_ndjson("games_prices_bulk.ndjson"), "after": ["steam_prices", "store_prices", "deals"], "wait_for": ["games_index"], "inputs": ["json_data/games.json", "json_data/temp/games_index_prices.json"]},
+    "categories_ndjson": {"kind": "export", "run": lambda: main.taxonomy_to_ndjson("categories", "categories_bulk.ndjson"), "after": ["steam_details"], "inputs": ["json_data/taxonomies.json"]},
+    "genres_ndjson": {"kind": "export", "run": lambda: main.taxonomy_to_ndjson("genres", "genres_bulk.ndjson"), "after": ["steam_details"], "inputs": ["json_data/taxonomies.json"]},
+    "developers_ndjson": {"kind": "export", "run": lambda: main.taxonomy_to_ndjson("developers", "developers_bulk.ndjson"), "after": ["steam_details"], "inputs": ["json_data/taxonomies.json"]},
+    "publishers_ndjson": {"kind": "export", "run": lambda: main.taxonomy_to_ndjson("publishers", "publishers_bulk.ndjson"), "after": ["steam_details"], "inputs": ["json_data/taxonomies.json"]},
+    "pegi_ndjson": {"kind": "export", "run": lambda: main.taxonomy_to_ndjson("pegi", "pegi_bulk.ndjson"), "after": ["steam_details"], "inputs": ["json_data/taxonomies.json"]},
+    "price_events_ndjson": {"kind": "export", "run": lambda: main.price_events_to_ndjson("price_events_bulk.ndjson"), "after": ["steam_details", "steam_prices", "store_prices"], "inputs": ["json_data/prices_history.bin"]},
+    # Index
+    "games_index": {"kind": "index", "run": main.post_games_index, "after": ["games_ndjson"], "inputs": ["ndjson_data/games_bulk.ndjson"]},
+    "game_details_index": {"kind": "index", "run": main.post_game_details_index, "after": ["game_details_ndjson"], "inputs": ["ndjson_data/game_details_bulk.ndjson"]},
+    "autocomplete_index": {"kind": "index", "run": main.post_autocomplete_index, "after": ["autocomplete_ndjson"], "inputs": ["ndjson_data/autocomplete_bulk.ndjson"]},
+    "games_prices_index": {"kind": "index", "run": main.post_games_prices_index, "after": ["games_prices_ndjson"], "inputs": ["ndjson_data/games_prices_bulk.ndjson"]},
+    "categories_index": {"kind": "index", "run": main.post_categories_index, "after": ["categories_ndjson"], "inputs": ["ndjson_data/categories_bulk.ndjson"]},
+    "genres_index": {"kind": "index", "run": main.post_genres_index, "after": ["genres_ndjson"], "inputs": ["ndjson_data/genres_bulk.ndjson"]},
+    "developers_index": {"kind": "index", "run": main.post_developers_index, "after": ["developers_ndjson"], "inputs": ["ndjson_data/developers_bulk.ndjson"]},
+    "publishers_index": {"kind": "index", "run": main.post_publishers_index, "after": ["publishers_ndjson"], "inputs": ["ndjson_data/publishers_bulk.ndjson"]},
+    "pegi_index": {"kind": "index", "run": main.post_pegi_index, "after": ["pegi_ndjson"], "inputs": ["ndjson_data/pegi_bulk.ndjson"]},
+    # Append-only: only the events exported since the last run (see main.post_price_events_index)
+    "price_events_index": {"kind": "index", "run": main.post_price_events_index, "after": ["price_events_ndjson"], "inputs": ["ndjson_data/price_events_bulk.ndjson"]},
+}
+
+# Embedded search (see main.build_games_search_file): rebuilt after every change of games.json, prices included
+if search_backend in ("embedded", "both"):
+    STAGES["games_search"] = {"kind": "index", "run": main.build_games_search_file, "after": ["steam_details", "steam_prices", "store_prices", "deals"], "inputs": ["json_data/games.json"]}
+if search_backend == "embedded":
+    for name in [name for name, stage in STAGES.items() if stage["kind"] == "index" and name != "games_search"]:
+        del STAGES[name]
+    # Exports only read by the ES index stages
+    for name in [name for name, stage in STAGES.items() if stage["kind"] == "export" and not any(name in other["after"] for other in STAGES.values())]:
+        del STAGES[name]
+
+# Named subsets of stages for the CLI (downstream stages are added by select_stages)
+GROUPS = {
+    "all": ["steam_catalog", "steam_details", "steam_prices", "store_prices"],
+    "steam": ["steam_catalog", "steam_details"],
+    "details": ["steam_details"],
+    "prices": ["steam_prices", "store_prices"],
+    "deals": ["deals"],
+    "export": [name for name, stage in STAGES.items() if stage["kind"] == "export"],
+    "index": [name for name, stage in STAGES.items() if stage["kind"] == "index"],
+}
+
+
+def get_downstream(name):
+    """
+    :param name: stage name
+    :return: export and index stages that (transitively) run after the stage
+    """
+    downstream = set()
+    pending = [name]
+    while pending:
+        current = pending.pop()
+        for other, stage in STAGES.items():
+            if current in stage["after"] and stage["kind"] != "fetch" and other not in downstream:
+                downstream.add(other)
+                pending.append(other)
+    return downstream
+
+def select_stages(targets):
+    """
+    :param targets: stage names, group names (see GROUPS) or "reindex-<index>" (e.g. "reindex-games")
+    :return: (selected stages, stages to run even if their inputs did not change)
+    """
+    selected, forced = set(), set()
+    for target in targets:
+        if target.startswith("reindex-"):
+            index_name = target[len("reindex-"):]
+            if f"{index_name}_index" not in STAGES:
+                raise ValueError(f'Unknown index {index_name}')
+            forced.update([f"{index_name}_ndjson", f"{index_name}_index"])
+            selected.update([f"{index_name}_ndjson", f"{index_name}_index"])
+        elif target in GROUPS:
+            selected.update(GROUPS[target])
+        elif target in STAGES:
+            selected.add(target)
+        else:
+            raise ValueError(f'Unknown stage or group {target}')
+
+    for name in list(selected):
+        selected.update(get_downstream(name))
+    return selected, forced
+
+def get_fingerprint(inputs):
+    """
+    :param inputs: files relative to parent_path
+    :return: sha1 of the contents of every file (missing files count as empty)
+    """
+    fingerprint = hashlib.sha1()
+    for file in inputs:
+        fingerprint.update(file.encode("utf-8"))
+        file_path = os.path.join(main.parent_path, file)
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    fingerprint.update(block)
+    return fingerprint.hexdigest()
+
+def acquire_lock():
+    """
+    Lock shared by the cron runs and the daemon (see daemon.py), so two runs never write the same files at once.
+    :return: the open lock file (keep it until release_lock), or None if another run holds it
+    """
+    lock_file = open(os.path.join(main.parent_path, lock_filename), "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    return lock_file
+
+def release_lock(lock_file):
+    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+def run_stage(name, state, forced):
+    """
+    :return: (status, fingerprint), status being "done" or "skipped"
+    """
+    stage = STAGES[name]
+    fingerprint = None
+    if stage["inputs"]:
+        fingerprint = get_fingerprint(stage["inputs"])
+        if name not in forced and state.get(name, {}).get("fingerprint") == fingerprint:
+            logger('INFO', f'Stage {name}: inputs unchanged, skipped')
+            return "skipped", fingerprint
+
+    logger('INFO', f'Stage {name}: started')
+    if stage["run"]() is False:
+        raise RuntimeError(f'Stage {name} reported a failure (see the errors above)')
+    if stage.get("updates_inputs"):
+        fingerprint = get_fingerprint(stage["inputs"])
+    logger('INFO', f'Stage {name}: ended')
+    return "done", fingerprint
+
+def run_pipeline(targets, force=False):
+    """
+    Runs the selected stages in dependency order, in parallel when possible.
+    :param targets: see select_stages
+    :param force: run every selected stage even if its inputs did not change
+    :return: {stage: "done" | "skipped" | "failed" | "blocked"}
+    """
+    selected, forced = select_stages(targets)
+    if force:
+        forced = set(selected)
+    state = read_json(state_filename) or {}
+    results = {}
+    running = {}
+
+    logger('INFO', f'Pipeline: {", ".join(name for name in STAGES if name in selected)}')
+    with ThreadPoolExecutor(max_workers=pipeline_workers) as executor:
+        while len(results) < len(selected):
+            for name in STAGES:
+                if name not in selected or name in results or name in running.values():
+                    continue
+                dependencies = [dependency for dependency in STAGES[name]["after"] + STAGES[name].get("wait_for", []) if dependency in selected]
+                if any(results.get(dependency) in ("failed", "blocked") for dependency in dependencies):
+                    logger('ERROR', f'Stage {name}: blocked by a failed stage')
+                    results[name] = "blocked"
+                    continue
+                if not all(dependency in results for dependency in dependencies):
+                    continue
+
+                if STAGES[name].get("main_thread"):
+                    # Blocks the scheduling until it ends, the stages already submitted keep running
+                    try:
+                        results[name], fingerprint = run_stage(name, state, forced)
+                        state[name] = {"fingerprint": fingerprint, "time": get_time()}
+                        write_json(state_filename, state)
+                    except:
+                        logger('ERROR', f'Stage {name}: {traceback.format_exc()}')
+                        results[name] = "failed"
+                else:
+                    running[executor.submit(run_stage, name, state, forced)] = name
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    results[name], fingerprint = future.result()
+                    state[name] = {"fingerprint": fingerprint, "time": get_time()}
+                    write_json(state_filename, state)
+                except:
+                    logger('ERROR', f'Stage {name}: {traceback.format_exc()}')
+                    results[name] = "failed"
+
+    logger('INFO', 'Pipeline ended: ' + ", ".join(f'{name} {results[name]}' for name in STAGES if name in results))
+    return results
+
+def list_stages():
+    for name, stage in STAGES.items():
+        after = ", ".join(stage["after"]) or "-"
+        print(f"{name:<24}{stage['kind']:<8}after: {after}")
+    for group, names in GROUPS.items():
+        print(f"{group:<24}group   {', '.join(names)}")
+
+def run():
+    parser = argparse.ArgumentParser(description="theEasterEgg scraper pipeline")
+    parser.add_argument("targets", nargs="*", help="stages, groups or reindex-<index> (default: default_targets)")
+    parser.add_argument("--force", action="store_true", help="run the selected stages even if their inputs did not change")
+    parser.add_argument("--stores", nargs="+", help="stores of the store_prices stage (epic, xbox, battle, gog)")
+    parser.add_argument("--resume", action="store_true", help="keep the prices of an interrupted crawl and only crawl the rest")
+    parser.add_argument("--reprocess", action="store_true", help="rebuild the Steam details from the appdetails cache instead of fetching them")
+    parser.add_argument("--list", action="store_true", help="list the stages and groups")
+    args = parser.parse_args()
+
+    if args.list:
+        list_stages()
+        return
+
+    global store_prices_stores, steam_details_source
+    if args.stores:
+        store_prices_stores = tuple(args.stores)
+    if args.reprocess:
+        steam_details_source = 'cache'
+    if args.resume:
+        main.crawl_resume = True
+
+    main.initialize()
+    lock_file = acquire_lock()
+    if lock_file is None:
+        logger('INFO', 'Another run is in progress, exiting')
+        return
+
+    try:
+        run_pipeline(args.targets or default_targets, force=args.force)
+        #main.finalize()
+    except:
+        #main.finalize(traceback.format_exc())
+        logger('ERROR', traceback.format_exc())
+    finally:
+        release_lock(lock_file)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,125 @@
+"""
+Deal metrics of every game, computed in one vectorized pass.
+
+The current price of every store (from games.json) and the extremes of the prices history (raw samples and every
+tier, see price_history.py) are loaded into [games, stores] NumPy arrays, and every metric is a column operation over
+them:
+- best_store / best_price_in_cents: cheapest store where the game is available now
+- historical_min_price_in_cents: lowest price ever recorded for the game in any store
+- historical_max_price_in_cents: highest price ever recorded in the best store (its regular price)
+- discount_percent: best price vs historical_max_price_in_cents
+- at_all_time_low: the best price is the lowest ever recorded
+"""
+import numpy as np
+
+from price_history import STORES, TIERS
+
+NO_PRICE = np.iinfo(np.int64).max
+CHUNK_ROWS = 16384
+
+
+def get_ring_buffer_extremes(min_column, max_column, count_column, rows):
+    """
+    Min and max of the used positions of every ring buffer of a group of columns, read CHUNK_ROWS rows at a time and in
+    the dtype of the columns, so no full-size temporary is ever built from the memory-mapped columns.
+    :return: (min, max) int64 arrays [rows] (NO_PRICE / -1 if empty)
+    """
+    mins = np.full(rows, NO_PRICE, dtype=np.int64)
+    maxs = np.full(rows, -1, dtype=np.int64)
+    if not rows:
+        return mins, maxs
+
+    # Ring buffers only wrap once full, so the used positions are always the first count ones
+    positions = np.arange(min_column.shape[1])
+    empty = np.iinfo(min_column.dtype).max
+    for start in range(0, rows, CHUNK_ROWS):
+        end = min(start + CHUNK_ROWS, rows)
+        used = positions < np.asarray(count_column[start:end])[:, None]
+        chunk_mins = np.where(used, min_column[start:end], empty).min(axis=1)
+        mins[start:end] = np.where(used[:, 0], chunk_mins, NO_PRICE)
+        maxs[start:end] = np.where(used, max_column[start:end], -1).max(axis=1)
+    return mins, maxs
+
+def get_slot_extremes(history, store):
+    """
+    :return: (min, max) int64 arrays [slots of the store] over every sample and tier bucket (NO_PRICE / -1 if empty)
+    """
+    slots = history.slots[store]
+    price = history.columns[f"{store}_price"]
+    mins, maxs = get_ring_buffer_extremes(price, price, history.columns[f"{store}_count"], slots)
+
+    # Only the slots that dropped samples have tiers (see PriceHistory.get_tier_slot)
+    tier_slots = np.asarray(history.columns[f"{store}_tier_slot"][:slots])
+    has_tiers = tier_slots >= 0
+    for tier in TIERS:
+        tier_mins, tier_maxs = get_ring_buffer_extremes(history.columns[f"{store}_{tier}_min"], history.columns[f"{store}_{tier}_max"],
+                                                        history.columns[f"{store}_{tier}_count"], history.slots[f"{store}_tiers"])
+        mins[has_tiers] = np.minimum(mins[has_tiers], tier_mins[tier_slots[has_tiers]])
+        maxs[has_tiers] = np.maximum(maxs[has_tiers], tier_maxs[tier_slots[has_tiers]])
+    return mins, maxs
+
+def get_current_prices(games):
+    """ :return: int64 array [games, stores] with the available prices (-1 where there is none) """
+    current = np.full((len(games), len(STORES)), -1, dtype=np.int64)
+    for i, game in enumerate(games):
+        for j, store in enumerate(STORES):
+            data = game.get("stores", {}).get(store)
+            if data and data["availability"] and data["price_in_cents"] is not None and data["price_in_cents"] >= 0:
+                current[i, j] = data["price_in_cents"]
+    return current
+
+def compute_deals(games, history):
+    """
+    :param games: games catalog
+    :param history: price_history.PriceHistory
+    :return: list with the deal metrics of every game (None values where it has no price)
+    """
+    count = len(games)
+    current = get_current_prices(games)
+    rows = np.array([history.rows.get(game["appid"], -1) for game in games], dtype=np.int64)
+
+    history_min = np.full((count, len(STORES)), NO_PRICE, dtype=np.int64)
+    history_max = np.full((count, len(STORES)), -1, dtype=np.int64)
+    for j, store in enumerate(STORES):
+        slot_mins, slot_maxs = get_slot_extremes(history, store)
+        slots = np.full(count, -1, dtype=np.int64)
+        in_history = rows >= 0
+        slots[in_history] = np.asarray(history.columns[f"{store}_slot"])[rows[in_history]]
+        has_slot = slots >= 0
+        history_min[has_slot, j] = slot_mins[slots[has_slot]]
+        history_max[has_slot, j] = slot_maxs[slots[has_slot]]
+
+    available = np.where(current >= 0, current, NO_PRICE)
+    best_store = available.argmin(axis=1)
+    best_price = available[np.arange(count), best_store]
+    has_price = best_price != NO_PRICE
+
+    regular_price = np.maximum(history_max[np.arange(count), best_store], np.where(has_price, best_price, -1))
+    discount = np.zeros(count, dtype=np.int64)
+    discounted = has_price & (regular_price > 0)
+    discount[discounted] = np.rint(100 * (regular_price[discounted] - best_price[discounted]) / regular_price[discounted])
+
+    lowest = np.minimum(history_min.min(axis=1), best_price)
+    at_all_time_low = has_price & (best_price <= lowest)
+
+    deals = []
+    for i in range(count):
+        if has_price[i]:
+            deals.append({
+                "best_store": STORES[best_store[i]],
+                "best_price_in_cents": int(best_price[i]),
+                "historical_min_price_in_cents": int(lowest[i]),
+                "historical_max_price_in_cents": int(regular_price[i]),
+                "discount_percent": int(discount[i]),
+                "at_all_time_low": bool(at_all_time_low[i])
+            })
+        else:
+            deals.append({
+                "best_store": None,
+                "best_price_in_cents": None,
+                "historical_min_price_in_cents": int(lowest[i]) if lowest[i] != NO_PRICE else None,
+                "historical_max_price_in_cents": None,
+                "discount_percent": None,
+                "at_all_time_low": False
+            })
+    return deals
@@ -0,0 +1,473 @@
+"""
+Columnar store of the prices history.
+
+Instead of one dict per price sample, every store keeps fixed-width NumPy columns (int32 prices, int64 times) with one
+row per app, used as ring buffers of history_limit samples. Appending is O(1) and the whole history is a handful of
+arrays.
+
+Only price changes are recorded: a sample is a run of the same price, from price_time (first seen) to last_seen.
+Seeing the same price again only moves last_seen, so history_limit counts actual price movements.
+
+Older prices are kept downsampled (see TIERS): a sample that leaves the ring buffer is folded into the min/max of its
+day and of its week, each in its own ring buffer, so long-range minimums stay available with a bounded size.
+
+The columns of a store are only allocated for the apps that ever had a price in it (<store>_slot), as most apps are
+only sold in a few stores, and the tier columns only for the slots that ever dropped a sample (<store>_tier_slot), as
+most apps never change price history_limit times.
+
+On disk it is a single binary file (json_data/prices_history.bin):
+    b"PHST" | uint32 header length | JSON header | columns
+The header lists the dtype, shape and offset (from the first 64 byte boundary after the header) of every column, and
+every column starts at a 64 byte boundary, so the file can be loaded with np.fromfile or memory-mapped with np.memmap
+(see PriceHistory.load).
+
+The JSON shape ([{"appid", "steam": [{"price_in_cents", "price_time", "last_seen"}, ...], "steam_daily": [...], ...}])
+is only built on demand, one app at a time (see PriceHistory.iter_entries). Every sample also gets a sequence number
+when it is recorded, so the price changes recorded since an export are exported as flat events for the append-only ES
+index (see PriceHistory.iter_events), whatever their price_time (e.g. crawled prices merged late).
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+STORES = ("steam", "epic", "xbox", "battle", "gog")
+MAGIC = b"PHST"
+VERSION = 4
+ALIGNMENT = 64
+DAY = 24 * 60 * 60
+
+# Downsampled tiers: bucket length, buckets kept, and age from which they are exported along with the raw samples
+TIERS = {
+    "daily": {"seconds": DAY, "capacity": 84, "export_after": 7 * DAY},
+    "weekly": {"seconds": 7 * DAY, "capacity": 53, "export_after": 90 * DAY},
+}
+TIER_FIELDS = {"key": np.int32, "min": np.int32, "max": np.int32}
+
+
+def align(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+class PriceHistory:
+    """
+    Prices history of every app and store:
+    - appids: int64 [apps]
+    - <store>_slot: int32 [apps], row of the app in the columns of the store (-1 if it never had a price there)
+    - <store>_price: int32 [slots, capacity], price in cents
+    - <store>_time: int64 [slots, capacity], unix time the price was first seen
+    - <store>_last_seen: int64 [slots, capacity], unix time the price was last seen
+    - <store>_sequence: int64 [slots, capacity], value of sequence when the sample was recorded
+    - <store>_head, <store>_count: int32 [slots], first sample and number of samples of every ring buffer
+    - <store>_tier_slot: int32 [slots], row of the slot in the tier columns of the store (-1 if it never dropped a sample)
+    - <store>_<tier>_key, _min, _max: int32 [tier slots, tier capacity], bucket number (time // bucket seconds) and prices
+    - <store>_<tier>_head, _count: int32 [tier slots]
+
+    slots holds the used rows of every group of columns: <store> (slots) and <store>_tiers (tier slots), and sequence
+    the number of samples ever recorded.
+    """
+
+    def __init__(self, capacity, stores=STORES):
+        self.capacity = capacity
+        self.stores = tuple(stores)
+        self.size = 0
+        self.sequence = 0
+        self.rows = {}
+        self.slots = {group: 0 for store in self.stores for group in (store, f"{store}_tiers")}
+        self.slot_columns = {}
+        self.columns = {"appids": np.zeros(0, dtype=np.int64)}
+        for store in self.stores:
+            self.columns[f"{store}_slot"] = np.zeros(0, dtype=np.int32)
+            self.add_slot_column(store, f"{store}_price", np.zeros((0, capacity), dtype=np.int32))
+            self.add_slot_column(store, f"{store}_time", np.zeros((0, capacity), dtype=np.int64))
+            self.add_slot_column(store, f"{store}_last_seen", np.zeros((0, capacity), dtype=np.int64))
+            self.add_slot_column(store, f"{store}_sequence", np.zeros((0, capacity), dtype=np.int64))
+            self.add_slot_column(store, f"{store}_head", np.zeros(0, dtype=np.int32))
+            self.add_slot_column(store, f"{store}_count", np.zeros(0, dtype=np.int32))
+            self.add_slot_column(store, f"{store}_tier_slot", np.zeros(0, dtype=np.int32))
+            for tier, settings in TIERS.items():
+                for field, dtype in TIER_FIELDS.items():
+                    self.add_slot_column(f"{store}_tiers", f"{store}_{tier}_{field}", np.zeros((0, settings["capacity"]), dtype=dtype))
+                self.add_slot_column(f"{store}_tiers", f"{store}_{tier}_head", np.zeros(0, dtype=np.int32))
+                self.add_slot_column(f"{store}_tiers", f"{store}_{tier}_count", np.zeros(0, dtype=np.int32))
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, appid):
+        return appid in self.rows
+
+    def add_slot_column(self, group, name, column):
+        self.columns[name] = column
+        self.slot_columns[name] = group
+
+    def get_length(self, name):
+        """ :return: used rows of a column (apps, or slots of its group) """
+        if name in self.slot_columns:
+            return self.slots[self.slot_columns[name]]
+        return self.size
+
+    def grow(self, rows, group=None):
+        """
+        Reallocates the app columns (or the columns of a group, see slots) with room for rows (at least), keeping the
+        used ones.
+        """
+        names = [name for name in self.columns if self.slot_columns.get(name) == group]
+        rows = max(rows, 2 * len(self.columns[names[0]]), 1024)
+        for name in names:
+            column = self.columns[name]
+            new_column = np.zeros((rows,) + column.shape[1:], dtype=column.dtype)
+            if name.endswith("_slot"):
+                new_column[:] = -1
+            length = self.get_length(name)
+            new_column[:length] = column[:length]
+            self.columns[name] = new_column
+
+    def add_app(self, appid):
+        """
+        :param appid:
+        :return: row of the app (new or existing)
+        """
+        if appid in self.rows:
+            return self.rows[appid]
+        if self.size == len(self.columns["appids"]):
+            self.grow(self.size + 1)
+
+        row = self.size
+        self.columns["appids"][row] = appid
+        self.rows[appid] = row
+        self.size += 1
+        return row
+
+    def get_slot(self, row, store):
+        """ :return: slot of the app in the columns of the store, allocated on first use """
+        slot = int(self.columns[f"{store}_slot"][row])
+        if slot == -1:
+            slot = self.slots[store]
+            if slot == len(self.columns[f"{store}_price"]):
+                self.grow(slot + 1, store)
+            self.slots[store] += 1
+            self.columns[f"{store}_slot"][row] = slot
+        return slot
+
+    def get_tier_slot(self, store, slot):
+        """ :return: row of a slot in the tier columns of the store, allocated on first use """
+        tier_slot = int(self.columns[f"{store}_tier_slot"][slot])
+        if tier_slot == -1:
+            group = f"{store}_tiers"
+            tier_slot = self.slots[group]
+            if tier_slot == len(self.columns[f"{store}_{next(iter(TIERS))}_head"]):
+                self.grow(tier_slot + 1, group)
+            self.slots[group] += 1
+            self.columns[f"{store}_tier_slot"][slot] = tier_slot
+        return tier_slot
+
+    def fold(self, store, slot, tier, price_in_cents, price_time):
+        """
+        Adds a price to the min/max of its bucket in a tier, starting a new bucket (and dropping the oldest one if
+        the ring buffer is full) when the bucket changes.
+        :param slot: row in the tier columns of the store (see get_tier_slot)
+        """
+        settings = TIERS[tier]
+        keys = self.columns[f"{store}_{tier}_key"]
+        mins = self.columns[f"{store}_{tier}_min"]
+        maxs = self.columns[f"{store}_{tier}_max"]
+        head = self.columns[f"{store}_{tier}_head"]
+        count = self.columns[f"{store}_{tier}_count"]
+        capacity = settings["capacity"]
+        key = price_time // settings["seconds"]
+
+        if count[slot] > 0:
+            last = (head[slot] + count[slot] - 1) % capacity
+            if keys[slot, last] >= key:
+                # Current bucket, or a late price for one of the kept buckets
+                for i in range(count[slot] - 1, -1, -1):
+                    position = (head[slot] + i) % capacity
+                    if keys[slot, position] == key:
+                        mins[slot, position] = min(mins[slot, position], price_in_cents)
+                        maxs[slot, position] = max(maxs[slot, position], price_in_cents)
+                        return
+                    if keys[slot, position] < key:
+                        return
+                return
+
+        if count[slot] < capacity:
+            position = (head[slot] + count[slot]) % capacity
+            count[slot] += 1
+        else:
+            position = head[slot]
+            head[slot] = (head[slot] + 1) % capacity
+        keys[slot, position] = key
+        mins[slot, position] = price_in_cents
+        maxs[slot, position] = price_in_cents
+
+    def fold_sample(self, store, slot, price_in_cents, price_time, last_seen):
+        """ Keeps a sample that leaves the ring buffer in every tier, from the first to the last time it was seen """
+        tier_slot = self.get_tier_slot(store, slot)
+        for tier in TIERS:
+            self.fold(store, tier_slot, tier, price_in_cents, price_time)
+            if last_seen != price_time:
+                self.fold(store, tier_slot, tier, price_in_cents, last_seen)
+
+    def append(self, appid, store, price_in_cents, price_time, last_seen=None):
+        """
+        Records a price seen at price_time. If it is the last recorded price of the app and store, only its last_seen
+        moves; otherwise a new sample starts, overwriting the oldest one if the ring buffer is full (the oldest one is
+        then folded into the tiers).
+        :param last_seen: end of the run, if already known (defaults to price_time)
+        :return: False if the app is not in the history
+        """
+        row = self.rows.get(appid)
+        if row is None:
+            return False
+        if last_seen is None:
+            last_seen = price_time
+
+        slot = self.get_slot(row, store)
+        head = self.columns[f"{store}_head"]
+        count = self.columns[f"{store}_count"]
+        if count[slot] > 0:
+            last = (head[slot] + count[slot] - 1) % self.capacity
+            if self.columns[f"{store}_price"][slot, last] == price_in_cents:
+                self.columns[f"{store}_last_seen"][slot, last] = max(self.columns[f"{store}_last_seen"][slot, last], last_seen)
+                return True
+
+        if count[slot] < self.capacity:
+            position = (head[slot] + count[slot]) % self.capacity
+            count[slot] += 1
+        else:
+            position = head[slot]
+            head[slot] = (head[slot] + 1) % self.capacity
+            self.fold_sample(store, slot, int(self.columns[f"{store}_price"][slot, position]),
+                             int(self.columns[f"{store}_time"][slot, position]), int(self.columns[f"{store}_last_seen"][slot, position]))
+        self.columns[f"{store}_price"][slot, position] = price_in_cents
+        self.columns[f"{store}_time"][slot, position] = price_time
+        self.columns[f"{store}_last_seen"][slot, position] = last_seen
+        self.sequence += 1
+        self.columns[f"{store}_sequence"][slot, position] = self.sequence
+        return True
+
+    def get_positions(self, slot, store):
+        """ :return: positions of the samples of a ring buffer, oldest first """
+        head = int(self.columns[f"{store}_head"][slot])
+        count = int(self.columns[f"{store}_count"][slot])
+        return (head + np.arange(count)) % self.capacity
+
+    def get(self, appid, store):
+        """
+        :return: samples of the app and store, oldest first, as [{"price_in_cents", "price_time", "last_seen"}]
+        """
+        row = self.rows.get(appid)
+        if row is None or self.columns[f"{store}_slot"][row] == -1:
+            return []
+        slot = int(self.columns[f"{store}_slot"][row])
+        positions = self.get_positions(slot, store)
+        prices = self.columns[f"{store}_price"][slot, positions].tolist()
+        times = self.columns[f"{store}_time"][slot, positions].tolist()
+        last_seen = self.columns[f"{store}_last_seen"][slot, positions].tolist()
+        return [{"price_in_cents": price, "price_time": time, "last_seen": seen} for price, time, seen in zip(prices, times, last_seen)]
+
+    def get_tier(self, appid, store, tier, before=None):
+        """
+        :param before: only the buckets that end before this unix time
+        :return: buckets of the app and store in a tier, oldest first, as
+            [{"price_time" (start of the bucket), "min_price_in_cents", "max_price_in_cents"}]
+        """
+        row = self.rows.get(appid)
+        if row is None or self.columns[f"{store}_slot"][row] == -1:
+            return []
+        tier_slot = int(self.columns[f"{store}_tier_slot"][int(self.columns[f"{store}_slot"][row])])
+        if tier_slot == -1:
+            return []
+        settings = TIERS[tier]
+        head = int(self.columns[f"{store}_{tier}_head"][tier_slot])
+        count = int(self.columns[f"{store}_{tier}_count"][tier_slot])
+        positions = (head + np.arange(count)) % settings["capacity"]
+
+        buckets = []
+        for key, min_price, max_price in zip(self.columns[f"{store}_{tier}_key"][tier_slot, positions].tolist(),
+                                             self.columns[f"{store}_{tier}_min"][tier_slot, positions].tolist(),
+                                             self.columns[f"{store}_{tier}_max"][tier_slot, positions].tolist()):
+            if before is not None and (key + 1) * settings["seconds"] > before:
+                break
+            buckets.append({"price_time": key * settings["seconds"], "min_price_in_cents": min_price, "max_price_in_cents": max_price})
+        return buckets
+
+    def get_min_price(self, appid, store, since):
+        """
+        :param since: unix time
+        :return: lowest price of the app in the store seen since then (from the raw samples and every tier), or None
+        """
+        prices = [sample["price_in_cents"] for sample in self.get(appid, store) if sample["last_seen"] >= since]
+        for tier, settings in TIERS.items():
+            prices.extend(bucket["min_price_in_cents"] for bucket in self.get_tier(appid, store, tier)
+                          if bucket["price_time"] + settings["seconds"] > since)
+        return min(prices) if prices else None
+
+    def get_entry(self, appid, now):
+        """
+        :param now: unix time the tiers are exported from (see TIERS export_after)
+        :return: history of the app in the JSON shape, {"appid", "steam": [...], "steam_daily": [...], ...}
+        """
+        entry = {"appid": appid}
+        for store in self.stores:
+            entry[store] = self.get(appid, store)
+            for tier, settings in TIERS.items():
+                entry[f"{store}_{tier}"] = self.get_tier(appid, store, tier, now - settings["export_after"])
+        return entry
+
+    def iter_entries(self, now):
+        """ Yields the history of every app in the JSON shape, one at a time """
+        for appid in self.columns["appids"][:self.size].tolist():
+            yield self.get_entry(appid, now)
+
+    def iter_events(self, since):
+        """
+        Yields the samples recorded after a sequence number (the price changes since then), oldest first within every
+        store.
+        :param since: sequence number, e.g. the sequence of the last export (0 for every sample kept)
+        :return: (appid, store, price_in_cents, price_time) tuples
+        """
+        appids = self.columns["appids"][:self.size]
+        for store in self.stores:
+            slots = self.slots[store]
+            if not slots:
+                continue
+            slot_column = np.asarray(self.columns[f"{store}_slot"][:self.size])
+            slot_appids = np.zeros(slots, dtype=np.int64)
+            slot_appids[slot_column[slot_column >= 0]] = appids[slot_column >= 0]
+
+            # Ring buffers only wrap once full, so the used positions are always the first count ones
+            times = np.asarray(self.columns[f"{store}_time"][:slots])
+            sequences = np.asarray(self.columns[f"{store}_sequence"][:slots])
+            used = np.arange(self.capacity) < np.asarray(self.columns[f"{store}_count"][:slots])[:, None]
+            event_slots, positions = np.nonzero(used & (sequences > since))
+            event_times = times[event_slots, positions]
+            order = np.argsort(event_times, kind="stable")
+            event_prices = self.columns[f"{store}_price"][event_slots[order], positions[order]]
+
+            for appid, price, time in zip(slot_appids[event_slots[order]].tolist(), event_prices.tolist(), event_times[order].tolist()):
+                yield appid, store, price, time
+
+    def write_json(self, file_path, now):
+        """ Writes the history in the prices_history.json shape, without building the whole list """
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write("[")
+            for i, entry in enumerate(self.iter_entries(now)):
+                f.write(("," if i else "") + "\n" + json.dumps(entry))
+            f.write("\n]\n")
+
+    def resize(self, capacity):
+        """
+        Changes the number of samples kept per app and store, keeping the newest ones (the dropped ones are folded
+        into the tiers).
+        :return: new PriceHistory
+        """
+        history = PriceHistory(capacity, self.stores)
+        history.rows = dict(self.rows)
+        history.size = self.size
+        history.sequence = self.sequence
+        history.slots = dict(self.slots)
+        samples = {f"{store}_{name}" for store in self.stores for name in ("price", "time", "last_seen", "sequence", "head", "count")}
+        for name, column in self.columns.items():
+            if name not in samples:
+                history.columns[name] = np.array(column[:self.get_length(name)])
+
+        for store in self.stores:
+            slots = self.slots[store]
+            history.columns[f"{store}_head"] = np.zeros(slots, dtype=np.int32)
+            history.columns[f"{store}_count"] = np.zeros(slots, dtype=np.int32)
+            for name in ("price", "time", "last_seen", "sequence"):
+                history.columns[f"{store}_{name}"] = np.zeros((slots, capacity), dtype=self.columns[f"{store}_{name}"].dtype)
+            for slot in range(slots):
+                positions = self.get_positions(slot, store)
+                for position in positions[:-capacity].tolist():
+                    history.fold_sample(store, slot, int(self.columns[f"{store}_price"][slot, position]),
+                                        int(self.columns[f"{store}_time"][slot, position]), int(self.columns[f"{store}_last_seen"][slot, position]))
+                positions = positions[-capacity:]
+                count = len(positions)
+                for name in ("price", "time", "last_seen", "sequence"):
+                    history.columns[f"{store}_{name}"][slot, :count] = self.columns[f"{store}_{name}"][slot, positions]
+                history.columns[f"{store}_count"][slot] = count
+        return history
+
+    def save(self, file_path):
+        """
+        Writes the binary file (to a temporary file first, so a crash never leaves a half-written history).
+        """
+        columns = [(name, np.ascontiguousarray(column[:self.get_length(name)])) for name, column in self.columns.items()]
+        header = {"version": VERSION, "capacity": self.capacity, "stores": list(self.stores), "apps": self.size,
+                  "sequence": self.sequence, "slots": self.slots, "columns": []}
+        offset = 0
+        for name, column in columns:
+            header["columns"].append({"name": name, "dtype": column.dtype.str, "shape": list(column.shape), "offset": offset})
+            offset += align(column.nbytes)
+        header_bytes = json.dumps(header).encode("utf-8")
+        data_start = align(len(MAGIC) + 4 + len(header_bytes))
+
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes)
+            for (name, column), column_header in zip(columns, header["columns"]):
+                f.seek(data_start + column_header["offset"])
+                f.write(column.tobytes())
+            f.truncate(data_start + offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path, capacity, mmap=False):
+        """
+        :param file_path: binary file written by save()
+        :param capacity: samples per app and store (the history is resized if the file has another capacity)
+        :param mmap: memory-map the columns read-only instead of reading them (for exports and analytics)
+        :return: PriceHistory, empty if the file does not exist
+        """
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            return cls(capacity)
+
+        with open(file_path, "rb") as f:
+            if f.read(4) != MAGIC:
+                raise ValueError(f"{file_path} is not a prices history file")
+            header_length = struct.unpack("<I", f.read(4))[0]
+            header = json.loads(f.read(header_length))
+        if header["version"] != VERSION:
+            raise ValueError(f"{file_path} has version {header['version']} of the prices history format, expected {VERSION}")
+        data_start = align(len(MAGIC) + 4 + header_length)
+
+        history = cls(header["capacity"], header["stores"])
+        for column_header in header["columns"]:
+            dtype = np.dtype(column_header["dtype"])
+            shape = tuple(column_header["shape"])
+            if mmap and shape[0] > 0:
+                column = np.memmap(file_path, dtype=dtype, mode="r", offset=data_start + column_header["offset"], shape=shape)
+            else:
+                with open(file_path, "rb") as f:
+                    f.seek(data_start + column_header["offset"])
+                    column = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+            history.columns[column_header["name"]] = column
+
+        history.size = header["apps"]
+        history.sequence = header["sequence"]
+        history.slots.update(header["slots"])
+        history.rows = {appid: row for row, appid in enumerate(history.columns["appids"].tolist())}
+        if history.capacity != capacity and not mmap:
+            history = history.resize(capacity)
+        return history
+
+    @classmethod
+    def from_entries(cls, entries, capacity):
+        """
+        :param entries: prices history in the JSON shape (last_seen is optional, repeated prices are collapsed)
+        :return: PriceHistory
+        """
+        history = cls(capacity)
+        history.grow(len(entries))
+        for entry in entries:
+            history.add_app(entry["appid"])
+            for store in history.stores:
+                for price in entry.get(store, []):
+                    history.append(entry["appid"], store, price["price_in_cents"], price["price_time"], price.get("last_seen"))
+        return history
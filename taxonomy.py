@@ -0,0 +1,105 @@
+"""
+Registry of the Steam taxonomies (genres, categories, developers, publishers and PEGI ratings).
+
+Every taxonomy is an insertion-ordered set of terms: a dict from term to id gives O(1) lookups, and the id of a term
+is its insertion position, so it never changes (it is the _id of the term in its ES index). Every term also counts the
+games that use it, kept up to date when a game is fetched again, so the taxonomy indexes can rank terms by popularity.
+
+Persisted as a single file (json_data/taxonomies.json):
+    {"genres": [{"name", "count"}, ...], "categories": [...], ...}
+with the terms in id order.
+"""
+import json
+import os
+
+TAXONOMIES = ("genres", "categories", "developers", "publishers", "pegi")
+
+
+class Taxonomy:
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.counts = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def add(self, name):
+        """ :return: id of the term (new or existing) """
+        term_id = self.ids.get(name)
+        if term_id is None:
+            term_id = len(self.names)
+            self.ids[name] = term_id
+            self.names.append(name)
+            self.counts.append(0)
+        return term_id
+
+    def count(self, name, delta):
+        """ Adds delta to the games using a term (added if new) """
+        term_id = self.add(name)
+        self.counts[term_id] = max(0, self.counts[term_id] + delta)
+
+    def to_list(self):
+        return [{"name": name, "count": count} for name, count in zip(self.names, self.counts)]
+
+
+class TaxonomyRegistry:
+    def __init__(self):
+        self.taxonomies = {kind: Taxonomy() for kind in TAXONOMIES}
+
+    def __getitem__(self, kind):
+        return self.taxonomies[kind]
+
+    def update_app(self, old_terms, new_terms):
+        """
+        Moves the usage counts of a game from its previous terms to the new ones.
+        :param old_terms: {taxonomy: terms} of the game before it was fetched again ({} if new)
+        :param new_terms: {taxonomy: terms} of the game now
+        """
+        for kind, taxonomy in self.taxonomies.items():
+            old = set(old_terms.get(kind, ()))
+            new = set(new_terms.get(kind, ()))
+            for name in old - new:
+                if name in taxonomy:
+                    taxonomy.count(name, -1)
+            # Terms are added in the order the game lists them, so ids follow the order they were first seen
+            for name in dict.fromkeys(new_terms.get(kind, ())):
+                if name not in old:
+                    taxonomy.count(name, 1)
+
+    def save(self, file_path):
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({kind: taxonomy.to_list() for kind, taxonomy in self.taxonomies.items()}, f, ensure_ascii=False)
+        os.replace(temp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        """ :return: TaxonomyRegistry, empty if the file does not exist """
+        registry = cls()
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            return registry
+        with open(file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for kind, taxonomy in registry.taxonomies.items():
+            for term in data.get(kind, []):
+                taxonomy.counts[taxonomy.add(term["name"])] = term["count"]
+        return registry
+
+    @classmethod
+    def from_lists(cls, lists, apps_terms):
+        """
+        Builds the registry from the old list files, keeping their order (and so the ids of their terms).
+        :param lists: {taxonomy: [terms]}
+        :param apps_terms: iterable of {taxonomy: terms} of every game, for the usage counts
+        """
+        registry = cls()
+        for kind, names in lists.items():
+            for name in names:
+                registry[kind].add(name)
+        for terms in apps_terms:
+            registry.update_app({}, terms)
+        return registry
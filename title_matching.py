@@ -0,0 +1,151 @@
+"""
+Fuzzy title matching between the games catalog and the stores.
+
+Titles are normalized first (symbols like ™/®, platform suffixes and roman numerals), so most variants end up with
+the same key and match in O(1). The rest go through blocking: candidates only come from the catalog titles that
+share one of the rarest words (or word prefixes) of the query, and each candidate is scored with the Dice
+coefficient of both trigram sets. That keeps the search near-linear instead of comparing every pair of titles.
+
+Numbers and edition words (see get_distinguishing_tokens) must match exactly: "Battlefield V" is not
+"Battlefield 1" and a Deluxe Edition is not the base game, however similar their trigrams are. Edition suffixes are
+never stripped for the same reason, only the ones that name the platform (and "Standard Edition").
+
+See benchmarks/bench_title_matching.py for precision, recall and runtime on a synthetic catalog.
+"""
+import re
+import unicodedata
+
+ROMAN_NUMERALS = {
+    "i": "1", "ii": "2", "iii": "3", "iv": "4", "v": "5", "vi": "6", "vii": "7", "viii": "8", "ix": "9", "x": "10",
+    "xi": "11", "xii": "12", "xiii": "13", "xiv": "14", "xv": "15", "xvi": "16", "xvii": "17", "xviii": "18",
+    "xix": "19", "xx": "20"
+}
+# Suffixes that do not change the product (its price is the one of the base game)
+PLATFORM_SUFFIX = re.compile(r"\s+(?:standard edition|pc edition|windows edition|for windows(?: 10)?|windows 10)$")
+EDITION_WORDS = {
+    "deluxe", "definitive", "complete", "ultimate", "gold", "premium", "enhanced", "special", "collector",
+    "collectors", "anniversary", "goty", "remastered", "remake"
+}
+
+
+def normalize_title(title):
+    """
+    :param title: title or url_name (hyphens are treated as spaces)
+    :return: matching key, e.g. "DOOM II: Hell on Earth™ - Deluxe Edition" -> "doom 2 hell on earth deluxe edition"
+    """
+    title = re.sub("[\u2122\u00ae\u00a9]", "", title)
+    title = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("ascii").lower()
+    title = title.replace("&", " and ").replace("'", "")
+    title = re.sub(r"[^a-z0-9]+", " ", title).strip()
+    title = re.sub(r"\bgame of the year\b", "goty", title)
+
+    previous = None
+    while previous != title:
+        previous = title
+        title = PLATFORM_SUFFIX.sub("", title)
+
+    return " ".join(ROMAN_NUMERALS.get(word, word) for word in title.split())
+
+
+def get_distinguishing_tokens(key):
+    """
+    Tokens of a normalized title that tell apart products with otherwise similar titles: numbers (sequels, years,
+    with the roman numerals already turned into digits) and edition words.
+    :return: tuple of tokens, in title order
+    """
+    return tuple(word for word in key.split() if word.isdigit() or word in EDITION_WORDS)
+
+
+def get_trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def get_blocking_keys(key):
+    """
+    Blocking keys of a normalized title: its words and, for long words, their 4 letter prefix (so a typo at the end
+    of a word still shares a key).
+    """
+    keys = set()
+    for word in key.split():
+        keys.add(word)
+        if len(word) > 4:
+            keys.add(word[:4] + "*")
+    return keys
+
+
+class TrigramIndex:
+    """
+    Maps normalized titles to values (e.g. catalog url_names) and finds the closest one for a query title.
+
+    Candidates only come from the rarest blocking keys of the query (see get_blocking_keys), must have the same
+    distinguishing tokens (see get_distinguishing_tokens) and are then scored with the Dice coefficient of both
+    trigram sets.
+    """
+    BLOCKS_PER_QUERY = 3
+
+    def __init__(self):
+        self.keys = []
+        self.values = []
+        self.sizes = []
+        self.tokens = []
+        self.exact = {}
+        self.blocks = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, title, value):
+        key = normalize_title(title)
+        if not key or key in self.exact:
+            return
+
+        position = len(self.keys)
+        self.exact[key] = position
+        self.keys.append(key)
+        self.values.append(value)
+        self.sizes.append(len(get_trigrams(key)))
+        self.tokens.append(get_distinguishing_tokens(key))
+        for block in get_blocking_keys(key):
+            self.blocks.setdefault(block, []).append(position)
+
+    def best_candidate(self, trigrams, tokens, blocks, min_score):
+        candidates = set()
+        for block in blocks[:self.BLOCKS_PER_QUERY]:
+            candidates.update(self.blocks[block])
+
+        size = len(trigrams)
+        # Dice >= min_score is impossible when the sizes are too far apart
+        min_size = min_score * size / (2 - min_score)
+        max_size = size * (2 - min_score) / min_score
+        best_value, best_score = None, 0
+        for candidate in candidates:
+            candidate_size = self.sizes[candidate]
+            if candidate_size < min_size or candidate_size > max_size or self.tokens[candidate] != tokens:
+                continue
+            score = 2 * len(trigrams & get_trigrams(self.keys[candidate])) / (size + candidate_size)
+            if score > best_score:
+                best_value, best_score = self.values[candidate], score
+        return best_value, best_score
+
+    def query(self, title, min_score=0.85):
+        """
+        :param title: title or url_name to look for
+        :param min_score: minimum Dice similarity (0-1) of the trigram sets
+        :return: (value, score) of the best match, or (None, 0)
+        """
+        key = normalize_title(title)
+        if not key:
+            return None, 0
+        if key in self.exact:
+            return self.values[self.exact[key]], 1.0
+
+        trigrams = get_trigrams(key)
+        blocks = [block for block in get_blocking_keys(key) if block in self.blocks]
+        blocks.sort(key=lambda block: len(self.blocks[block]))
+
+        best_value, best_score = self.best_candidate(trigrams, get_distinguishing_tokens(key), blocks, min_score)
+
+        if best_score >= min_score:
+            return best_value, best_score
+        return None, 0